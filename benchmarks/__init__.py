@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+""" twsqlparser のベンチマーク
+
+合成したSQLテンプレートについて、字句解析、SQL構築、ファイル読み込み、一連の処理の実行時間を計測する。
+実行方法は `python -m benchmarks --help` を参照。
+"""
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+""" ベンチマークの実行、比較
+
+ex:
+    python -m benchmarks run -o baseline.json
+    python -m benchmarks compare baseline.json             # 計測し、 baseline.json と比較する
+    python -m benchmarks compare baseline.json current.json
+    python -m benchmarks scaling                          # 入力の大きさに対して解析時間が線形に伸びるか確認する
+    python -m benchmarks threads                          # スレッド数を増やしても処理量が落ちないか確認する
+"""
+
+import argparse
+import json
+import sys
+
+from . import compare, runner, scaling, threads
+from .generator import SPECS
+
+
+def main(argv=None) -> int:
+    args = _parser().parse_args(argv)
+    return args.command(args)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='twsqlparser benchmarks')
+    commands = parser.add_subparsers(dest='command_name')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run benchmarks and write the results as JSON')
+    _add_run_arguments(run_parser)
+    run_parser.add_argument('-o', '--output', help='output JSON file (default: stdout)')
+    run_parser.set_defaults(command=_run_command)
+
+    cmp_parser = commands.add_parser('compare', help='compare results and flag regressions')
+    cmp_parser.add_argument('baseline', help='baseline JSON file')
+    cmp_parser.add_argument('current', nargs='?', help='current JSON file (default: run benchmarks now)')
+    cmp_parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown ratio (default: 0.1)')
+    cmp_parser.add_argument('--stat', choices=compare.STATS, default='min', help='statistic to compare')
+    _add_run_arguments(cmp_parser)
+    cmp_parser.set_defaults(command=_compare_command)
+
+    scale_parser = commands.add_parser('scaling', help='check that compile time grows linearly with input size')
+    scale_parser.add_argument('--limit', type=float, default=3.0,
+                              help='allowed ratio of the largest input to the fastest per-unit time (default: 3.0)')
+    scale_parser.add_argument('--quick', action='store_true', help='small inputs for smoke checks')
+    scale_parser.set_defaults(command=_scaling_command)
+
+    thread_parser = commands.add_parser('threads', help='check Engine throughput with multiple threads')
+    thread_parser.add_argument('--min-ratio', type=float, default=0.5,
+                               help='required throughput ratio of the most threads to one thread (default: 0.5)')
+    thread_parser.add_argument('--jobs', type=int, default=2000, help='parse_sql calls per thread count')
+    thread_parser.set_defaults(command=_threads_command)
+    return parser
+
+
+def _add_run_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-t', '--template', action='append', choices=sorted(SPECS), help='template (repeatable)')
+    parser.add_argument('-p', '--path', action='append', choices=runner.PATHS, help='measured path (repeatable)')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per repetition')
+    parser.add_argument('--startup-files', type=int, default=runner.STARTUP_FILES,
+                        help=f'SQL files loaded by the startup paths (default: {runner.STARTUP_FILES})')
+    parser.add_argument('--quick', action='store_true', help='short run for smoke checks')
+
+
+def _run(args) -> dict:
+    warmup, repeat, min_time = (0, 2, 0.01) if args.quick else (args.warmup, args.repeat, args.min_time)
+    return runner.run(args.template, args.path, warmup, repeat, min_time, report=_report,
+                      startup_files=args.startup_files)
+
+
+def _report(key: str, result: dict):
+    print(f'{key}: {result["min"] * 1e6:.2f} us (x{result["number"]})', file=sys.stderr)
+
+
+def _run_command(args) -> int:
+    results = _run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+def _compare_command(args) -> int:
+    baseline = _load(args.baseline)
+    current = _load(args.current) if args.current else _run(args)
+    comparisons = compare.compare(baseline, current, args.threshold, args.stat)
+    print(compare.format_table(comparisons, args.stat))
+    regressions = [c for c in comparisons if c.regressed]
+    if regressions:
+        print(f'{len(regressions)} regression(s) over {args.threshold:.0%}', file=sys.stderr)
+        return 1
+    return 0
+
+
+def _scaling_command(args) -> int:
+    per_byte = scaling.compile_per_byte(scaling.QUICK_SIZES if args.quick else scaling.SIZES)
+    per_param = scaling.compile_per_param(scaling.QUICK_PARAM_COUNTS if args.quick else scaling.PARAM_COUNTS)
+    ratios = []
+    for unit, per_unit in (('byte', per_byte), ('param', per_param)):
+        for size, sec in per_unit.items():
+            print(f'compile {size:>10} {unit}s: {sec * 1e9:.2f} ns/{unit}')
+        ratios.append(scaling.growth(per_unit))
+        print(f'growth per {unit}: {ratios[-1]:.2f}x (limit {args.limit:.2f}x)')
+    return 0 if max(ratios) <= args.limit else 1
+
+
+def _threads_command(args) -> int:
+    throughput = threads.engine_throughput(threads.WORKERS, args.jobs)
+    for count, per_sec in throughput.items():
+        print(f'{count} thread(s): {per_sec:.0f} calls/s')
+    ratio = throughput[max(throughput)] / throughput[min(throughput)]
+    print(f'ratio: {ratio:.2f}x (min {args.min_ratio:.2f}x)')
+    return 0 if args.min_ratio <= ratio else 1
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+from collections import namedtuple
+
+STATS = ('min', 'median', 'mean', 'peak_bytes')
+
+
+class Comparison(namedtuple('Comparison', ('key', 'baseline', 'current', 'ratio', 'regressed'))):
+    """ 1件の計測結果の比較
+
+    baseline, current は比較した統計値 (秒、 peak_bytes の場合はバイト) 、 ratio は current / baseline 。
+    regressed は ratio が閾値を超えた場合 True 。
+    """
+    __slots__ = ()
+
+
+def compare(baseline: dict, current: dict, threshold=0.1, stat='min') -> list:
+    """2つの計測結果を比較する
+
+    Args:
+        baseline (dict): 基準とする `runner.run` の結果
+        current (dict): 比較する `runner.run` の結果
+        threshold (float): 遅くなったとみなす割合 ex: 0.1 の場合、基準より10%を超えて遅い結果
+        stat (str): 比較する統計値 min, median, mean, peak_bytes のいずれか
+    Returns:
+        list: 両方に含まれる計測結果の Comparison
+    """
+    if stat not in STATS:
+        raise ValueError(f'stat must be one of {STATS}, but {stat!r}')
+    comparisons = []
+    base_results = baseline['results']
+    for key, result in current['results'].items():
+        base, cur = base_results.get(key, {}).get(stat), result.get(stat)
+        if base is None or cur is None:
+            continue
+        ratio = cur / base if base else float('inf')
+        comparisons.append(Comparison(key, base, cur, ratio, 1 + threshold < ratio))
+    return comparisons
+
+
+def format_table(comparisons: list, stat='min') -> str:
+    """比較結果を表形式の文字列にする stat は `compare` に指定した統計値"""
+    fmt = _fmt_bytes if stat == 'peak_bytes' else _fmt_sec
+    width = max((len(c.key) for c in comparisons), default=10)
+    lines = [f'{"benchmark":<{width}}  {"baseline":>12}  {"current":>12}  {"ratio":>7}']
+    for c in comparisons:
+        mark = '  REGRESSION' if c.regressed else ''
+        lines.append(f'{c.key:<{width}}  {fmt(c.baseline):>12}  {fmt(c.current):>12}  '
+                     f'{c.ratio:>6.2f}x{mark}')
+    return '\n'.join(lines)
+
+
+def _fmt_sec(sec: float) -> str:
+    if sec < 1e-3:
+        return f'{sec * 1e6:.2f} us'
+    if sec < 1:
+        return f'{sec * 1e3:.2f} ms'
+    return f'{sec:.3f} s'
+
+
+def _fmt_bytes(size: int) -> str:
+    if size < 1024 * 1024:
+        return f'{size / 1024:.1f} KiB'
+    return f'{size / 1024 / 1024:.1f} MiB'
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+from collections import namedtuple
+
+
+class TemplateSpec(namedtuple('TemplateSpec', ('size', 'depth', 'density', 'loop_length', 'branches', 'paired',
+                                               'payload'))):
+    """ 合成するテンプレートの形
+
+    size は最上位のブロック数、 depth は if/for の入れ子の深さ (0 の場合は if/for を含まず、パラメータを持つ行のみ並べる) 、
+    density は1行あたりのバインドパラメータ数、 loop_length は for でループする件数。
+    branches は if の分岐数 (2以上の場合は /*%elif*/ と /*%else*/ を続ける) 、
+    paired は分岐を互いに排他な条件の if を並べて書くかどうか。
+    payload は IN 句に渡すリストと、SQLで利用しない行データの件数 (0 の場合は追加しない) 。
+    """
+    __slots__ = ()
+
+
+TemplateSpec.__new__.__defaults__ = (1, False, 0)
+
+# ベンチマークで利用するテンプレートの形
+SPECS = {
+    'small': TemplateSpec(size=3, depth=1, density=1, loop_length=3),
+    'medium': TemplateSpec(size=30, depth=2, density=2, loop_length=5),
+    'large': TemplateSpec(size=300, depth=2, density=2, loop_length=5),
+    'deep': TemplateSpec(size=5, depth=5, density=1, loop_length=2),
+    'dense': TemplateSpec(size=30, depth=1, density=10, loop_length=3),
+    'long_loop': TemplateSpec(size=1, depth=2, density=2, loop_length=2000),
+    'switch': TemplateSpec(size=30, depth=1, density=2, loop_length=3, branches=5),
+    'switch_paired': TemplateSpec(size=30, depth=1, density=2, loop_length=3, branches=5, paired=True),
+    'static': TemplateSpec(size=300, depth=0, density=0, loop_length=0),
+    'params_only': TemplateSpec(size=300, depth=0, density=2, loop_length=0),
+    'large_payload': TemplateSpec(size=20, depth=2, density=1, loop_length=3, payload=50000),
+}
+
+
+def generate(spec: TemplateSpec) -> (str, dict):
+    """spec の形のSQLテンプレートと、全ての if/for を通るパラメータを作成する 分岐がある場合はいずれか1つを通る
+
+    同じ spec からは常に同じSQLとパラメータを作成する。
+
+    Args:
+        spec (TemplateSpec): テンプレートの形
+    Returns:
+        tuple(str, dict):
+            str: SQLテンプレート
+            dict: SQL実行時に利用するパラメータ
+    """
+    lines = ['select', '    t.id -- primary key', "  , 'literal' as \"name\"", '  from tbl t /* table */',
+             ' where 1 = 1']
+    params = {}
+    for block in range(spec.size):
+        if spec.depth:
+            _block(spec, f'b{block}', 1, lines, params)
+        else:
+            lines.append(_condition_line(spec, f'b{block}', '  ', params))
+    if spec.payload:
+        # パラメータのコピーにかかる時間とメモリ使用量を計測するため、大きなリストを渡す
+        params['ids'] = list(range(spec.payload))
+        params['rows'] = [{'id': i, 'name': f'name{i}'} for i in range(spec.payload)]
+        lines.append('   and id in /*:ids*/(1, 2)')
+    lines.append(';')
+    return '\n'.join(lines) + '\n', params
+
+
+def _block(spec: TemplateSpec, name: str, level: int, lines: list, params: dict):
+    # 奇数の階層は if 、偶数の階層は for とし、最も深い階層にパラメータを持つ行を置く
+    indent = '  ' * level
+    if level % 2:
+        _if_block(spec, name, level, lines, params)
+        return
+    params[f'{name}_list'] = list(range(spec.loop_length))
+    lines.append(f'{indent}/*%for {name}_v in {name}_list*/')
+    _block_body(spec, name, level, lines, params, for_var=f'{name}_v')
+    lines.append(f'{indent}/*end*/')
+
+
+def _if_block(spec: TemplateSpec, name: str, level: int, lines: list, params: dict):
+    indent = '  ' * level
+    if spec.branches <= 1:
+        params[f'{name}_flag'] = True
+        lines.append(f'{indent}/*%if {name}_flag*/')
+        _block_body(spec, name, level, lines, params)
+        lines.append(f'{indent}/*end*/')
+        return
+    # ブロックごとに通る分岐を変える paired によらず同じ分岐を通るよう、パラメータの件数から決める
+    params[f'{name}_sel'] = len(params) % spec.branches
+    for branch in range(spec.branches):
+        lines.append(f'{indent}{_branch_comment(spec, name, branch)}')
+        _block_body(spec, name, level, lines, params, branch=branch)
+        if spec.paired:
+            lines.append(f'{indent}/*end*/')
+    if not spec.paired:
+        lines.append(f'{indent}/*end*/')
+
+
+def _branch_comment(spec: TemplateSpec, name: str, branch: int) -> str:
+    last = spec.branches - 1
+    if spec.paired:
+        return f'/*%if {name}_sel == {branch}*/' if branch < last else f'/*%if {name}_sel >= {last}*/'
+    if branch == 0:
+        return f'/*%if {name}_sel == 0*/'
+    return f'/*%elif {name}_sel == {branch}*/' if branch < last else '/*%else*/'
+
+
+def _block_body(spec: TemplateSpec, name: str, level: int, lines: list, params: dict, for_var=None, branch=None):
+    if level < spec.depth:
+        _block(spec, f'{name}_{level}', level + 1, lines, params)
+    lines.append(_condition_line(spec, name, '  ' * level, params, for_var, branch))
+
+
+def _condition_line(spec: TemplateSpec, name: str, indent: str, params: dict, for_var=None, branch=None) -> str:
+    conditions = [] if branch is None else [f'kind = {branch}']
+    for i in range(spec.density):
+        pname = f'{name}_p{i}'
+        params[pname] = f'value{i}'
+        conditions.append(f"c{i} = /*:{pname}*/'dummy'")
+    if for_var is not None:
+        conditions.append(f'v = /*:{for_var}*/0')
+    return f"{indent}   and ({' and '.join(conditions) or '1 = 1'})"
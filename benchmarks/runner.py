@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import datetime
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import twsqlparser
+from twsqlparser import twsp
+
+from .generator import SPECS, generate
+
+# 計測対象の処理
+PATHS = ('parse', 'render', 'render_no_copy', 'render_cached', 'render_sparse', 'file_load', 'disk_cache_load',
+         'end_to_end', 'startup_cold', 'startup_disk_cache')
+# 起動時間の計測で SqlRegistry に読み込ませるファイル数 (デフォルト)
+STARTUP_FILES = 300
+_STARTUP_PATHS = frozenset(('startup_cold', 'startup_disk_cache'))
+
+
+def measure(func, warmup=1, repeat=5, min_time=0.2) -> dict:
+    """func の1回あたりの実行時間を計測する
+
+    1回の計測が min_time 秒以上になるよう実行回数を決め、 warmup 回の計測を捨てた後に repeat 回計測する。
+
+    Args:
+        func (callable): 計測する処理 引数なしで呼び出す
+        warmup (int): 結果に含めない計測の回数
+        repeat (int): 結果に含める計測の回数
+        min_time (float): 1回の計測の最小秒数
+    Returns:
+        dict: 1回あたりの秒数の min, median, mean, stdev と、 number (1回の計測の実行回数), repeat
+    """
+    number = _calibrate(func, min_time)
+    for _ in range(warmup):
+        _time(func, number)
+    times = [_time(func, number) / number for _ in range(max(repeat, 1))]
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if 1 < len(times) else 0.0, 'number': number, 'repeat': len(times)}
+
+
+def peak_memory(func) -> int:
+    """func を1回実行する間の最大メモリ使用量(バイト)を tracemalloc で求める 計測中の場合は None"""
+    if tracemalloc.is_tracing():
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _calibrate(func, min_time: float) -> int:
+    # timeit.Timer.autorange と同様に、実行回数を増やして min_time 秒以上かかる回数を求める
+    number = 1
+    while True:
+        if min_time <= _time(func, number) or 10 ** 7 <= number:
+            return number
+        number *= 2
+
+
+def _time(func, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def run(names=None, paths=None, warmup=1, repeat=5, min_time=0.2, report=None, startup_files=STARTUP_FILES) -> dict:
+    """合成したテンプレートごとに、各処理の実行時間を計測する
+
+    Args:
+        names (iterable): 計測するテンプレートの名前 None の場合は全て ex: ('small', 'large')
+        paths (iterable): 計測する処理 None の場合は全て ex: ('parse', 'render')
+        warmup (int): `measure` 参照
+        repeat (int): `measure` 参照
+        min_time (float): `measure` 参照
+        report (callable): 1件計測するごとに (名前, 結果) で呼び出す
+        startup_files (int): startup_cold, startup_disk_cache で読み込ませるSQLファイル数
+    Returns:
+        dict: JSONに変換できる計測結果 results のキーは "処理/テンプレート名"
+            各結果は `measure` の結果に、 peak_bytes (1回あたりの最大メモリ使用量) と sql_bytes を加えたもの
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in names or SPECS:
+            cases = _cases(name, tmp_dir, paths or PATHS, startup_files)
+            for path in paths or PATHS:
+                key = f'{path}/{name}'
+                results[key] = {**measure(cases[path], warmup, repeat, min_time),
+                                'peak_bytes': peak_memory(cases[path]), 'sql_bytes': cases['sql_bytes']}
+                if report is not None:
+                    report(key, results[key])
+    return {'meta': _meta(warmup, repeat, min_time, startup_files), 'results': results}
+
+
+def _cases(name: str, tmp_dir: str, paths, startup_files: int) -> dict:
+    sql, params = generate(SPECS[name])
+    file_path = os.path.join(tmp_dir, f'{name}.sql')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(sql)
+    template = twsp.compile(sql)
+    disk_cache = twsqlparser.DiskCache(os.path.join(tmp_dir, 'cache'))
+    disk_cache.load(file_path, 'utf-8', True, '\n')
+    render_cache = twsqlparser.RenderCache()
+    # 全ての if を偽とし、何も出力しない場合の構築時間を計測する
+    sparse = {key: False if key.endswith('_flag') else value for key, value in params.items()}
+
+    def file_load():
+        # キャッシュを利用せず、ファイルの読み込みから字句解析までを行う
+        twsp.file_cache.clear()
+        twsp._compile_cache.cache_clear()
+        twsp.compile_file(file_path)
+
+    cases = {
+        'parse': lambda: twsp.compile(sql),
+        'render': lambda: template.render(params),
+        'render_no_copy': lambda: template.render(params, copy_params=False),
+        'render_cached': lambda: template.render(params, render_cache=render_cache),
+        'render_sparse': lambda: template.render(sparse),
+        'file_load': file_load,
+        'disk_cache_load': lambda: disk_cache.load(file_path, 'utf-8', True, '\n'),
+        'end_to_end': lambda: twsp.parse_file(file_path, params),
+        'sql_bytes': len(sql.encode('utf-8')),
+    }
+    if _STARTUP_PATHS.intersection(paths):
+        cases.update(_startup_cases(name, sql, tmp_dir, startup_files))
+    return cases
+
+
+def _startup_cases(name: str, sql: str, tmp_dir: str, startup_files=STARTUP_FILES) -> dict:
+    # startup_files 件のSQLファイルを持つディレクトリを SqlRegistry で読み込む起動時間を、
+    # 全てコンパイルする場合と DiskCache に保存済みのテンプレートを読み込む場合で計測する
+    sql_dir = os.path.join(tmp_dir, f'{name}_startup')
+    cache_dir = os.path.join(tmp_dir, f'{name}_startup_cache')
+    for i in range(startup_files):
+        file_path = os.path.join(sql_dir, f'dir{i % 10}', f'query{i}.sql')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            # ファイルごとに内容を変え、 compile のキャッシュを利用しないようにする
+            f.write(f'-- query {i}\n{sql}')
+    twsqlparser.SqlRegistry(sql_dir, cache_dir=cache_dir)
+
+    def startup_cold():
+        twsp._compile_cache.cache_clear()
+        twsqlparser.SqlRegistry(sql_dir)
+
+    return {
+        'startup_cold': startup_cold,
+        'startup_disk_cache': lambda: twsqlparser.SqlRegistry(sql_dir, cache_dir=cache_dir),
+    }
+
+
+def _meta(warmup: int, repeat: int, min_time: float, startup_files: int) -> dict:
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'twsqlparser': twsqlparser.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'warmup': warmup,
+        'repeat': repeat,
+        'min_time': min_time,
+        'startup_files': startup_files,
+    }
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+""" 入力の大きさに対する字句解析時間の伸び
+
+SQLを大きくしても、1バイトあたりの解析時間がほぼ一定 (線形) であること、
+パラメータを増やしても、1パラメータあたりの解析時間がほぼ一定であることを確認する。
+"""
+
+import time
+
+from twsqlparser import twsp
+
+# 行コメント、クォート、通常コメント、if を含む集計SQLの1単位
+SCALE_UNIT = """\
+select c1, 'literal ''x''' as "alias", sum(c2) -- line comment
+  from tbl /* normal comment */
+ where 1 = 1
+  /*%if flag*/
+   and c3 in (1, 2, 3)
+  /*end*/
+union all
+"""
+# 計測するSQLのバイト数 10KB から 10MB まで
+SIZES = (10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+QUICK_SIZES = (10 ** 3, 10 ** 4, 10 ** 5)
+# 計測するSQLの行数 (1行に3個のパラメータを含む)
+PARAM_COUNTS = (500, 2000, 20000)
+QUICK_PARAM_COUNTS = (50, 200, 2000)
+
+
+def compile_per_byte(sizes=SIZES, budget=10 ** 6) -> dict:
+    """SQLのバイト数ごとに、 compile の1バイトあたりの秒数を求める
+
+    Args:
+        sizes (iterable): SQLのバイト数 SCALE_UNIT を繰り返して作成する
+        budget (int): バイト数ごとの計測回数を決める値 budget // バイト数 回 (1回以上) 計測し、最小値を採用する
+    Returns:
+        dict: {バイト数: 1バイトあたりの秒数}
+    """
+    per_byte = {}
+    for size in sizes:
+        sql = SCALE_UNIT * max(1, size // len(SCALE_UNIT))
+        elapsed = min(_compile_time(sql) for _ in range(max(1, budget // size)))
+        per_byte[size] = elapsed / len(sql)
+    return per_byte
+
+
+def compile_per_param(counts=PARAM_COUNTS, budget=20000) -> dict:
+    """パラメータの密度が高いSQLについて、パラメータ数ごとに compile の1パラメータあたりの秒数を求める
+
+    Args:
+        counts (iterable): SQLの行数 1行に /*:param*/ 2個、 /*$param*/ 1個を含む
+        budget (int): 行数ごとの計測回数を決める値 budget // 行数 回 (1回以上) 計測し、最小値を採用する
+    Returns:
+        dict: {パラメータ数: 1パラメータあたりの秒数}
+    """
+    per_param = {}
+    for count in counts:
+        values = ', '.join(f"(/*:c{i}*/'name', /*:n{i}*/123, /*$t{i}*/(0, 1))" for i in range(count))
+        sql = f'insert into tbl (c, n, t) values {values};'
+        elapsed = min(_compile_time(sql) for _ in range(max(1, budget // count)))
+        per_param[count * 3] = elapsed / (count * 3)
+    return per_param
+
+
+def growth(per_unit: dict) -> float:
+    """最大の入力の1単位あたりの秒数が、最も速い入力の何倍かを返す 線形の場合は 1 に近い"""
+    return per_unit[max(per_unit)] / min(per_unit.values())
+
+
+def _compile_time(sql: str) -> float:
+    start = time.perf_counter()
+    twsp.compile(sql)
+    return time.perf_counter() - start
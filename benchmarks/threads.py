@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+""" 複数スレッドから Engine を利用した場合の処理量
+
+Engine はロックで直列化していないため、スレッド数を増やしても全体の処理量が大きく落ちないことを確認する。
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from twsqlparser import Engine, ParamStyle
+
+BASE_SQL = """\
+select *
+  from tbl
+ where 1 = 1
+/*%if flag*/
+   and c1 = /*:c1*/'x'
+/*end*/
+/*%for v in vals*/
+   and c2 = /*:v*/0 -- comment
+/*end*/
+"""
+PARAMS = {'flag': True, 'c1': 'A', 'vals': [1, 2, 3]}
+# 計測するスレッド数 最初の値を基準とする
+WORKERS = (1, 4)
+
+
+def engine_throughput(workers=WORKERS, jobs=2000) -> dict:
+    """設定の異なる Engine で parse_sql を jobs 回実行し、スレッド数ごとの1秒あたりの処理件数を求める
+
+    Args:
+        workers (iterable): ThreadPoolExecutor のスレッド数
+        jobs (int): 実行する parse_sql の回数
+    Returns:
+        dict: {スレッド数: 1秒あたりの処理件数}
+    """
+    engines = [Engine(), Engine(newline='\r\n'), Engine(paramstyle=ParamStyle.PYFORMAT),
+               Engine(delete_comment=False, newline='\r\n', paramstyle=ParamStyle.PYFORMAT)]
+    tasks = [(engine, BASE_SQL.replace('\n', engine.newline)) for engine in engines] * max(1, jobs // len(engines))
+    throughput = {}
+    for count in workers:
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda task: task[0].parse_sql(task[1], PARAMS), tasks))
+            throughput[count] = len(tasks) / (time.perf_counter() - start)
+    return throughput
@@ -15,7 +15,7 @@ pg8000.paramstyle = 'named'
 def main():
     from .PG8000Con import PG8000Con
     loop = 50
-    methods = [twspsimpleinsert, simple_insert, twspmultiinsert, exec_many]
+    methods = [twspsimpleinsert, simple_insert, twspmultiinsert, exec_many, twsp_render_many]
     timemap = {}
     with PG8000Con(host='localhost', port=5432, user='postgres', password='password', database='postgres') as conn:
         for mthd in [*methods, *(reversed(methods))]:
@@ -91,5 +91,22 @@ def exec_many(loop: int, conn):
     return msec
 
 
+def twsp_render_many(loop: int, conn):
+    cur = conn.cursor()
+    start = datetime.datetime.now().timestamp()
+    template = twsp.compile("insert into sample_lang (name) values ( /*:name*/'hoge' );")
+    for _ in range(loop):
+        cur.execute('truncate table sample_lang')
+        names = ['C', 'D', 'F#', 'Go', 'KQ']
+        params = ({'name': name} for name in names)
+        for sql, exec_params in twsp.render_many(template, params):
+            cur.executemany(sql, exec_params)
+    end = datetime.datetime.now().timestamp()
+    conn.commit()
+    msec = end - start
+    print(f'twsp_render_many: {msec}')
+    return msec
+
+
 if __name__ == '__main__':
     main()
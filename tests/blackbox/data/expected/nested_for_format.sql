@@ -0,0 +1,15 @@
+select * from xxx
+where 1 = 1
+  and current_loop_is = 0
+    and nested_0 = 0
+    and nested_1 = 0
+  and current_loop_is = 1
+    and nested_0 = 1
+    and nested_1 = 1
+  and current_loop_is = 0
+    and nested_0 = %s
+    and nested_1 = %s
+  and current_loop_is = 1
+    and nested_0 = %s
+    and nested_1 = %s
+;
\ No newline at end of file
@@ -7,9 +7,9 @@ where 1 = 1
     and nested_0 = 1
     and nested_1 = 1
   and current_loop_is = 0
-    and nested_0 = :xxxxx4_0_x
-    and nested_1 = :xxxxx4_0_x
+    and nested_0 = :xxxxx3_0_x
+    and nested_1 = :xxxxx3_0_x
   and current_loop_is = 1
-    and nested_0 = :xxxxx4_1_x
-    and nested_1 = :xxxxx4_1_x
+    and nested_0 = :xxxxx3_1_x
+    and nested_1 = :xxxxx3_1_x
 ;
\ No newline at end of file
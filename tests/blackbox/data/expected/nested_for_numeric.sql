@@ -0,0 +1,15 @@
+select * from xxx
+where 1 = 1
+  and current_loop_is = 0
+    and nested_0 = 0
+    and nested_1 = 0
+  and current_loop_is = 1
+    and nested_0 = 1
+    and nested_1 = 1
+  and current_loop_is = 0
+    and nested_0 = :1
+    and nested_1 = :2
+  and current_loop_is = 1
+    and nested_0 = :3
+    and nested_1 = :4
+;
\ No newline at end of file
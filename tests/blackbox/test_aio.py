@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import asyncio
+import threading
+import time
+import pytest
+
+import twsqlparser
+from twsqlparser import Template, aio, twsp
+
+SQL = """\
+select *
+  from tbl
+ where id = /*:id*/0
+/*%for v in vals*/
+   or v = /*:v*/0
+/*end*/
+"""
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    twsp.file_cache.clear()
+    twsp._compile_cache.cache_clear()
+    yield
+    twsp.file_cache.clear()
+    twsp._compile_cache.cache_clear()
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    # 読み込みを遅くし、同時に読み込んだファイルと回数を記録する
+    calls = []
+    compile_file = twsp.compile_file
+
+    def slow_compile_file(file_path, *args):
+        calls.append(file_path)
+        time.sleep(0.05)
+        return compile_file(file_path, *args)
+
+    monkeypatch.setattr(twsp, 'compile_file', slow_compile_file)
+    return calls
+
+
+def write(tmp_path, name, sql=SQL):
+    path = tmp_path / name
+    path.write_text(sql, encoding='utf-8')
+    return str(path)
+
+
+def test_concurrent_loads_share_one_read(tmp_path, loads):
+    path = write(tmp_path, 'a.sql')
+
+    async def main():
+        return await asyncio.gather(*(twsqlparser.compile_file_async(path) for _ in range(200)))
+
+    templates = run(main())
+    assert loads == [path]
+    assert all(template is templates[0] for template in templates)
+    assert aio._inflight == {}
+
+
+def test_many_paths(tmp_path, loads):
+    paths = [write(tmp_path, f'{i}.sql', SQL.replace('tbl', f'tbl{i}')) for i in range(20)]
+    query_params = {'id': 1, 'vals': [2, 3]}
+
+    async def main():
+        return await asyncio.gather(*(twsqlparser.parse_file_async(path, query_params)
+                                      for _ in range(10) for path in paths))
+
+    results = run(main())
+    assert sorted(loads) == sorted(paths)
+    assert results == [twsqlparser.parse_file(path, query_params) for _ in range(10) for path in paths]
+
+
+def test_cached_file_is_not_read_in_executor(tmp_path, loads):
+    path = write(tmp_path, 'a.sql')
+    twsqlparser.compile_file(path)
+    template = run(Template.load_async(path))
+    assert loads == [] and template is twsqlparser.compile_file(path)
+
+
+def test_render_in_executor(tmp_path):
+    path = write(tmp_path, 'a.sql')
+    query_params = {'id': 1, 'vals': list(range(100))}
+    threads = set()
+    render = Template.render
+
+    def render_spy(self, *args):
+        threads.add(threading.get_ident())
+        return render(self, *args)
+
+    Template.render = render_spy
+    try:
+        actual = run(twsqlparser.parse_file_async(path, query_params, render_in_executor=True))
+    finally:
+        Template.render = render
+    assert actual == twsqlparser.parse_file(path, query_params)
+    assert threading.get_ident() not in threads
+
+
+def test_error_is_shared(tmp_path, loads):
+    path = str(tmp_path / 'missing.sql')
+
+    async def main():
+        return await asyncio.gather(*(twsqlparser.compile_file_async(path) for _ in range(5)),
+                                    return_exceptions=True)
+
+    errors = run(main())
+    assert loads == [path] and all(type(e) is FileNotFoundError for e in errors)
+    assert aio._inflight == {}
+
+
+def test_validate_error_is_logged():
+    # parse_file と同様に、 TwspException はログに出力して None を返す
+    assert run(twsqlparser.parse_file_async('relative.sql')) is None
+
+
+def test_cancel_one_waiter(tmp_path, loads):
+    path = write(tmp_path, 'a.sql')
+
+    async def main():
+        first = asyncio.ensure_future(twsqlparser.compile_file_async(path))
+        second = asyncio.ensure_future(twsqlparser.compile_file_async(path))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert run(main()).sql == SQL
+    assert loads == [path]
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import json
+import pytest
+
+from benchmarks import __main__ as cli
+from benchmarks import compare, runner, scaling, threads
+from benchmarks.generator import SPECS, TemplateSpec, generate
+from twsqlparser import twsp
+
+
+@pytest.mark.parametrize('name', sorted(SPECS))
+def test_generate_renders(name):
+    sql, params = generate(SPECS[name])
+    assert generate(SPECS[name]) == (sql, params)
+    actual, rparam = twsp.compile(sql).render(params)
+    assert 'dummy' not in actual
+    assert set(params).issubset(rparam)
+
+
+def test_generate_shape():
+    sql, params = generate(TemplateSpec(size=2, depth=3, density=4, loop_length=7))
+    assert sql.count('/*%if ') == 4 and sql.count('/*%for ') == 2
+    assert all(len(params[f'b{i}_1_list']) == 7 for i in range(2))
+    _, rparam = twsp.parse_sql(sql, params)
+    # for のループ変数は、ブロックごとにループ回数分の一時パラメータになる
+    assert len([k for k in rparam if k.startswith('__f')]) == 2 * 7
+
+
+def test_generate_branches():
+    sql, params = generate(TemplateSpec(size=5, depth=2, density=1, loop_length=2, branches=3))
+    paired_sql, paired_params = generate(TemplateSpec(size=5, depth=2, density=1, loop_length=2, branches=3,
+                                                      paired=True))
+    assert sql.count('/*%elif ') == 5 and sql.count('/*%else*/') == 5 and '/*%e' not in paired_sql
+    assert params == paired_params and {params[f'b{i}_sel'] for i in range(5)} == {0, 1, 2}
+    # 分岐を if を並べて書いた場合と同じSQLになる
+    assert twsp.parse_sql(sql, params) == twsp.parse_sql(paired_sql, params)
+
+
+def test_generate_payload():
+    sql, params = generate(TemplateSpec(size=1, depth=1, density=1, loop_length=1, payload=5))
+    assert params['ids'] == list(range(5)) and len(params['rows']) == 5
+    assert twsp.parse_sql(sql, params)[1]['ids'] == list(range(5))
+
+
+def test_peak_memory():
+    assert 10 ** 6 <= runner.peak_memory(lambda: bytearray(10 ** 6)) < 2 * 10 ** 6
+
+
+def test_compare_peak_bytes():
+    baseline = {'results': {'render/a': {'min': 1.0, 'peak_bytes': 1024},
+                            'render/b': {'min': 1.0, 'peak_bytes': None}}}
+    current = {'results': {'render/a': {'min': 1.0, 'peak_bytes': 4096}, 'render/b': {'min': 1.0, 'peak_bytes': 1}}}
+    comparisons = compare.compare(baseline, current, stat='peak_bytes')
+    # 計測できなかった結果は比較しない
+    assert [(c.key, c.ratio, c.regressed) for c in comparisons] == [('render/a', 4.0, True)]
+    assert '4.0 KiB' in compare.format_table(comparisons, 'peak_bytes')
+
+
+def test_startup_cases(tmp_path):
+    sql, _ = generate(SPECS['small'])
+    cases = runner._startup_cases('small', sql, str(tmp_path), 30)
+    cases['startup_cold']()
+    cases['startup_disk_cache']()
+    assert len(list((tmp_path / 'small_startup').rglob('*.sql'))) == 30
+    assert len(list((tmp_path / 'small_startup_cache').rglob('*.twsp'))) == 30
+    # 起動時間の計測は、デフォルトで数百件のテンプレートを読み込む
+    assert 200 <= runner.STARTUP_FILES
+
+
+def test_measure():
+    result = runner.measure(lambda: None, warmup=0, repeat=3, min_time=0.001)
+    assert result['repeat'] == 3 and 1 <= result['number']
+    assert 0 <= result['min'] <= result['median'] <= max(result['mean'], result['median'])
+
+
+def test_run_and_compare(tmp_path):
+    output = tmp_path / 'baseline.json'
+    assert cli.main(['run', '--quick', '-t', 'small', '--startup-files', '20', '-o', str(output)]) == 0
+    baseline = json.loads(output.read_text(encoding='utf-8'))
+    assert set(baseline['results']) == {f'{path}/small' for path in runner.PATHS}
+    assert baseline['meta']['repeat'] == 2 and baseline['meta']['startup_files'] == 20
+    assert all(0 < r['peak_bytes'] for r in baseline['results'].values())
+
+    # 基準より2倍遅い結果は遅くなったとみなす
+    slow = {'results': {key: {**r, 'min': r['min'] * 2} for key, r in baseline['results'].items()}}
+    comparisons = compare.compare(baseline, slow, threshold=0.5)
+    assert len(comparisons) == len(runner.PATHS) and all(c.regressed for c in comparisons)
+    assert not any(c.regressed for c in compare.compare(baseline, baseline))
+    assert 'REGRESSION' in compare.format_table(comparisons)
+
+    current = tmp_path / 'current.json'
+    current.write_text(json.dumps(slow), encoding='utf-8')
+    assert cli.main(['compare', str(output), str(current), '--threshold', '0.5']) == 1
+    assert cli.main(['compare', str(output), str(current), '--threshold', '1.5']) == 0
+
+
+def test_compile_per_byte():
+    per_byte = scaling.compile_per_byte((100, 1000), budget=1000)
+    assert set(per_byte) == {100, 1000} and all(0 < sec for sec in per_byte.values())
+    assert scaling.growth({10: 2.0, 100: 1.0, 1000: 3.0}) == 3.0
+
+
+def test_compile_per_param():
+    per_param = scaling.compile_per_param((10, 100), budget=100)
+    assert set(per_param) == {30, 300} and all(0 < sec for sec in per_param.values())
+
+
+def test_scaling_command(capsys):
+    assert cli.main(['scaling', '--quick', '--limit', '1000']) == 0
+    out = capsys.readouterr().out
+    assert 'ns/byte' in out and 'ns/param' in out
+    assert cli.main(['scaling', '--quick', '--limit', '0']) == 1
+
+
+def test_engine_throughput(capsys):
+    throughput = threads.engine_throughput((1, 2), jobs=40)
+    assert set(throughput) == {1, 2} and all(0 < per_sec for per_sec in throughput.values())
+    assert cli.main(['threads', '--jobs', '40', '--min-ratio', '0']) == 0
+    assert 'calls/s' in capsys.readouterr().out
+
+
+def test_compare_wrong_stat():
+    with pytest.raises(ValueError):
+        compare.compare({'results': {}}, {'results': {}}, stat='max')
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
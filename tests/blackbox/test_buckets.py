@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pytest
+
+import twsqlparser
+from twsqlparser import Engine, InListBuckets, ParamStyle, internal_exceptions
+
+IN_SQL = 'select * from t where id in (/*%for x in ids*//*:x*/0, /*end*/-1)'
+
+
+@pytest.mark.parametrize('sizes, counts, expected', [
+    (None, [0, 1, 2, 3, 5, 8, 9, 1000], [0, 1, 2, 4, 8, 8, 16, 1024]),
+    ((50, 10, 100), [1, 10, 11, 100, 101, 250], [10, 10, 50, 100, 200, 300]),
+    ((), [1, 3, 7], [1, 3, 7]),
+])
+def test_bucket_size(sizes, counts, expected):
+    buckets = InListBuckets(sizes)
+    assert [buckets.bucket_size(count) for count in counts] == expected
+
+
+@pytest.mark.parametrize('kwargs, msg', [
+    ({'fill': 'zero'}, internal_exceptions.Msg.E0001),
+    ({'sizes': (0, 10)}, internal_exceptions.Msg.E0016),
+    ({'sizes': (2.5, 10)}, internal_exceptions.Msg.E0016),
+    ({'sizes': ('a', 'b')}, internal_exceptions.Msg.E0016),
+    ({'sizes': (1, 'a')}, internal_exceptions.Msg.E0016),
+    ({'sizes': (None, )}, internal_exceptions.Msg.E0016),
+    ({'sizes': (True, 4)}, internal_exceptions.Msg.E0016),
+])
+def test_wrong_settings(kwargs, msg):
+    with pytest.raises(internal_exceptions.TwspValidateError) as e:
+        InListBuckets(**kwargs)
+    assert e.value.args[0] is msg
+
+
+def test_shape_count_is_logarithmic():
+    tpl = twsqlparser.compile(IN_SQL)
+    padded, unpadded = InListBuckets(), InListBuckets(())
+    for count in range(1, 101):
+        params = {'ids': list(range(count))}
+        tpl.render(params, in_buckets=padded)
+        tpl.render(params, in_buckets=unpadded)
+    assert padded.shape_count == 8
+    assert unpadded.shape_count == 100
+    padded.reset()
+    assert padded.shape_count == 0
+
+
+def test_pad_for_loop():
+    tpl = twsqlparser.compile(IN_SQL)
+    actual, rparam = tpl.render({'ids': [7, 8, 9]}, in_buckets=InListBuckets())
+    assert actual == 'select * from t where id in (:__f0_0_x, :__f0_1_x, :__f0_2_x, :__f0_3_x, -1)'
+    assert rparam == {'ids': [7, 8, 9], '__f0_0_x': 7, '__f0_1_x': 8, '__f0_2_x': 9, '__f0_3_x': 9}
+
+
+def test_pad_for_loop_null_positional():
+    tpl = twsqlparser.compile('select * from t where (a, b) in (/*%for a, b in ab*/(/*:a*/0, /*:b*/0), /*end*/)')
+    actual, values = tpl.render({'ab': [(1, 2), (3, 4), (5, 6)]}, ParamStyle.QMARK,
+                                in_buckets=InListBuckets(fill='null'))
+    assert actual == 'select * from t where (a, b) in ((?, ?), (?, ?), (?, ?), (?, ?), )'
+    assert values == [1, 2, 3, 4, 5, 6, None, None]
+
+
+def test_not_in_list_loop_is_not_padded():
+    # IN 句以外の for は、件数を埋めると結果が変わるため対象外
+    tpl = twsqlparser.compile('insert into t values /*%for v in vals*/(/*:v*/0)/*end*/')
+    actual, rparam = tpl.render({'vals': [1, 2, 3]}, in_buckets=InListBuckets())
+    assert actual == 'insert into t values (:__f0_0_v)(:__f0_1_v)(:__f0_2_v)'
+
+
+@pytest.mark.parametrize('paramstyle, expected', [
+    (ParamStyle.NAMED, {'ids': (1, 2, 3, 3), 'name': 'x'}),
+    (ParamStyle.DOLLAR_NUMERIC, [(1, 2, 3, 3), 'x']),
+])
+def test_pad_list_param(paramstyle, expected):
+    tpl = twsqlparser.compile("select * from t where id in /*:ids*/(0) and name = /*:name*/'a'")
+    params = {'ids': (1, 2, 3), 'name': 'x'}
+    _, actual = tpl.render(params, paramstyle, in_buckets=InListBuckets())
+    assert actual == expected
+    assert params == {'ids': (1, 2, 3), 'name': 'x'}
+
+
+@pytest.mark.parametrize('sql, paramstyle, expected', [
+    ('select * from t where id not in (/*%for x in ids*//*:x*/0, /*end*/-1)', ParamStyle.QMARK,
+     ('select * from t where id not in (?, ?, ?, ?, -1)', [1, 2, 3, 3])),
+    ('select * from t where id NOT IN /*:ids*/(0)', ParamStyle.QMARK,
+     ('select * from t where id NOT IN ?', [[1, 2, 3, 3]])),
+    ('select * from t where id not\n  in /*:ids*/(0)', ParamStyle.NAMED,
+     ('select * from t where id not\n  in :ids', {'ids': [1, 2, 3, 3]})),
+])
+def test_not_in_is_not_filled_with_null(sql, paramstyle, expected):
+    # NOT IN のリストに NULL を含むと条件が真にならないため、 fill='null' でも最後の値で埋める
+    buckets = InListBuckets(fill='null')
+    assert twsqlparser.compile(sql).render({'ids': [1, 2, 3]}, paramstyle, in_buckets=buckets) == expected
+    assert buckets.for_not_in().fill == 'last' and buckets.shape_count == 1
+
+
+def test_in_is_filled_with_null():
+    tpl = twsqlparser.compile('select * from t where id in /*:ids*/(0) and name is not null')
+    _, values = tpl.render({'ids': [1, 2, 3]}, ParamStyle.QMARK, in_buckets=InListBuckets(fill='null'))
+    assert values == [[1, 2, 3, None]]
+
+
+def test_iter_render_records_after_exhausted():
+    buckets = InListBuckets()
+    tpl = twsqlparser.compile(IN_SQL)
+    fragments, _ = tpl.iter_render({'ids': [1]}, in_buckets=buckets)
+    assert buckets.shape_count == 0
+    assert ''.join(fragments) == 'select * from t where id in (:__f0_0_x, -1)'
+    assert buckets.shape_count == 1
+
+
+def test_engine_in_buckets():
+    buckets = InListBuckets((10, ))
+    engine = Engine(in_buckets=buckets)
+    batches = list(engine.render_many(engine.compile(IN_SQL), ({'ids': list(range(n))} for n in range(1, 11))))
+    assert len(batches) == 1 and len(batches[0][1]) == 10
+    assert engine.parse_sql(IN_SQL, {'ids': [1]})[0].count(':__f0_') == 10
+    assert buckets.shape_count == 1
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pytest
+
+import twsqlparser
+from twsqlparser import internal_exceptions
+
+INSERT_SQL = """\
+insert into sample_lang (lang_name, create_year)
+values
+/*%for i, lang_name, year in [(i, *lang) for i, lang in enumerate(langs)]*/
+/*%if i > 0*/, /*end*/( /*:lang_name*/'sample' , /*:year*/1995 )
+/*end*/
+;"""
+
+
+def langs(count):
+    return [(f'lang{i}', 1990 + i) for i in range(count)]
+
+
+def expected_sql(count):
+    rows = ''.join(f'{", " if i else ""}( :__f0_{i}_lang_name , :__f0_{i}_year )\n' for i in range(count))
+    return f'insert into sample_lang (lang_name, create_year)\nvalues\n{rows};'
+
+
+@pytest.fixture
+def tpl():
+    return twsqlparser.compile(INSERT_SQL)
+
+
+def test_render_chunks_max_params(tpl):
+    params = {'langs': langs(7), 'other': 'x'}
+    actual = list(twsqlparser.render_chunks(tpl, params, 'langs', max_params=6))
+    assert [sql for sql, _ in actual] == [expected_sql(3), expected_sql(3), expected_sql(1)]
+    # 同じ件数の分割は同じSQLになる
+    assert actual[0][0] is not actual[1][0] and actual[0][0] == actual[1][0]
+    assert actual[1][1] == {'langs': langs(7)[3:6], 'other': 'x',
+                            '__f0_0_lang_name': 'lang3', '__f0_0_year': 1993,
+                            '__f0_1_lang_name': 'lang4', '__f0_1_year': 1994,
+                            '__f0_2_lang_name': 'lang5', '__f0_2_year': 1995}
+
+
+def test_render_chunks_max_bytes(tpl):
+    max_bytes = len(expected_sql(4).encode('utf-8'))
+    actual = list(twsqlparser.render_chunks(tpl, {'langs': langs(10)}, 'langs', max_bytes=max_bytes))
+    assert [sql for sql, _ in actual] == [expected_sql(4), expected_sql(4), expected_sql(2)]
+
+
+def test_render_chunks_both_limits(tpl):
+    actual = list(twsqlparser.render_chunks(tpl, {'langs': langs(10)}, 'langs', max_params=8, max_bytes=10 ** 6,
+                                            paramstyle=twsqlparser.ParamStyle.PYFORMAT))
+    assert [len(params['langs']) for _, params in actual] == [4, 4, 2]
+    assert actual[0][0].count('%(__f0_') == 8
+
+
+def test_render_chunks_positional(tpl):
+    actual = list(twsqlparser.render_chunks(tpl, {'langs': langs(7)}, 'langs', max_params=6,
+                                            paramstyle=twsqlparser.ParamStyle.DOLLAR_NUMERIC))
+    assert [values for _, values in actual] == [['lang0', 1990, 'lang1', 1991, 'lang2', 1992],
+                                                ['lang3', 1993, 'lang4', 1994, 'lang5', 1995],
+                                                ['lang6', 1996]]
+    assert actual[0][0].endswith('( $5 , $6 )\n;')
+
+
+def test_render_chunks_no_limit(tpl):
+    actual = list(twsqlparser.render_chunks(tpl, {'langs': langs(5)}, 'langs'))
+    assert [sql for sql, _ in actual] == [expected_sql(5)]
+
+
+def test_render_chunks_varying_rows():
+    # 行によってパラメータ数が変わる場合は、上限を超えた分割をさらに半分に分ける
+    tpl = twsqlparser.compile('select /*%for r in rows*//*%if r*//*:r*/1, /*end*/ /*end*/0')
+    rows = [0, 0, 0, 0, 1, 2, 3, 4]
+    actual = list(twsqlparser.render_chunks(tpl, {'rows': rows}, 'rows', max_params=2))
+    assert [params['rows'] for _, params in actual] == [[0, 0, 0, 0], [1, 2], [3, 4]]
+
+
+def test_render_chunks_single_row_exceeds(tpl):
+    with pytest.raises(internal_exceptions.TwspExecuteError):
+        list(twsqlparser.render_chunks(tpl, {'langs': langs(2)}, 'langs', max_params=1))
+
+
+def test_render_chunks_not_list(tpl):
+    with pytest.raises(internal_exceptions.TwspValidateError):
+        twsqlparser.render_chunks(tpl, {'langs': iter(langs(2))}, 'langs', max_params=1)
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import os
+import pytest
+
+import twsqlparser
+from twsqlparser import cache, twsp
+
+
+def write(path, text, mtime_ns=None):
+    path.write_text(text, encoding='utf-8')
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+@pytest.mark.parametrize('env, expected', [(None, None), ('0', 0.0), ('1.5', 1.5), ('-1', None), ('x', None)])
+def test_get_check_interval(monkeypatch, env, expected):
+    if env is None:
+        monkeypatch.delenv('TWSP_TEST_INTERVAL', raising=False)
+    else:
+        monkeypatch.setenv('TWSP_TEST_INTERVAL', env)
+    assert cache.get_check_interval('TWSP_TEST_INTERVAL') == expected
+
+
+def test_file_cache_hit_and_miss(tmp_path):
+    fc = cache.FileCache()
+    path = write(tmp_path / 'a.sql', 'select 1')
+    assert fc.read(path) == 'select 1'
+    assert fc.read(path) == 'select 1'
+    assert fc.info() == cache.FileCacheInfo(1, 1, 0, 0, 1, 8)
+
+
+def test_file_cache_without_check(tmp_path):
+    fc = cache.FileCache()
+    path = write(tmp_path / 'a.sql', 'select 1', 10 ** 18)
+    fc.read(path)
+    write(tmp_path / 'a.sql', 'select 2', 2 * 10 ** 18)
+    # 更新を確認しない場合は古い内容を返す
+    assert fc.read(path) == 'select 1'
+
+
+def test_file_cache_revalidate(tmp_path):
+    fc = cache.FileCache(check_interval=0)
+    path = write(tmp_path / 'a.sql', 'select 1', 10 ** 18)
+    assert fc.read(path) == 'select 1'
+    assert fc.read(path) == 'select 1'
+    write(tmp_path / 'a.sql', 'select 22', 2 * 10 ** 18)
+    assert fc.read(path) == 'select 22'
+    assert fc.info() == cache.FileCacheInfo(1, 2, 0, 1, 1, 9)
+
+
+def test_file_cache_revalidate_once_per_interval(tmp_path, monkeypatch):
+    path = write(tmp_path / 'a.sql', 'select 1')
+    now, stats, real_stat = [1000.0], [], os.stat
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(cache.os, 'stat', lambda p, *args, **kwargs: stats.append(p) or real_stat(p, *args, **kwargs))
+    fc = cache.FileCache(check_interval=1)
+    fc.read(path)
+    for _ in range(10):
+        now[0] += 0.4
+        assert fc.read(path) == 'select 1'
+    # 読み込み時の1回と、4秒間で確認間隔ごとの3回のみ
+    assert len(stats) == 4
+    # 確認した直後は、確認せずに返せる
+    assert fc.peek(path) == 'select 1'
+    assert fc.info().hits == 11
+
+
+def test_file_cache_revalidate_interval(tmp_path):
+    fc = cache.FileCache(check_interval=3600)
+    path = write(tmp_path / 'a.sql', 'select 1', 10 ** 18)
+    fc.read(path)
+    write(tmp_path / 'a.sql', 'select 2', 2 * 10 ** 18)
+    # 確認間隔が経過するまでは確認しない
+    assert fc.read(path) == 'select 1'
+
+
+def test_file_cache_evict_by_entries(tmp_path):
+    fc = cache.FileCache(max_entries=2)
+    paths = [write(tmp_path / f'{i}.sql', f'select {i}') for i in range(3)]
+    fc.read(paths[0])
+    fc.read(paths[1])
+    fc.read(paths[0])
+    fc.read(paths[2])
+    # 最も長く使われていない paths[1] が破棄される
+    assert fc.info() == cache.FileCacheInfo(1, 3, 1, 0, 2, 16)
+    fc.read(paths[0])
+    assert fc.info().hits == 2
+
+
+def test_file_cache_evict_by_bytes(tmp_path):
+    fc = cache.FileCache(max_entries=None, max_bytes=20)
+    paths = [write(tmp_path / f'{i}.sql', 'x' * 8) for i in range(3)]
+    for path in paths:
+        fc.read(path)
+    assert fc.info() == cache.FileCacheInfo(0, 3, 1, 0, 2, 16)
+    # 上限より大きいファイルはキャッシュしない
+    large = write(tmp_path / 'large.sql', 'x' * 21)
+    assert fc.read(large) == 'x' * 21
+    assert fc.info() == cache.FileCacheInfo(0, 4, 1, 0, 2, 16)
+
+
+def test_file_cache_invalidate_and_clear(tmp_path):
+    fc = cache.FileCache()
+    path1 = write(tmp_path / '1.sql', 'select 1')
+    path2 = write(tmp_path / '2.sql', 'select 2')
+    fc.read(path1)
+    fc.read(path1, encoding='cp932')
+    fc.read(path2)
+    fc.invalidate(path1)
+    assert fc.info() == cache.FileCacheInfo(0, 3, 0, 0, 1, 8)
+    fc.read(path1)
+    assert fc.info().misses == 4
+    fc.clear()
+    assert fc.info() == cache.FileCacheInfo(0, 0, 0, 0, 0, 0)
+
+
+@pytest.mark.parametrize('check_interval, expected', [(None, 'select 1'), (3600, 'select 1'), (0, None)])
+def test_file_cache_peek(tmp_path, check_interval, expected):
+    fc = cache.FileCache(check_interval=check_interval)
+    path = write(tmp_path / 'a.sql', 'select 1')
+    assert fc.peek(path) is None
+    fc.read(path)
+    # 更新の確認が必要な場合はファイルを確認せずに None を返す
+    assert fc.peek(path) == expected
+    assert fc.info().hits == (0 if expected is None else 1)
+
+
+def test_parse_file_reloads_changed_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(twsqlparser.file_cache, 'check_interval', 0)
+    path = write(tmp_path / 'a.sql', 'select /*:a*/1', 10 ** 18)
+    assert twsp.parse_file(path, {'a': 1})[0] == 'select :a'
+    write(tmp_path / 'a.sql', 'select /*:b*/1', 2 * 10 ** 18)
+    assert twsp.parse_file(path, {'b': 1})[0] == 'select :b'
+    twsqlparser.file_cache.invalidate(path)
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import os
+import pytest
+
+from twsqlparser import DiskCache, SqlRegistry, diskcache, twsp
+
+SQL = 'select * from a where id in (/*%for i in ids*//*:i*/1, /*end*/0)'
+PARAMS = {'ids': [1, 2]}
+
+
+def write(path, text, mtime_ns):
+    path.write_text(text, encoding='utf-8')
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+@pytest.fixture
+def no_compile(monkeypatch):
+    def fail(*args):
+        raise AssertionError('compiled')
+
+    def disable():
+        monkeypatch.setattr(twsp, 'compile', fail)
+    return disable
+
+
+def test_diskcache_load(tmp_path, no_compile):
+    path = write(tmp_path / 'a.sql', SQL, 10 ** 18)
+    expected = twsp.compile(SQL).render(PARAMS)
+    assert DiskCache(tmp_path / 'cache').load(path).render(PARAMS) == expected
+    assert len(list((tmp_path / 'cache').glob('a.*.twsp'))) == 1
+    # 別のインスタンス(プロセスの再起動)でもコンパイルせずに読み込む
+    no_compile()
+    assert DiskCache(tmp_path / 'cache').load(path).render(PARAMS) == expected
+
+
+def test_diskcache_source_changed(tmp_path):
+    cache = DiskCache(tmp_path / 'cache')
+    path = write(tmp_path / 'a.sql', SQL, 10 ** 18)
+    cache.load(path)
+    path = write(tmp_path / 'a.sql', 'select /*:b*/1', 2 * 10 ** 18)
+    assert cache.load(path).render({'b': 1}) == ('select :b', {'b': 1})
+
+
+def test_diskcache_touched_source(tmp_path, no_compile):
+    cache = DiskCache(tmp_path / 'cache')
+    path = write(tmp_path / 'a.sql', SQL, 10 ** 18)
+    cache.load(path)
+    no_compile()
+    # mtime のみ変わった場合は、内容のハッシュが一致するためコンパイルしない
+    path = write(tmp_path / 'a.sql', SQL, 2 * 10 ** 18)
+    assert cache.load(path).sql == SQL
+    assert cache.load(path).sql == SQL
+
+
+def test_diskcache_settings_and_version(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path / 'cache')
+    path = write(tmp_path / 'a.sql', 'select 1 /* c */', 10 ** 18)
+    assert cache.load(path, delete_comment=True).sql == 'select 1 /* c */'
+    assert cache.load(path, delete_comment=False).render() == ('select 1 /* c */', {})
+    assert cache.load(path, delete_comment=True).render() == ('select 1 ', {})
+    assert len(list(cache.cache_dir.glob('*.twsp'))) == 2
+    monkeypatch.setattr(diskcache, '_CACHE_FORMAT', -1)
+    compiled = []
+    monkeypatch.setattr(twsp, 'compile', lambda *args: compiled.append(args) or 'new')
+    assert cache.load(path) == 'new'
+    assert len(compiled) == 1
+
+
+def test_diskcache_broken_entry(tmp_path):
+    cache = DiskCache(tmp_path / 'cache')
+    path = write(tmp_path / 'a.sql', SQL, 10 ** 18)
+    cache.load(path)
+    for entry_path in cache.cache_dir.glob('*.twsp'):
+        entry_path.write_bytes(b'broken')
+    assert cache.load(path).render(PARAMS) == twsp.compile(SQL).render(PARAMS)
+    cache.clear()
+    assert list(cache.cache_dir.iterdir()) == []
+
+
+def test_registry_with_cache_dir(tmp_path, no_compile):
+    (tmp_path / 'sql').mkdir()
+    write(tmp_path / 'sql' / 'a.sql', SQL, 10 ** 18)
+    expected = twsp.compile(SQL).render(PARAMS)
+    assert SqlRegistry(tmp_path / 'sql', cache_dir=tmp_path / 'cache').render('a', PARAMS) == expected
+    no_compile()
+    registry = SqlRegistry(tmp_path / 'sql', cache_dir=tmp_path / 'cache', parallel='thread')
+    assert registry.render('a', PARAMS) == expected
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
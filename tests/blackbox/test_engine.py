@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from twsqlparser import Engine, ParamStyle, internal_exceptions
+
+BASE_SQL = """\
+select *
+  from tbl
+ where 1 = 1
+/*%if flag*/
+   and c1 = /*:c1*/'x'
+/*end*/
+/*%for v in vals*/
+   and c2 = /*:v*/0 -- comment
+/*end*/
+"""
+
+PARAMS = {'flag': True, 'c1': 'A', 'vals': [1, 2, 3]}
+
+ENGINES = [
+    Engine(),
+    Engine(newline='\r\n'),
+    Engine(paramstyle=ParamStyle.PYFORMAT),
+    Engine(delete_comment=False, newline='\r\n', paramstyle=ParamStyle.PYFORMAT),
+]
+
+
+def sql_for(engine):
+    return BASE_SQL.replace('\n', engine.newline)
+
+
+def test_engine_settings():
+    engine = Engine(delete_comment=False, paramstyle=ParamStyle.PYFORMAT)
+    actual, rparam = engine.parse_sql(sql_for(engine), PARAMS)
+    assert actual == ("select *\n  from tbl\n where 1 = 1\n   and c1 = %(c1)s\n"
+                      "   and c2 = %(__f0_0_v)s -- comment\n"
+                      "   and c2 = %(__f0_1_v)s -- comment\n"
+                      "   and c2 = %(__f0_2_v)s -- comment\n")
+    assert rparam == {**PARAMS, '__f0_0_v': 1, '__f0_1_v': 2, '__f0_2_v': 3}
+    tpl = engine.compile(sql_for(engine))
+    assert engine.render(tpl, PARAMS) == (actual, rparam)
+
+
+def test_engine_wrong_paramstyle():
+    with pytest.raises(internal_exceptions.TwspValidateError):
+        Engine(paramstyle='xxx')
+
+
+@pytest.mark.parametrize('workers', [1, 4, 8])
+def test_engine_concurrent_render(workers):
+    # 設定の異なる Engine を複数スレッドから同時に利用しても、結果が混ざらないことを確認する
+    # 処理量の計測は benchmarks.threads で行う
+    expected = {id(engine): engine.parse_sql(sql_for(engine), PARAMS) for engine in ENGINES}
+    jobs = ENGINES * 500
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda e: (id(e), e.parse_sql(sql_for(e), PARAMS)), jobs))
+    for engine_id, result in results:
+        assert result == expected[engine_id]
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
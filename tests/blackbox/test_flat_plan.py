@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import io
+import pytest
+
+from twsqlparser import InListBuckets, ParamStyle, twsp
+from twsqlparser.internal_exceptions import TwspExecuteError
+from twsqlparser.template import _RenderContext, _prepare_qparams, _stream_root
+
+SQL = """\
+select id  -- comment
+  from /*$schema*/public.users
+ where name = /*:name*/'x'  /* note */
+   and id in /*:ids*/(1, 2)
+   and kind in /*:kinds[]*/  \r
+   and code = /*:name*/'y'
+"""
+
+
+def params():
+    return {'schema': 'app', 'name': 'a', 'ids': [1, 2], 'kinds': (3, 4)}
+
+
+def stream(tpl, query_params, paramstyle):
+    # ノードを辿って構築した場合の結果
+    qparams = _prepare_qparams(query_params, True, tpl._constants)
+    values = [] if paramstyle.positional else None
+    ctx = _RenderContext(qparams, paramstyle.value, tpl.newline, True, values)
+    return ''.join(_stream_root(tpl.nodes, ctx)), qparams if values is None else values
+
+
+@pytest.mark.parametrize('paramstyle', list(ParamStyle))
+@pytest.mark.parametrize('delete_comment', [True, False])
+def test_same_as_stream(paramstyle, delete_comment):
+    tpl = twsp.compile(SQL, delete_comment=delete_comment)
+    assert tpl._plan is not None
+    for schema in ('app', '', 'x\n  '):
+        query_params = {**params(), 'schema': schema}
+        expected = stream(tpl, query_params, paramstyle)
+        assert tpl.render(query_params, paramstyle) == expected
+        fragments, rparams = tpl.iter_render(query_params, paramstyle)
+        assert (''.join(fragments), rparams) == expected
+
+
+def test_static():
+    tpl = twsp.compile('select 1  \n  from dual  ')
+    for paramstyle in ParamStyle:
+        assert tpl.render(None, paramstyle) == ('select 1  \n  from dual  ', [] if paramstyle.positional else {})
+    # パラメータは render ごとにコピーする
+    query_params = {'a': [1]}
+    _, rparams = tpl.render(query_params)
+    assert rparams == query_params and rparams['a'] is not query_params['a']
+
+
+def test_sql_is_reused():
+    tpl = twsp.compile('select /*:a*/1, /*:b*/2')
+    first, _ = tpl.render({'a': 1, 'b': 2}, ParamStyle.NUMERIC)
+    second, values = tpl.render({'a': 3, 'b': 4}, ParamStyle.NUMERIC)
+    assert first is second and first == 'select :1, :2' and values == [3, 4]
+    assert tpl.render({'a': 1}) == ('select :a, :b', {'a': 1})
+
+
+def test_missing_positional_param():
+    tpl = twsp.compile('select /*:a*/1, /*:b*/2')
+    with pytest.raises(TwspExecuteError):
+        tpl.render({'a': 1}, ParamStyle.QMARK)
+    # iter_render ではジェネレータを読み進めた時点で発生する
+    fragments, values = tpl.iter_render({'a': 1}, ParamStyle.QMARK)
+    with pytest.raises(TwspExecuteError):
+        list(fragments)
+    assert values == [1]
+
+
+def test_not_flat():
+    assert twsp.compile('select 1/*%if a*/, 2/*end*/')._plan is None
+    assert twsp.compile('select 1/*%for a in b*/, 2/*end*/')._plan is None
+    assert twsp.compile('select 1/*%if a*/, 2/*end*/').specialize(a=True)._plan is None
+
+
+def test_specialized_and_copy_params():
+    tpl = twsp.compile('select /*$c*/, /*:a*/1').specialize(c='x')
+    query_params = {'a': 1}
+    sql, rparams = tpl.render(query_params, copy_params=False)
+    assert sql == 'select x, :a' and dict(rparams) == {'a': 1, 'c': 'x'}
+    rparams['b'] = 2
+    assert query_params == {'a': 1}
+
+
+def test_in_buckets_and_render_to():
+    tpl = twsp.compile('select 1 where id in /*:ids*/(1)')
+    buckets = InListBuckets()
+    assert tpl.render({'ids': [1, 2, 3]}, in_buckets=buckets) == ('select 1 where id in :ids', {'ids': [1, 2, 3, 3]})
+    out = io.StringIO()
+    assert tpl.render_to(out, {'ids': [1, 2, 3]}, ParamStyle.QMARK) == [[1, 2, 3]]
+    assert out.getvalue() == 'select 1 where id in ?'
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
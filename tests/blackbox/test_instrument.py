@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pytest
+
+import twsqlparser
+from twsqlparser import PhaseStats, SqlRegistry, twsp
+
+SQL = """\
+select *
+  from tbl
+ where 1 = 1
+/*%if flag*/
+   and c1 = /*:c1*/'x'
+/*end*/
+/*%for v in vals*/
+   /*%if v*/ or c2 = /*:v*/0/*end*/
+/*end*/
+"""
+PARAMS = {'flag': True, 'c1': 'A', 'vals': [1, 0, 3]}
+
+
+@pytest.fixture(autouse=True)
+def collect():
+    twsqlparser.reset_stats()
+    twsqlparser.enable_stats()
+    yield
+    twsqlparser.disable_stats()
+    twsqlparser.reset_stats()
+
+
+def test_disabled():
+    twsqlparser.disable_stats()
+    twsp.compile(SQL).render(PARAMS)
+    assert twsqlparser.stats() == {}
+
+
+def test_parse_file(tmp_path):
+    path = tmp_path / 'query.sql'
+    path.write_text(SQL, encoding='utf-8')
+    for _ in range(3):
+        twsqlparser.parse_file(str(path), PARAMS)
+    actual = twsqlparser.stats()[str(path)]
+    assert set(actual) == {'load', 'lex', 'eval', 'loop', 'join'}
+    assert [actual[phase].count for phase in ('load', 'lex', 'eval', 'loop', 'join')] == [3, 1, 3 * 4, 3 * 3, 3]
+    assert all(0 <= stat.seconds for stat in actual.values())
+
+
+def test_sql_name():
+    twsp.compile(SQL).render(PARAMS)
+    twsp.compile(SQL, name='named').render(PARAMS)
+    names = sorted(twsqlparser.stats())
+    assert names[0].startswith('<sql:') and names[1] == 'named'
+    assert twsqlparser.stats()['named']['load'] == PhaseStats(0, 0.0)
+
+
+def test_iter_render_records_after_exhausted():
+    fragments, _ = twsp.compile(SQL, name='stream').iter_render(PARAMS)
+    next(fragments)
+    assert twsqlparser.stats()['stream']['join'].count == 0
+    list(fragments)
+    assert twsqlparser.stats()['stream']['join'].count == 1
+
+
+def test_callback():
+    events = []
+
+    def callback(*args):
+        events.append(args)
+
+    twsqlparser.register_stats_callback(callback)
+    try:
+        twsp.compile(SQL, name='cb').render(PARAMS)
+    finally:
+        twsqlparser.unregister_stats_callback(callback)
+    assert [(name, phase, count) for name, phase, count, _ in events] == [
+        ('cb', 'lex', 1), ('cb', 'eval', 4), ('cb', 'loop', 3), ('cb', 'join', 1)]
+
+
+def test_unregister_callback():
+    events = []
+    twsqlparser.register_stats_callback(events.append)
+    twsqlparser.unregister_stats_callback(events.append)
+    twsp.compile(SQL).render(PARAMS)
+    assert events == []
+
+
+def test_registry(tmp_path):
+    (tmp_path / 'a.sql').write_text(SQL, encoding='utf-8')
+    registry = SqlRegistry(tmp_path)
+    registry.render('a', PARAMS)
+    actual = twsqlparser.stats()[str(tmp_path / 'a.sql')]
+    assert (actual['load'].count, actual['lex'].count, actual['join'].count) == (1, 1, 1)
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pytest
+
+from twsqlparser import lexer, internal_exceptions
+from twsqlparser.enums import TokenType
+
+
+@pytest.mark.parametrize('s, i, expected', [
+    ('hoge', 0, (TokenType.TEXT, 4)),
+    ('ho-ge', 0, (TokenType.TEXT, 5)),
+    ('ho/ge', 0, (TokenType.TEXT, 5)),
+    ('ho--ge', 0, (TokenType.TEXT, 2)),
+    ('ho/*x*/ge', 0, (TokenType.TEXT, 2)),
+    ('ho(ge', 0, (TokenType.TEXT, 2)),
+    ('ho(ge', 2, (TokenType.BRACKET, 3)),
+    ("'ho'ge", 0, (TokenType.QUOTE, 4)),
+    ("'ho", 0, (TokenType.QUOTE, 3)),
+    ('--ho\nge', 0, (TokenType.LINE_COMMENT, 4)),
+    ('--hoge', 0, (TokenType.LINE_COMMENT, 6)),
+    ('/*:ho*/ge', 0, (TokenType.PARAM, 7)),
+    ('/*:ho[]*/ge', 0, (TokenType.PARAM, 9)),
+    ('/*:h[o]*/ge', 0, (TokenType.NORMAL, 9)),
+    ('/*$ho*/ge', 0, (TokenType.DIRECT, 7)),
+    ('/*%if ho*/ge', 0, (TokenType.IFEND, 10)),
+    ('/*%for h in o*/ge', 0, (TokenType.FOREND, 15)),
+    ('/*%elif ho*/ge', 0, (TokenType.ELIF, 12)),
+    ('/*%else*/ge', 0, (TokenType.ELSE, 9)),
+    ('/*%else ho*/ge', 0, (TokenType.NORMAL, 12)),
+    ('/*end*/ge', 0, (TokenType.END, 7)),
+    ('/*ho\nge*/', 0, (TokenType.NORMAL, 9)),
+    ('/*%if\nho*/', 0, (TokenType.NORMAL, 10)),
+    ('x /*:ho*/ge', 2, (TokenType.PARAM, 9)),
+])
+def test_next_token(s, i, expected):
+    assert lexer.next_token(s, i, '\n') == expected
+
+
+@pytest.mark.parametrize('s, i, expected', [
+    ("'abc' x", 0, 5),
+    ("x 'abc' x", 2, 7),
+    ("''", 0, 2),
+    ("'", 0, 1),
+    ('"a\'b" x', 0, 5),
+])
+def test_quote_end(s, i, expected):
+    assert lexer.quote_end(s, i) == expected
+
+
+@pytest.mark.parametrize('s, i, expected', [
+    ('/*:p*/ from', 6, 6),
+    ('/*:p*/', 6, 6),
+    ('/*:p*/123 from', 6, 9),
+    ('/*:p*/123.4, x', 6, 11),
+    ('/*:p*/tbl.col_1)', 6, 15),
+    ("/*:p*/'abc def' x", 6, 15),
+    ("/*:p*/'abc''def' x", 6, 16),
+    ('/*:p*/(0, 1, 2) x', 6, 15),
+    ('/*:p*/[0, (1)] x', 6, 14),
+    ('/*:p*/{0, 1 x', 6, 13),
+    ('/*:p*/abc(1, 2)d x', 6, 16),
+    ('/*:p*/0--comment', 6, 7),
+    ('/*:p*/0/*comment*/', 6, 7),
+])
+def test_dummy_end(s, i, expected):
+    assert lexer.dummy_end(s, i) == expected
+
+
+def test_next_token_unclosed_comment():
+    with pytest.raises(internal_exceptions.TwspException):
+        lexer.next_token('select /* 1', 7, '\n')
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pytest
+
+from twsqlparser import Engine, ParamStyle, SqlRegistry, internal_exceptions
+
+FILES = {
+    'orders/select_by_user.sql': 'select * from orders where user_id = /*:user_id*/1',
+    'orders/items/select.sql': 'select * from items where id in (/*%for i in ids*//*:i*/1, /*end*/0)',
+    'users.sql': 'select * from users /*%if name*/where name = /*:name*/\'x\'/*end*/',
+    'README.md': 'not sql',
+}
+
+
+@pytest.fixture
+def root_dir(tmp_path):
+    for name, text in FILES.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+    return tmp_path
+
+
+def test_registry_names(root_dir):
+    registry = SqlRegistry(root_dir)
+    assert registry.names() == ['orders/items/select', 'orders/select_by_user', 'users']
+    assert len(registry) == 3
+    assert 'users' in registry
+    assert 'README' not in registry
+
+
+@pytest.mark.parametrize('parallel', [None, 'thread', 'process'])
+def test_registry_render(root_dir, parallel):
+    registry = SqlRegistry(root_dir, parallel=parallel, max_workers=2)
+    assert registry.render('orders/select_by_user', {'user_id': 3}) == (
+        'select * from orders where user_id = :user_id', {'user_id': 3})
+    assert registry.render('orders/items/select', {'ids': [5, 6]}) == (
+        'select * from items where id in (:__f0_0_i, :__f0_1_i, 0)', {'ids': [5, 6], '__f0_0_i': 5, '__f0_1_i': 6})
+    assert registry.render('users', {'name': None}) == ('select * from users ', {'name': None})
+
+
+def test_registry_engine(root_dir):
+    registry = SqlRegistry(root_dir, engine=Engine(paramstyle=ParamStyle.PYFORMAT))
+    assert registry.render('orders/select_by_user', {'user_id': 3})[0] == (
+        'select * from orders where user_id = %(user_id)s')
+
+
+def test_registry_lazy(root_dir):
+    registry = SqlRegistry(root_dir, preload=False)
+    # 利用するまでコンパイルしないため、作成後の変更が反映される
+    (root_dir / 'users.sql').write_text('select 1', encoding='utf-8')
+    assert registry.render('users') == ('select 1', {})
+    assert registry.get('users') is registry.get('users')
+
+
+def test_registry_not_found(root_dir):
+    registry = SqlRegistry(root_dir)
+    with pytest.raises(internal_exceptions.TwspValidateError):
+        registry.render('orders/unknown')
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
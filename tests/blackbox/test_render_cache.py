@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import itertools
+import pytest
+
+import twsqlparser
+from twsqlparser import InListBuckets, ParamStyle, RenderCache, RenderCacheInfo, twsp
+
+SQL = """\
+select *
+  from tbl
+ where 1 = 1
+/*%if flag*/
+   and c1 = /*:c1*/'x'
+/*end*/
+   and c2 in (/*%for v in vals*//*:v*/0, /*end*/-1)
+ order by /*$order*/id
+"""
+
+
+def params(flag=True, c1='A', vals=(1, 2), order='id'):
+    return {'flag': flag, 'c1': c1, 'vals': list(vals), 'order': order}
+
+
+def test_hit_rebuilds_params():
+    template = twsp.compile(SQL)
+    rc = RenderCache()
+    first = template.render(params(c1='A', vals=(1, 2)), render_cache=rc)
+    second = template.render(params(c1='B', vals=(3, 4)), render_cache=rc)
+    assert first == template.render(params(c1='A', vals=(1, 2)))
+    assert second == template.render(params(c1='B', vals=(3, 4)))
+    assert first[0] == second[0]
+    assert second[1]['c1'] == 'B' and (second[1]['__f0_0_v'], second[1]['__f0_1_v']) == (3, 4)
+    assert rc.info() == RenderCacheInfo(1, 1, 0, 1, rc.info().currbytes)
+
+
+@pytest.mark.parametrize('changed', [params(flag=False), params(vals=(1, 2, 3)), params(order='name')])
+def test_control_flow_changes_signature(changed):
+    template = twsp.compile(SQL)
+    rc = RenderCache()
+    template.render(params(), render_cache=rc)
+    assert template.render(changed, render_cache=rc) == template.render(changed)
+    assert (rc.info().hits, rc.info().misses) == (0, 2)
+
+
+@pytest.mark.parametrize('paramstyle', list(ParamStyle))
+def test_paramstyles(paramstyle):
+    template = twsp.compile(SQL)
+    rc = RenderCache()
+    for c1, flag in itertools.product(('A', 'B'), (True, False)):
+        query_params = params(flag=flag, c1=c1)
+        assert template.render(query_params, paramstyle, render_cache=rc) == template.render(query_params, paramstyle)
+    assert (rc.info().hits, rc.info().misses) == (2, 2)
+
+
+def test_muted_body_affects_sql():
+    # 出力しない if の内側の値でも、 /*end*/ の後ろの空白の扱いが変わる
+    template = twsp.compile('select 1\n/*%if a*/\n  /*%if b*/x/*end*/ /*$d*/\n/*end*/\n  from t\n')
+    rc = RenderCache()
+    for a, b, d in itertools.product((True, False), (True, False), ('', 'y')):
+        query_params = {'a': a, 'b': b, 'd': d}
+        assert template.render(query_params, render_cache=rc) == template.render(query_params)
+
+
+def test_if_chain_branch_in_signature():
+    template = twsp.compile('select 1\n/*%if a*/\n , /*:a*/0\n/*%elif b*/\n , /*:b*/0\n/*%else*/\n , 0\n/*end*/\n')
+    rc = RenderCache()
+    for a, b in itertools.product((True, False), repeat=2):
+        query_params = {'a': a, 'b': b}
+        assert template.render(query_params, render_cache=rc) == template.render(query_params)
+    # a が真の場合は b によらず同じSQL
+    assert (rc.info().hits, rc.info().misses) == (1, 3)
+
+
+def test_lru_eviction():
+    template = twsp.compile(SQL)
+    rc = RenderCache(max_entries=2)
+    for order in ('a', 'b', 'a', 'c', 'a', 'b'):
+        template.render(params(order=order), render_cache=rc)
+    assert rc.info() == RenderCacheInfo(2, 4, 2, 2, rc.info().currbytes)
+
+
+def test_max_bytes():
+    template = twsp.compile(SQL)
+    sql, _ = template.render(params())
+    rc = RenderCache(max_bytes=len(sql))
+    # 1件で上限を超える場合は保持しない
+    template.render(params(), render_cache=rc)
+    template.render(params(), render_cache=rc)
+    assert rc.info() == RenderCacheInfo(0, 2, 0, 0, 0)
+
+
+def test_clear():
+    rc = RenderCache()
+    twsp.compile(SQL).render(params(), render_cache=rc)
+    rc.clear()
+    assert rc.info() == RenderCacheInfo(0, 0, 0, 0, 0)
+
+
+def test_unstable_bind_names_bypass():
+    rc = RenderCache()
+    twsp.compile(SQL).render(params(), stable_bind_names=False, render_cache=rc)
+    assert rc.info() == RenderCacheInfo(0, 0, 0, 0, 0)
+
+
+def test_in_buckets():
+    template = twsp.compile(SQL)
+    rc, buckets = RenderCache(), InListBuckets()
+    for vals in ((1, 2, 3), (4, 5, 6, 7), (8, )):
+        query_params = params(vals=vals)
+        assert template.render(query_params, in_buckets=buckets, render_cache=rc) == template.render(
+            query_params, in_buckets=InListBuckets())
+    assert (rc.info().hits, rc.info().misses, buckets.shape_count) == (1, 2, 2)
+
+
+def test_errors_are_raised():
+    template = twsp.compile(SQL)
+    with pytest.raises(twsqlparser.internal_exceptions.TwspExecuteError):
+        template.render({'vals': []}, render_cache=RenderCache())
+
+
+def test_engine_and_parse_sql():
+    rc = RenderCache()
+    engine = twsqlparser.Engine(render_cache=rc)
+    assert engine.render_cache is rc
+    assert engine.parse_sql(SQL, params()) == twsqlparser.parse_sql(SQL, params())
+    assert twsqlparser.parse_sql(SQL, params(c1='B'), render_cache=rc) == twsqlparser.parse_sql(SQL, params(c1='B'))
+    batches = list(engine.render_many(engine.compile(SQL), [params(c1=c1) for c1 in 'XYZ']))
+    assert len(batches) == 1 and [p['c1'] for p in batches[0][1]] == ['X', 'Y', 'Z']
+    # キャッシュはテンプレートごとのため、 compile で作成したテンプレートの1回目は含まない
+    assert (rc.info().hits, rc.info().misses) == (3, 2)
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
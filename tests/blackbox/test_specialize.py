@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import itertools
+import unittest.mock
+import pytest
+
+from twsqlparser import ParamStyle, RenderCache, template, twsp
+from twsqlparser.internal_exceptions import Msg, TwspValidateError
+
+SQL = """\
+select id
+/*%if feature_x*/
+     , extra
+/*end*/
+  from /*$schema*/public.users
+ where 1 = 1
+/*%if dialect == 'pg'*/
+   and name ilike /*:name*/'x'
+/*%elif dialect == 'mysql'*/
+   and name like /*:name*/'x'
+/*%else*/
+   and lower(name) like lower(/*:name*/'x')
+/*end*/
+/*%if dialect == 'pg' and ids*/
+   and id = any(/*:ids*/(1))
+/*end*/
+/*%for c in cols*/
+   and /*$c*/x is not null/*%if feature_x*/ and /*$c*/x <> ''/*end*/
+/*end*/
+"""
+
+
+def query_params(**kwargs):
+    return {'name': 'a%', 'ids': [1, 2], 'cols': ['c1', 'c2'], **kwargs}
+
+
+@pytest.mark.parametrize('dialect, feature_x, schema', list(itertools.product(('pg', 'mysql', 'sqlite'), (True, False),
+                                                                              ('app', ''))))
+@pytest.mark.parametrize('paramstyle', [ParamStyle.NAMED, ParamStyle.QMARK])
+@pytest.mark.parametrize('copy_params', [True, False])
+def test_same_as_render(dialect, feature_x, schema, paramstyle, copy_params):
+    tpl = twsp.compile(SQL)
+    constants = {'dialect': dialect, 'feature_x': feature_x, 'schema': schema}
+    expected = tpl.render(query_params(**constants), paramstyle, copy_params=copy_params)
+    actual = tpl.specialize(**constants).render(query_params(), paramstyle, copy_params=copy_params)
+    assert actual == expected
+
+
+def test_folds_nodes():
+    tpl = twsp.compile(SQL).specialize(dialect='mysql', feature_x=False, schema='app')
+    # 通らない分岐を取り除き、真偽と埋め込む文字列は評価済み
+    feature, text, chain, partial, loop = [n for n in tpl.nodes if type(n) is not template.TextNode or 'app' in n.text]
+    assert (feature.statement, feature.body, feature.orelse) == (False, (), ())
+    assert text.text == 'app'
+    assert chain.statement is True and chain.orelse == () and 'like' in chain.body[0].text
+    assert partial.statement == "if dialect == 'pg' and ids"
+    # for の内側では分岐を残し、評価のみ省略する
+    assert [n.statement for n in loop.body if type(n) is template.IfNode] == [False]
+
+
+def test_no_evaluation():
+    tpl = twsp.compile('select 1\n/*%if a*/\n , 2\n/*%elif b*/\n , 3\n/*end*/\n/*$c*/\n')
+    tpl = tpl.specialize(a=False, b=True, c='x')
+    with unittest.mock.patch.object(template, '_execute_if_statement') as execute:
+        assert tpl.render({}) == ('select 1\n , 3\nx\n', {'a': False, 'b': True, 'c': 'x'})
+        assert tpl.render({}, render_cache=RenderCache())[0] == 'select 1\n , 3\nx\n'
+    assert execute.call_count == 0
+
+
+def test_loop_variable_is_not_folded():
+    tpl = twsp.compile('select 1/*%for d in ds*//*%if d == "pg"*/, /*$d*//*end*//*end*/').specialize(d='pg')
+    assert tpl.render({'ds': ['pg', 'my', 'pg']})[0] == 'select 1, pg, pg'
+
+
+def test_constants_take_precedence():
+    tpl = twsp.compile('select /*:a*/1, /*$a*/2/*%if a == 1*/, 3/*end*/').specialize(a=1)
+    assert tpl.render({'a': 2}) == ('select :a, 1, 3', {'a': 1})
+    _, rparam = tpl.render({'a': 2}, copy_params=False)
+    assert rparam['a'] == 1
+
+
+def test_errors_are_raised_on_render():
+    tpl = twsp.compile('select 1/*%if 1 / a*/, 2/*end*//*%if a*/, 3/*end*/').specialize(a=0)
+    with pytest.raises(ZeroDivisionError):
+        tpl.render({})
+
+
+def test_variants_are_reused():
+    tpl = twsp.compile(SQL)
+    assert tpl.specialize() is tpl
+    pg = tpl.specialize(dialect='pg', feature_x=True)
+    assert tpl.specialize(feature_x=True, dialect='pg') is pg
+    assert tpl.specialize(dialect='mysql', feature_x=True) is not pg
+    assert pg.constants == {'dialect': 'pg', 'feature_x': True} and tpl.constants == {}
+    # ハッシュ可能でない値は再利用しない
+    assert tpl.specialize(dialect=['pg']) is not tpl.specialize(dialect=['pg'])
+
+
+def test_variants_of_equal_values_with_other_types():
+    tpl = twsp.compile('select /*:limit*/0, /*:pair*/0')
+    for value in (1, True, 1.0, 1, True):
+        _, rparam = tpl.specialize(limit=value, pair=(value, 0)).render({})
+        assert rparam == {'limit': value, 'pair': (value, 0)}
+        assert type(rparam['limit']) is type(value) and type(rparam['pair'][0]) is type(value)
+    assert tpl.specialize(limit=True) is tpl.specialize(limit=True)
+    assert tpl.specialize(limit=True) is not tpl.specialize(limit=1)
+
+
+def test_specialize_twice():
+    tpl = twsp.compile(SQL)
+    twice = tpl.specialize(dialect='pg').specialize(feature_x=False, schema='app')
+    assert twice.constants == {'dialect': 'pg', 'feature_x': False, 'schema': 'app'}
+    assert twice.render(query_params()) == tpl.specialize(dialect='pg', feature_x=False, schema='app').render(
+        query_params())
+    with pytest.raises(TwspValidateError) as e:
+        twice.specialize(dialect='mysql', feature_x=True)
+    assert e.value.args == (Msg.E0015, ['dialect', 'feature_x'])
+
+
+if __name__ == '__main__':
+    pytest.main(['--lf'])
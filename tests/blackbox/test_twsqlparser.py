@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 # (C) 2020 gomachssm
 
+import io
 import os
 import pytest
+import tracemalloc
 import unittest.mock
 
-from twsqlparser import twsp, internal_exceptions
+import twsqlparser
+from twsqlparser import twsp, template, internal_exceptions
 
 DIRNAME = os.path.abspath(os.path.dirname(__file__))
-UUID4PATH = 'twsqlparser.twsp.uuid4'
+UUID4PATH = 'twsqlparser.template.uuid4'
 called_count = 0
 DELETE_PATTERN = [False, True]
 
@@ -29,9 +32,13 @@ class ExpSql:
 
 @pytest.fixture(scope='function', autouse=True)
 def __reset_count():
+    reset_count()
+    yield
+
+
+def reset_count():
     global called_count
     called_count = 0
-    yield
 
 
 def mockid():
@@ -41,15 +48,15 @@ def mockid():
     return result
 
 
-@pytest.mark.parametrize('bs, qp, dc, eop, ap, lsc, expr, expl, expi', [
-    ('hoge', {}, False, None, False, -1, 'hoge', -1, 4),
-    ('ho/*end*/ge', {}, False, twsp._EOP_END, False, -1, 'ho', -1, 2),
-    ('"ho/*end*/"ge', {}, False, twsp._EOP_END, False, -1, '"ho/*end*/"ge', -1, 13),
+@pytest.mark.parametrize('bs, in_block, expr, expi', [
+    ('hoge', False, 'hoge', 4),
+    ('ho/*end*/ge', True, 'ho', 2),
+    ('"ho/*end*/"ge', True, '"ho/*end*/"ge', 13),
 ])
-def test_unit__parse(bs, qp, dc, eop, ap, lsc, expr, expl, expi):
-    result, ldng_sp_cnt, idx = twsp._parse(bs, qp, dc, ':{0}', eop=eop, after_pcmt=ap, ldng_sp_cnt=lsc)
-    assert result == expr
-    assert ldng_sp_cnt == expl
+def test_unit__parse(bs, in_block, expr, expi):
+    nodes, idx = twsp._parse(bs, 0, False, '\n', in_block=in_block)
+    assert [type(n) for n in nodes] == [template.TextNode]
+    assert nodes[0].text == expr
     assert idx == expi
 
 
@@ -175,7 +182,18 @@ def test_parse_multicomment_direct_brkt(q):
     ExpSql("select /*%if p5*/0/*end*/ from a", "select  from a"),
     ExpSql("select /*%if p6*/0/*end*/ from a", "select  from a"),
     ExpSql("select /*%if p7*/0/*end*/ from a", "select  from a"),
-    # TODO: ELSE
+    # ELIF, ELSE
+    ExpSql("select /*%if p1 == 'B'*/0/*%elif p1 == 'A'*/1/*end*/ from a", "select 1 from a"),
+    ExpSql("select /*%if p1 == 'B'*/0/*%elif p2 == 'A'*/1/*end*/ from a", "select  from a"),
+    ExpSql("select /*%if p1 == 'B'*/0/*%else*/1/*end*/ from a", "select 1 from a"),
+    ExpSql("select /*%if p1*/0/*%elif p2*/1/*%else*/2/*end*/ from a", "select 0 from a"),
+    ExpSql("select /*%if not p1*/0/*%elif p2*/1/*%else*/2/*end*/ from a", "select 1 from a"),
+    ExpSql("select /*%if not p1*/0/*%elif not p2*/1/*%else*/2/*end*/ from a", "select 2 from a"),
+    ExpSql("select /*%if p4*/0/*%elif p5*/1/*%elif p6*/2/*%elif p7*/3/*end*/ from a", "select  from a"),
+    # if の外側の ELIF, ELSE は通常コメント
+    ExpSql("select /*%else*/0 from a", "select /*%else*/0 from a"),
+    ExpSql("select /*%for a in px1*//*%elif a*/0/*end*/ from a",
+           "select /*%elif a*/0/*%elif a*/0/*%elif a*/0 from a"),
 ])
 def test_parse_multicomment_if_no_nest(q):
     params = {'p1': 'A', 'p2': 'B', 'p3': (7, 8, 9), 'p4': None, 'p5': 0, 'p6': {}, 'p7': [],
@@ -269,7 +287,7 @@ def test_parse_multicomment_for_no_nest_no_param(q, delete_comment):
     ExpSql("select 1/*%for a in px1*//*%if a % 2 == 1*/--\n, /*:a*/'xxx'--\n/*end*//*end*/ from a",
            "select 1--\n, :xxxxx0_0_a--\n--\n, :xxxxx0_2_a--\n from a",
            "select 1\n, :xxxxx0_0_a\n\n, :xxxxx0_2_a\n from a",
-           add_params={'xxxxx0_0_a': 1, 'xxxxx0_1_a': 2, 'xxxxx0_2_a': 3}),
+           add_params={'xxxxx0_0_a': 1, 'xxxxx0_2_a': 3}),
     ExpSql("select 1/*%for a in px1*//*%if a % 2 == 1*/--\n, /*$a*/'xxx'--\n/*end*//*end*/ from a",
            "select 1--\n, 1--\n--\n, 3--\n from a",
            "select 1\n, 1\n\n, 3\n from a"),
@@ -279,17 +297,16 @@ def test_parse_multicomment_for_no_nest_no_param(q, delete_comment):
            "/*%if v == 'ho1'*//*:k*/'aaa'/*end*/"
            "/*%if v == 'ge3'*//*$k*/'aaa'/*end*//*end*//*end*//*end*/ from a",
            "select 1, :xxxxx1_0_k, b from a",
-           add_params={'xxxxx1_0_k': 'a', 'xxxxx1_1_k': 'b', 'xxxxx2_0_k': 'a', 'xxxxx2_1_k': 'b',
-                       'xxxxx3_0_k': 'a', 'xxxxx3_1_k': 'b', }),
+           add_params={'xxxxx1_0_k': 'a'}),
     ExpSql("select 1/*%for p1 in px4*//*%for p2 in p1*//*%for p3 in p2*/, /*:p3*/'para3' , /*$p3*/'para3'"
            "/*end*//*end*//*end*/, /*$p1*/'para1' , /*$p2*/'para2' , /*$p3*/'para3' from a",
            "select 1, :xxxxx2_0_p3 , 111, :xxxxx2_1_p3 , 112, :xxxxx3_0_p3 , 121, :xxxxx3_1_p3 , 122"
-           ", :xxxxx6_0_p3 , 211, :xxxxx6_1_p3 , 212, :xxxxx7_0_p3 , 221, :xxxxx7_1_p3 , 222"
-           ", :xxxx10_0_p3 , 311, :xxxx10_1_p3 , 312, :xxxx11_0_p3 , 321, :xxxx11_1_p3 , 322"
+           ", :xxxxx5_0_p3 , 211, :xxxxx5_1_p3 , 212, :xxxxx6_0_p3 , 221, :xxxxx6_1_p3 , 222"
+           ", :xxxxx8_0_p3 , 311, :xxxxx8_1_p3 , 312, :xxxxx9_0_p3 , 321, :xxxxx9_1_p3 , 322"
            ", A , B , (7, 8, 9) from a",
            add_params={'xxxxx2_0_p3': 111, 'xxxxx2_1_p3': 112, 'xxxxx3_0_p3': 121, 'xxxxx3_1_p3': 122,
-                       'xxxxx6_0_p3': 211, 'xxxxx6_1_p3': 212, 'xxxxx7_0_p3': 221, 'xxxxx7_1_p3': 222,
-                       'xxxx10_0_p3': 311, 'xxxx10_1_p3': 312, 'xxxx11_0_p3': 321, 'xxxx11_1_p3': 322}),
+                       'xxxxx5_0_p3': 211, 'xxxxx5_1_p3': 212, 'xxxxx6_0_p3': 221, 'xxxxx6_1_p3': 222,
+                       'xxxxx8_0_p3': 311, 'xxxxx8_1_p3': 312, 'xxxxx9_0_p3': 321, 'xxxxx9_1_p3': 322}),
     ExpSql("select 1 from x where 1 = 1/*%for k, v in px2.items()*/ and col in (/*:k*/'key', /*:v*/'value')/*end*/",
            "select 1 from x where 1 = 1 and col in (:xxxxx0_0_k, :xxxxx0_0_v) and col in (:xxxxx0_1_k, :xxxxx0_1_v)",
            add_params={'xxxxx0_0_k': 'a', 'xxxxx0_0_v': 'ho', 'xxxxx0_1_k': 'b', 'xxxxx0_1_v': 'ge'})
@@ -303,45 +320,566 @@ def test_parse_multicomment_for_nested_param(q, delete_comment):
               }
 
     with unittest.mock.patch(UUID4PATH, mockid):
-        actual, rparam = twsp.parse_sql(q.sql(), params, delete_comment)
+        actual, rparam = twsp.parse_sql(q.sql(), params, delete_comment, stable_bind_names=False)
     assert_sql_oneline(actual, q.expected(delete_comment), (delete_comment, q.sql()))
     assert_result_param(params, rparam, q.params)
 
 
 @pytest.mark.parametrize('paramstyle', twsp.ParamStyle)
-@pytest.mark.parametrize('path, addparams', [
-    ('example1_if', {}),
-    ('example2_for', {}),
-    ('nested_for', {'xxxxx4_0_x': 0, 'xxxxx4_1_x': 1, }),
+@pytest.mark.parametrize('path, addparams, values', [
+    ('example1_if', {}, ["'ABC'"]),
+    ('example2_for', {}, []),
+    ('nested_for', {'xxxxx3_0_x': 0, 'xxxxx3_1_x': 1, }, [0, 0, 1, 1]),
 ])
-def test_parse_file(path, addparams, paramstyle):
+def test_parse_file(path, addparams, values, paramstyle):
     params = {'table_name': 'TABNAME',
               't_param': True, 'f_param': False,
               'c1': "'ABC'", 'c2': "'IJK'",
               'dct': {'k1': 'v1', 'k2': 'v2'}}
     input_path = absp(f'./data/input/{path}.sql')
     with unittest.mock.patch(UUID4PATH, mockid):
-        actual, rparam = twsp.parse_file(input_path, params, False, paramstyle=paramstyle)
+        actual, rparam = twsp.parse_file(input_path, params, False, paramstyle=paramstyle, stable_bind_names=False)
     pname = str(paramstyle.name).lower()
     exp = read(absp(f'./data/expected/{path}_{pname}.sql'))
     assert_sql_oneline(actual, exp, f'{path}_{pname}.sql')
-    assert_result_param(params, rparam, addparams)
+    if paramstyle.positional:
+        assert rparam == values
+    else:
+        assert_result_param(params, rparam, addparams)
+
+
+@pytest.mark.parametrize('paramstyle', twsp.ParamStyle)
+@pytest.mark.parametrize('path', ['example1_if', 'example2_for', 'nested_for'])
+def test_compile_file_render(path, paramstyle):
+    params = {'table_name': 'TABNAME',
+              't_param': True, 'f_param': False,
+              'c1': "'ABC'", 'c2': "'IJK'",
+              'dct': {'k1': 'v1', 'k2': 'v2'}}
+    input_path = absp(f'./data/input/{path}.sql')
+    tpl = twsp.compile_file(input_path, False)
+    pname = str(paramstyle.name).lower()
+    exp = read(absp(f'./data/expected/{path}_{pname}.sql'))
+    for _ in range(2):
+        with unittest.mock.patch(UUID4PATH, mockid):
+            actual, rparam = tpl.render(params, paramstyle, stable_bind_names=False)
+        assert_sql_oneline(actual, exp, f'{path}_{pname}.sql')
+        reset_count()
 
 
-@pytest.mark.parametrize('s, i, expected', [
-    ('hoge', 0, ('hoge', 'hoge', 4)),
-    ('hoge', 1, ('oge', 'oge', 4)),
-    ('hoge', 2, ('ge', 'ge', 4)),
-    ('hoge', 3, ('e', 'e', 4)),
-    # ('ho/*end*/ge', 0, 'ho'),
-    # ('"ho/*end*/"ge', 0, '"ho/*end*/"ge', -1, 13),
+@pytest.mark.parametrize('delete_comment', DELETE_PATTERN)
+def test_compile_render_same_as_parse_sql(delete_comment):
+    base_sql = """\
+select /*:p1*/'x' -- comment
+  from /*$p2*/tbl /* normal */
+ where 1 = 1
+  /*%if p1*/
+   and c1 = /*:p1*/'x'
+  /*end*/
+  /*%for k, v in px2.items()*/
+   and /*$k*/c = /*:v*/'y'
+  /*end*/
+"""
+    params = {'p1': 'A', 'p2': 'B', 'px2': {'a': 'ho', 'b': 'ge'}}
+    tpl = twsp.compile(base_sql, delete_comment)
+    assert tpl.sql == base_sql
+    assert tpl.delete_comment is delete_comment
+    with unittest.mock.patch(UUID4PATH, mockid):
+        expected = twsp.parse_sql(base_sql, params, delete_comment)
+    reset_count()
+    with unittest.mock.patch(UUID4PATH, mockid):
+        actual = tpl.render(params)
+    assert actual == expected
+    assert params == {'p1': 'A', 'p2': 'B', 'px2': {'a': 'ho', 'b': 'ge'}}
+
+
+def test_compile_nodes():
+    tpl = twsp.compile("select /*:p1*/'x' from a where /*%if p2*/b = /*$p3*/0/*end*/")
+    assert [type(n) for n in tpl.nodes] == [template.TextNode, template.ParamNode,
+                                            template.TextNode, template.IfNode]
+    assert tpl.nodes[1].name == 'p1'
+    if_node = tpl.nodes[3]
+    assert if_node.statement == 'if p2'
+    assert [type(n) for n in if_node.body] == [template.TextNode, template.DirectNode]
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('/*%if a*/\n x\n/*end*/  \nfrom', 3),
+    ('/*%if a*/\n x = /*:p*/1\n  /*end*/\nfrom', 1),
+    ('/*%if a*/ x = /*:p*/1  /*end*/\nfrom', 0),
+    ('/*%if a*//*end*/\nfrom', 1),
+    ('/*%if a*/ x /*end*/ from', 0),
+    ('/*%for v in vals*/\n x /*$v*/\n/*end*/\nfrom', 1),
+    # 末尾の if/for は、出力する場合としない場合のいずれも同じ
+    ('/*%if a*/ x\n  /*%if b*/y\n/*end*/\n/*end*/\nfrom', 1),
+    ('/*%if a*/\n  /*%for v in vs*/\n  , /*:v*/1\n  /*end*/\n/*end*/\nfrom', 1),
+    ('/*%if a*/\n  /*%if b*/\n  y\n  /*%else*/\n  z\n  /*end*/\n/*end*/\nfrom', 1),
+    # 本文の出力によって変わる場合
+    ('/*%if a*/\n x /*$p*//*end*/\nfrom', None),
+    ('/*%if a*/\n  /*%if b*/y/*end*//*end*/\nfrom', None),
 ])
-def test__next_chars(s, i, expected):
-    m = len(s)
-    actual = twsp._next_chars(s, i, m)
+def test_compile_end_skip(sql, expected):
+    assert twsp.compile(sql).nodes[0].end_skip == expected
+
+
+def test_false_branch_is_not_evaluated():
+    sql = ('select 1\n/*%if False*/\n  /*%if undefined*/x/*end*/\n  /*%for v in 1 / 0*/, /*:v*/0/*end*/\n'
+           '  y\n/*end*/\nfrom a')
+    assert twsp.compile(sql).render({'p': 1}) == ('select 1\nfrom a', {'p': 1})
+
+
+@pytest.mark.parametrize('inner', ['/*%if b.x == 1*/\n  and x = 1\n  /*end*/',
+                                   '/*%for v in b.vals*/\n  and x = /*:v*/1\n  /*end*/',
+                                   '/*%if b.x == 1*/\n  and x = 1\n  /*%elif b.x == 2*/\n  and x = 2\n  /*end*/'])
+def test_false_guard_of_nested_block(inner):
+    # 本文の末尾が if/for の場合も、偽の分岐の内側の式は評価しない
+    sql = f'select 1\n/*%if b is not None*/\n  {inner}\n/*end*/\nfrom a'
+    assert twsp.compile(sql).render({'b': None}) == ('select 1\nfrom a', {'b': None})
+
+
+@pytest.mark.parametrize('paramstyle', twsp.ParamStyle)
+def test_false_branch_adds_no_params(paramstyle):
+    sql = 'select 1\n/*%if a*/\n  /*%for v in vals*/, /*:v*/0/*end*/ /*$d*/\n/*end*/\nfrom a'
+    _, rparam = twsp.compile(sql).render({'a': False, 'vals': [1, 2], 'd': ''}, paramstyle)
+    assert rparam == ([] if paramstyle.positional else {'a': False, 'vals': [1, 2], 'd': ''})
+
+
+IF_CHAIN_SQL = """\
+select *
+  from t
+ where 1 = 1
+  /*%if kind == 'id'*/
+   and id = /*:value*/0
+  /*%elif kind == 'ids'*/
+   and id in (/*%for v in value*//*:v*/0, /*end*/-1)
+  /*%elif kind == 'name'*/
+   and name = /*:value*/'x'
+  /*%else*/
+   and /*$kind*/ is null
+  /*end*/
+ order by id
+"""
+
+# IF_CHAIN_SQL と同じ分岐を、互いに排他な条件の if を並べて書いたもの
+PAIRED_IF_SQL = """\
+select *
+  from t
+ where 1 = 1
+  /*%if kind == 'id'*/
+   and id = /*:value*/0
+  /*end*/
+  /*%if kind == 'ids'*/
+   and id in (/*%for v in value*//*:v*/0, /*end*/-1)
+  /*end*/
+  /*%if kind == 'name'*/
+   and name = /*:value*/'x'
+  /*end*/
+  /*%if kind not in ('id', 'ids', 'name')*/
+   and /*$kind*/ is null
+  /*end*/
+ order by id
+"""
+
+
+@pytest.mark.parametrize('query_params, expected', [
+    ({'kind': 'id', 'value': 1}, '   and id = :value\n'),
+    ({'kind': 'ids', 'value': [1, 2]}, '   and id in (:__f0_0_v, :__f0_1_v, -1)\n'),
+    ({'kind': 'name', 'value': 'x'}, '   and name = :value\n'),
+    ({'kind': 'deleted_at', 'value': None}, '   and deleted_at is null\n'),
+])
+def test_if_chain(query_params, expected):
+    actual = twsp.parse_sql(IF_CHAIN_SQL, query_params)
+    assert actual[0] == f'select *\n  from t\n where 1 = 1\n{expected} order by id\n'
+    # for の名前は分岐によらず、テンプレート内の出現順
+    assert actual == twsp.parse_sql(PAIRED_IF_SQL, query_params)
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('select\n  /*%if a*/\n  x\n  /*%elif b*/\n  y\n  /*end*/\nfrom', 'select\nfrom'),
+    ('select\n  /*%if a*/ x /*%elif b*/\n  y\n  /*end*/\nfrom', 'select\nfrom'),
+    ('select\n  /*%if a*/\n  x\n  /*%elif b*/ y /*end*/\nfrom', 'select\n  \nfrom'),
+])
+def test_if_chain_all_false(sql, expected):
+    # いずれの分岐も出力しない場合、最後の分岐が偽の if と同じ
+    assert twsp.parse_sql(sql, {'a': False, 'b': False})[0] == expected
+
+
+def test_if_chain_stops_at_first_true():
+    sql = 'select /*%if a*/1/*%elif undefined*/2/*%elif 1 / 0*/3/*%else*/4/*end*/ from t'
+    tpl = twsp.compile(sql)
+    assert tpl.render({'a': True})[0] == 'select 1 from t'
+    with pytest.raises(internal_exceptions.TwspExecuteError):
+        tpl.render({'a': False})
+
+
+@pytest.mark.parametrize('paramstyle', [p for p in twsp.ParamStyle if p.positional])
+def test_if_chain_adds_chosen_params(paramstyle):
+    sql = 'select 1 /*%if a*/, /*:p*/0/*%elif b*/, /*:q*/0/*%else*/, /*:r*/0/*end*/'
+    _, rparam = twsp.parse_sql(sql, {'a': False, 'b': True, 'p': 1, 'q': 2, 'r': 3}, paramstyle=paramstyle)
+    assert rparam == [2]
+
+
+def test_compile_if_chain_nodes():
+    tpl = twsp.compile('/*%if a*/1/*%elif b*//*%for v in c*/2/*end*//*%else*/3/*end*/ /*%for v in d*//*end*/')
+    if_node = tpl.nodes[0]
+    assert if_node.statement == 'if a'
+    assert [n.statement for n in if_node.orelse] == ['if b', None]
+    assert [n.orelse for n in if_node.orelse] == [(), ()]
+    assert if_node.orelse[0].body[0].loop_id == 0 and tpl.nodes[2].loop_id == 1
+
+
+@pytest.mark.parametrize('sql', [
+    '/*%if a*/1/*%else*/2/*%elif b*/3/*end*/',
+    '/*%if a*/1/*%else*/2/*%else*/3/*end*/',
+])
+def test_if_chain_else_must_be_last(sql):
+    with pytest.raises(internal_exceptions.TwspException):
+        twsp.compile(sql)
+
+
+def test_expression_cache():
+    tpl = twsp.compile("select 1/*%for a in px1*//*%if a % 2 == 1*/, /*$a*/0/*end*//*end*/ from a")
+    template._compile_expression.cache_clear()
+    for _ in range(3):
+        actual, _ = tpl.render({'px1': [1, 2, 3]})
+        assert actual == 'select 1, 1, 3 from a'
+    info = twsqlparser.expression_cache_info()
+    # for の式と if の式がそれぞれ1回だけコンパイルされる
+    assert info.misses == 2
+    assert info.hits == 3 * (1 + 3) - 2
+    assert info.currsize == 2
+
+
+def test_stable_bind_names():
+    sql = ('select 1 /*%for a in px1*/, (/*%for b in px2*//*:b*/0/*end*/) /*:a*/0/*end*/'
+           ' /*%for c in px2*/, /*:c*/0/*end*/')
+    params = {'px1': [1, 2], 'px2': ['x', 'y']}
+    expected = ('select 1 , (:__f1_0_0_b:__f1_0_1_b) :__f0_0_a, (:__f1_1_0_b:__f1_1_1_b) :__f0_1_a'
+                ', :__f2_0_c, :__f2_1_c')
+    tpl = twsp.compile(sql)
+    actual, rparam = tpl.render(params)
+    assert actual == expected
+    assert rparam == {**params, '__f0_0_a': 1, '__f0_1_a': 2, '__f1_0_0_b': 'x', '__f1_0_1_b': 'y',
+                      '__f1_1_0_b': 'x', '__f1_1_1_b': 'y', '__f2_0_c': 'x', '__f2_1_c': 'y'}
+    # 同じテンプレートを何度描画しても、同じSQLになる
+    assert tpl.render(params)[0] == actual
+    assert twsp.parse_sql(sql, params)[0] == actual
+
+
+def test_stable_bind_names_disabled():
+    with unittest.mock.patch(UUID4PATH, mockid):
+        actual, rparam = twsp.parse_sql('select /*%for a in px*/ /*:a*/0/*end*/', {'px': [1]},
+                                        stable_bind_names=False)
+    assert actual == 'select  :xxxxx0_0_a'
+    assert rparam == {'px': [1], 'xxxxx0_0_a': 1}
+
+
+def test_copy_params_false():
+    ids = list(range(5))
+    params = {'ids': ids, 'px1': [{'k': 'a'}, {'k': 'b'}]}
+    sql = 'select * from a where id in /*:ids*/(1) /*%for p in px1*/or k = /*:p*/0 /*end*/'
+    copied = twsp.parse_sql(sql, params)
+    actual, rparam = twsp.parse_sql(sql, params, copy_params=False)
+    assert actual == copied[0]
+    assert dict(rparam) == copied[1]
+    # 呼び出し元の値はコピーされず、呼び出し元のdictも変更されない
+    assert rparam['ids'] is ids
+    assert rparam['__f0_0_p'] is params['px1'][0]
+    assert params == {'ids': ids, 'px1': [{'k': 'a'}, {'k': 'b'}]}
+    assert rparam.maps[0] == {'__f0_0_p': {'k': 'a'}, '__f0_1_p': {'k': 'b'}}
+
+
+@pytest.mark.parametrize('params', [None, {}])
+def test_copy_params_false_empty(params):
+    actual, rparam = twsp.parse_sql('select /*:a*/1', params, copy_params=False)
+    assert actual == 'select :a'
+    assert dict(rparam) == {}
+
+
+def test_copy_params_false_wrong_type():
+    with pytest.raises(internal_exceptions.TwspValidateError):
+        twsp.compile('select 1').render(['a'], copy_params=False)
+
+
+@pytest.mark.parametrize('copy_params', [True, False])
+def test_loop_variable_shadows_query_param(copy_params):
+    sql = 'select /*%for v in vals*//*%if v == "x"*/[/*$v*/]/*end*//*%for w in v*/ /*$w*//*$p*//*end*/,/*end*/ /*$v*/'
+    actual, _ = twsp.parse_sql(sql, {'v': 'y', 'vals': ['ab', 'x'], 'p': '.'}, copy_params=copy_params)
+    assert actual == 'select  a. b.,[x] x., y'
+
+
+def test_loop_scope_name_error():
+    with pytest.raises(internal_exceptions.TwspExecuteError):
+        twsp.compile('/*%for v in vals*//*%if v and undefined*/x/*end*//*end*/').render({'vals': [1]})
+
+
+def test_loop_scope_mapping():
+    qparams = {'a': 1, 'v': 2}
+    scope = template._Scope(qparams, {'v': {template._TN: '__f0_0_v', template._VL: 3}})
+    assert dict(scope) == {'a': 1, 'v': 3} and len(scope) == 2
+    # query_params はコピーせずに参照する
+    qparams['b'] = 4
+    assert scope['b'] == 4
+
+
+def test_render_many():
+    tpl = twsp.compile('update a set /*%for c in cols*/ /*$c*/c = /*:c*/1,/*end*/ u = 1 where id = /*:id*/0'
+                       '/*%if ver is not None*/ and ver = /*:ver*/0/*end*/')
+    rows = [{'id': 1, 'cols': ['x'], 'ver': None},
+            {'id': 2, 'cols': ['x'], 'ver': 3},
+            {'id': 3, 'cols': ['x'], 'ver': None},
+            {'id': 4, 'cols': ['x', 'y'], 'ver': None},
+            {'id': 5, 'cols': ['x'], 'ver': None}]
+    actual = list(twsqlparser.render_many(tpl, iter(rows), batch_size=2))
+    assert [(sql, [p['id'] for p in params]) for sql, params in actual] == [
+        ('update a set  x = :__f0_0_c, u = 1 where id = :id', [1, 3]),
+        ('update a set  x = :__f0_0_c, u = 1 where id = :id and ver = :ver', [2]),
+        ('update a set  x = :__f0_0_c, y = :__f0_1_c, u = 1 where id = :id', [4]),
+        ('update a set  x = :__f0_0_c, u = 1 where id = :id', [5]),
+    ]
+    assert actual[2][1][0] == {**rows[3], '__f0_0_c': 'x', '__f0_1_c': 'y'}
+
+
+def test_render_many_is_lazy():
+    consumed = []
+
+    def gen():
+        for i in range(10):
+            consumed.append(i)
+            yield {'a': i}
+    batches = twsqlparser.render_many(twsp.compile('select /*:a*/1'), gen(), twsp.ParamStyle.PYFORMAT, 3)
+    assert next(batches) == ('select %(a)s', [{'a': 0}, {'a': 1}, {'a': 2}])
+    assert consumed == [0, 1, 2]
+    assert [len(params) for _, params in batches] == [3, 3, 1]
+
+
+def test_render_many_wrong_paramstyle():
+    with pytest.raises(internal_exceptions.TwspValidateError):
+        twsqlparser.render_many(twsp.compile('select 1'), [], 'xxx')
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_iter_render_same_as_render(newline):
+    sql = """\
+select *
+  from a
+ where 1 = 1
+  /*%for k, v in px2.items()*/
+   and /*$k*/col = /*:v*/0 \t
+  /*end*/
+  /*%if px1*/
+   and b in /*:px1*/(1, 2)\x20\x20\x20
+  /*end*/\x20\x20
+""".replace('\n', newline)
+    tpl = twsp.compile(sql, newline=newline)
+    params = {'px1': [1, 2], 'px2': {'a': 'ho', 'b': 'ge'}}
+    fragments, rparam = tpl.iter_render(params)
+    assert ''.join(fragments) == tpl.render(params)[0]
+    assert rparam == tpl.render(params)[1]
+    stream = io.StringIO()
+    assert tpl.render_to(stream, params, twsp.ParamStyle.PYFORMAT) == rparam
+    assert stream.getvalue() == tpl.render(params, twsp.ParamStyle.PYFORMAT)[0]
+
+
+@pytest.mark.parametrize('paramstyle', [twsp.ParamStyle.NAMED, twsp.ParamStyle.QMARK])
+def test_render_without_generators(paramstyle):
+    sql = """\
+select *
+  from a
+ where b in /*:px1*/(1)
+  /*%if px1 is None*/
+   and c = /*:c*/0
+  /*%elif px2*/
+  /*%for k, v in px2.items()*/
+   and /*$k*/col = /*:v*/0 \t
+  /*end*/
+  /*%else*/
+   and d = 1
+  /*end*/\x20\x20
+"""
+    tpl = twsp.compile(sql)
+    params = {'px1': [1, 2, 3], 'px2': {'a': 'ho', 'b': 'ge'}}
+    buckets1, buckets2 = twsqlparser.InListBuckets((4, )), twsqlparser.InListBuckets((4, ))
+    fragments, rparam = tpl.iter_render(params, paramstyle, in_buckets=buckets1)
+    expected = ''.join(fragments)
+    # render はジェネレータを連ねずに構築する
+    with unittest.mock.patch('twsqlparser.template._stream_root') as stream_root:
+        actual = tpl.render(params, paramstyle, in_buckets=buckets2)
+    stream_root.assert_not_called()
+    assert actual == (expected, rparam)
+    assert buckets2.shape_count == buckets1.shape_count == 1
+
+
+def test_iter_render_lazy_loop_source():
+    consumed = []
+
+    def rows():
+        for i in range(3):
+            consumed.append(i)
+            yield i
+    tpl = twsp.compile('select 1/*%for r in rows*/, /*:r*/0/*end*/')
+    fragments, rparam = tpl.iter_render({'rows': rows()}, copy_params=False)
+    assert next(fragments) == 'select 1'
+    # 末尾の空白は次の出力まで保留する
+    assert next(fragments) == ','
+    assert next(fragments) == ' :__f0_0_r'
+    assert consumed == [0]
+    assert ''.join(fragments) == ', :__f0_1_r, :__f0_2_r'
+    assert dict(rparam) == {'rows': rparam['rows'], '__f0_0_r': 0, '__f0_1_r': 1, '__f0_2_r': 2}
+
+
+def test_iter_render_loop_source_error():
+    def rows():
+        yield 1
+        raise ValueError('broken')
+    tpl = twsp.compile('select 1/*%for r in rows*/, /*:r*/0/*end*/')
+    with pytest.raises(internal_exceptions.TwspExecuteError):
+        tpl.render({'rows': rows()}, copy_params=False)
+
+
+@pytest.mark.parametrize('sql, expected', [
+    # if の条件からも query_params を参照できる (Python のバージョンによらない)
+    ('/*%for x in lst if x > lim*/, /*$x*//*end*/', ', 3, 4'),
+    ('/*%for x in lst if x > lim if x % 2 == 0*/, /*$x*//*end*/', ', 4'),
+    ('/*%for k, v in pairs.items() if v != lim*/, /*$k*//*$v*//*end*/', ', a1, c3'),
+    ('/*%for x in lst if x <= lim for y in lst if y < x*/, /*$x*//*end*/', ', 2'),
+])
+def test_for_statement_scope(sql, expected):
+    params = {'lst': [1, 2, 3, 4], 'lim': 2, 'pairs': {'a': 1, 'b': 2, 'c': 3}}
+    actual, _ = twsp.parse_sql('select 0' + sql, params)
+    assert actual == 'select 0' + expected
+
+
+@pytest.mark.parametrize('for_statement', [
+    'for k, v in lst',
+    'for x.y in lst',
+    'for x in lst if',
+    'for x in lst if x > undefined',
+])
+def test_for_statement_error(for_statement):
+    with pytest.raises(internal_exceptions.TwspExecuteError):
+        twsp.compile(f'select 0/*%{for_statement}*/, /*$x*//*end*/').render({'lst': [1, 2]})
+
+
+def test_render_to_peak_memory():
+    # 出力全体ではなく、断片1つ分のメモリで出力できることを確認する
+    class CountingStream:
+        size = 0
+
+        def write(self, s):
+            self.size += len(s)
+    tpl = twsp.compile('insert into a values\n/*%for r in rows*/(/*$r*/0, \'abcdefghijklmnopqrstuvwxyz\'),\n/*end*/')
+    stream = CountingStream()
+    tracemalloc.start()
+    tpl.render_to(stream, {'rows': iter(range(20000))}, copy_params=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert 5 * 10 ** 5 < stream.size
+    assert peak < stream.size / 20, (peak, stream.size)
+
+
+POSITIONAL_SQL = """\
+select * from t where a = /*:a*/1
+/*%if b*/ and b = /*:b*/2 /*end*/
+/*%if not b*/ and c = /*:c*/3 /*end*/
+/*%for x in xs*/ or x = /*:x*/4 or a = /*:a*/5
+/*end*/"""
+
+
+@pytest.mark.parametrize('paramstyle, placeholders', [
+    (twsp.ParamStyle.QMARK, ('?', '?', '?', '?', '?', '?')),
+    (twsp.ParamStyle.NUMERIC, (':1', ':2', ':3', ':4', ':5', ':6')),
+    (twsp.ParamStyle.DOLLAR_NUMERIC, ('$1', '$2', '$3', '$4', '$5', '$6')),
+    (twsp.ParamStyle.FORMAT, ('%s', '%s', '%s', '%s', '%s', '%s')),
+])
+def test_positional_paramstyle(paramstyle, placeholders):
+    params = {'a': 1, 'b': 'B', 'xs': [10, 20]}
+    expected = ('select * from t where a = {}\n and b = {} \n\n or x = {} or a = {}\n or x = {} or a = {}\n'
+                .format(*placeholders))
+    assert paramstyle.positional
+    # 出力しない if の内側のパラメータ c は、 query_params に無くてもリストに含めない
+    assert twsp.parse_sql(POSITIONAL_SQL, params, paramstyle=paramstyle) == (expected, [1, 'B', 10, 1, 20, 1])
+    assert params == {'a': 1, 'b': 'B', 'xs': [10, 20]}
+
+
+def test_positional_paramstyle_sqlite3():
+    import sqlite3
+    conn = sqlite3.connect(':memory:')
+    conn.execute('create table t (a, b)')
+    conn.executemany('insert into t values (?, ?)', [(i, i % 3) for i in range(10)])
+    tpl = twsp.compile('select a from t where b = /*:b*/0 and a in (/*%for a in as_*//*:a*/0, /*end*/-1) order by a')
+    sql, values = tpl.render({'b': 1, 'as_': [1, 2, 4, 7]}, twsp.ParamStyle.QMARK)
+    assert values == [1, 1, 2, 4, 7]
+    assert conn.execute(sql, values).fetchall() == [(1, ), (4, ), (7, )]
+
+
+def test_positional_paramstyle_not_found():
+    tpl = twsp.compile('select /*:a*/1, /*:b*/2')
+    with pytest.raises(internal_exceptions.TwspExecuteError):
+        tpl.render({'a': 1}, twsp.ParamStyle.QMARK)
+
+
+@pytest.mark.parametrize('paramstyle', [twsp.ParamStyle.NAMED, twsp.ParamStyle.PYFORMAT])
+def test_named_paramstyle_is_not_positional(paramstyle):
+    assert not paramstyle.positional
+
+
+ARRAY_SQL = "select * from t where id in /*:ids[]*/(1, 2, 3) and kind not in /*:kinds[]*/('x') order by id"
+EXPANDED_SQL = """\
+select * from t where id in (/*%for i in ids*//*:i*/0, /*end*/null) \
+and kind not in (/*%for k in kinds*//*:k*/'x', /*end*/null) order by id"""
+
+
+@pytest.mark.parametrize('paramstyle', [twsp.ParamStyle.NAMED, twsp.ParamStyle.PYFORMAT,
+                                        twsp.ParamStyle.DOLLAR_NUMERIC])
+@pytest.mark.parametrize('count', [1, 3, 1000])
+def test_array_param_same_as_expanded(paramstyle, count):
+    params = {'ids': list(range(count)), 'kinds': ['a', 'b']}
+    array_sql, array_params = twsp.parse_sql(ARRAY_SQL, params, paramstyle=paramstyle)
+    expanded_sql, expanded_params = twsp.parse_sql(EXPANDED_SQL, params, paramstyle=paramstyle)
+    # 展開した IN 句を配列パラメータに置き換えると、配列のSQLと同じになる
+    fmt = paramstyle.value.format
+    if paramstyle.positional:
+        in_ids = ', '.join(fmt('', i + 1) for i in range(count))
+        in_kinds = ', '.join(fmt('', i + count + 1) for i in range(2))
+        any_ids, all_kinds = fmt('', 1), fmt('', 2)
+        assert array_params == [params['ids'], params['kinds']]
+        assert expanded_params == [*params['ids'], *params['kinds']]
+    else:
+        in_ids = ', '.join(fmt(f'__f0_{i}_i') for i in range(count))
+        in_kinds = ', '.join(fmt(f'__f1_{i}_k') for i in range(2))
+        any_ids, all_kinds = fmt('ids'), fmt('kinds')
+        # 要素ごとの一時パラメータは作成しない
+        assert array_params == params
+        assert [expanded_params[f'__f0_{i}_i'] for i in range(count)] == params['ids']
+    assert array_sql == (expanded_sql.replace(f'id in ({in_ids}, null)', f'id = ANY({any_ids})')
+                         .replace(f'kind not in ({in_kinds}, null)', f'kind <> ALL({all_kinds})'))
+
+
+def test_array_param_sql_is_constant():
+    tpl = twsp.compile(ARRAY_SQL)
+    small = tpl.render({'ids': [1], 'kinds': []})
+    large = tpl.render({'ids': list(range(10000)), 'kinds': ['a']})
+    assert small[0] == large[0] == 'select * from t where id = ANY(:ids) and kind <> ALL(:kinds) order by id'
+
+
+@pytest.mark.parametrize('q, expected', [
+    ("select * from t where id = any(/*:ids[]*/'{1, 2}')", 'select * from t where id = any(:ids)'),
+    ('select * from t where id in/*:ids[]*/(1, 2)', 'select * from t where id = ANY(:ids)'),
+    ('select * from t where (a, b) in /*:ids[]*/(1, 2)', 'select * from t where (a, b) = ANY(:ids)'),
+    ('select * from join /*:ids[]*/(1, 2)', 'select * from join :ids'),
+    ('select /*:a*/1 /*%for x in xs*/ from t where id in /*:x[]*/(1)/*end*/',
+     'select :a from t where id = ANY(:__f0_0_x)'),
+])
+def test_array_param(q, expected):
+    actual, _ = twsp.parse_sql(q, {'a': 1, 'ids': [1, 2], 'xs': [[1, 2]]})
     assert actual == expected
 
 
+def test_compile_unclosed_comment():
+    with pytest.raises(internal_exceptions.TwspException):
+        twsp.compile('select /* 1 from a')
+
+
 def assert_sql_oneline(a: str, e: str, param=None):
     actual = repcrlf(a)
     expected = repcrlf(e)
@@ -2,7 +2,17 @@
 # (C) 2020 gomachssm
 
 from . import internal_exceptions
-from .twsp import parse_sql, parse_file, logger
-from .twsp import NEWLINE_CHAR
+from .twsp import parse_sql, parse_file, compile, compile_file, render_many, logger
+from .twsp import NEWLINE_CHAR, file_cache, file_cache_info
+from .cache import FileCache, FileCacheInfo, RenderCache, RenderCacheInfo
+from .template import Template, expression_cache_info
+from .bulk import render_chunks
+from .engine import Engine
+from .registry import SqlRegistry
+from .diskcache import DiskCache
+from .buckets import InListBuckets
+from .instrument import stats, enable_stats, disable_stats, reset_stats, PhaseStats
+from .instrument import register_stats_callback, unregister_stats_callback
+from .aio import parse_file_async, compile_file_async
 from .enums import ParamStyle
 from .__pkg_info__ import __author__, __copyright__, __license__, __url__, __version__  # noqa: F401
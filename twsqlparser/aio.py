@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import asyncio
+import functools
+
+from . import twsp
+from .internal_exceptions import TwspException
+from .template import Template, _is_collect_type
+
+# 読み込み中のテンプレート {(イベントループ, ファイルパス, delete_comment, encoding, newline): Future}
+_inflight = {}
+
+
+async def compile_file_async(file_path: str, delete_comment=True, encoding='utf-8', newline='\n',
+                             executor=None) -> Template:
+    """SQLファイルをイベントループを止めずに読み込み、再利用可能なテンプレートを作成する
+
+    キャッシュ済みのファイルはイベントループ上でそのまま返し、それ以外は executor で読み込む。
+    同じファイルを同時に読み込む場合、2つ目以降は1つ目の読み込みの完了を待ち、同じテンプレートを返す。
+
+    Args:
+        file_path (str): 実行対象SQLのファイルパス(必須)
+        delete_comment (bool): `twsqlparser.compile_file` 参照
+        encoding (str): `twsqlparser.compile_file` 参照
+        newline (str): `twsqlparser.compile_file` 参照
+        executor (concurrent.futures.Executor): 読み込みに利用する Executor None の場合はイベントループの既定
+    Returns:
+        Template: コンパイル済みのテンプレート
+    """
+    _is_collect_type('file_path', file_path, str)
+    base_sql = twsp.file_cache.peek(file_path, encoding)
+    if base_sql is not None:
+        return twsp._compile_cache(base_sql, delete_comment, newline, file_path)
+    loop = asyncio.get_event_loop()
+    key = (loop, file_path, delete_comment, encoding, newline)
+    future = _inflight.get(key)
+    if future is None:
+        future = loop.run_in_executor(executor, twsp.compile_file, file_path, delete_comment, encoding, newline)
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    # 待っている1つのコルーチンがキャンセルされても、他のコルーチンの読み込みは続ける
+    return await asyncio.shield(future)
+
+
+async def parse_file_async(file_path: str, query_params=None, delete_comment=True, encoding='utf-8', newline='\n',
+                           paramstyle=None, stable_bind_names=True, copy_params=True, in_buckets=None,
+                           render_cache=None, render_in_executor=False, executor=None) -> (str, dict):
+    """`twsqlparser.parse_file` と同じ解析を、ファイルの読み込み中にイベントループを止めずに行う
+
+    Args:
+        file_path (str): `twsqlparser.parse_file` 参照
+        query_params (dict): `twsqlparser.parse_file` 参照
+        delete_comment (bool): `twsqlparser.parse_file` 参照
+        encoding (str): `twsqlparser.parse_file` 参照
+        newline (str): `twsqlparser.parse_file` 参照
+        paramstyle (ParamStyle): `twsqlparser.parse_file` 参照
+        stable_bind_names (bool): `twsqlparser.parse_file` 参照
+        copy_params (bool): `twsqlparser.parse_file` 参照
+        in_buckets (InListBuckets): `twsqlparser.parse_file` 参照
+        render_cache (RenderCache): `twsqlparser.parse_file` 参照
+        render_in_executor (bool): True の場合、SQLの構築も executor で行う
+            大きなテンプレートの構築でイベントループを止めたくない場合に指定する (デフォルトは False)
+        executor (concurrent.futures.Executor): `compile_file_async` 参照
+    Returns:
+        tuple(str, dict): `twsqlparser.parse_file` と同じ
+    """
+    try:
+        template = await compile_file_async(file_path, delete_comment, encoding, newline, executor)
+        render = functools.partial(template.render, query_params, paramstyle, stable_bind_names, copy_params,
+                                   in_buckets, render_cache)
+        if not render_in_executor:
+            return render()
+        return await asyncio.get_event_loop().run_in_executor(executor, render)
+    except TwspException as e:
+        twsp.logger.error(e)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import hashlib
+import threading
+
+from .internal_exceptions import Msg, TwspValidateError
+
+FILL_LAST = 'last'
+FILL_NULL = 'null'
+
+
+class InListBuckets:
+    """ IN 句のリスト展開の件数を決まった段階まで埋める設定と、構築したSQLの種類数
+
+    リストの件数ごとに異なるSQLになると、DBのプリペアドステートメントのキャッシュが効かない。
+    件数を段階に揃えることで、テンプレートごとのSQLの種類を log(n) 程度に抑える。
+    対象は `in (` の直後にある /*%for*/ と、 `in` の直後にある list, tuple のバインドパラメータ。
+    `not in` のリストに NULL を含むと条件が真にならないため、 fill によらず最後の値で埋める。
+    """
+    __slots__ = ('_sizes', '_fill', '_shapes', '_lock', '_not_in')
+
+    def __init__(self, sizes=None, fill=FILL_LAST):
+        """
+        Args:
+            sizes (iterable): 件数の段階 ex: (10, 50, 100) None の場合は 1, 2, 4, 8, ... の2の累乗
+                最大の段階を超える件数は、最大の段階の倍数まで埋める
+                空の場合は件数を埋めず、SQLの種類数のみ数える
+            fill (str): 埋める値 'last' の場合は最後の値を繰り返し、 'null' の場合は None ( `not in` 以外のみ)
+        """
+        if fill not in (FILL_LAST, FILL_NULL):
+            raise TwspValidateError(Msg.E0001, 'fill', f"'{FILL_LAST}' or '{FILL_NULL}'", fill)
+        if sizes is not None:
+            sizes = tuple(sizes)
+            # 並べ替える前に検証し、比較できない値も同じ例外にする
+            if not all(type(size) is int and 1 <= size for size in sizes):
+                raise TwspValidateError(Msg.E0016, sizes)
+        self._sizes = None if sizes is None else tuple(sorted(set(sizes)))
+        self._fill = fill
+        self._shapes = set()
+        self._lock = threading.Lock()
+        self._not_in = self if fill == FILL_LAST else self._fill_last()
+
+    @property
+    def sizes(self) -> tuple:
+        return self._sizes
+
+    @property
+    def fill(self) -> str:
+        return self._fill
+
+    @property
+    def shape_count(self) -> int:
+        """これまでに構築したSQLの種類数"""
+        return len(self._shapes)
+
+    def for_not_in(self) -> 'InListBuckets':
+        """`not in` のリストを埋める設定を返す 最後の値で埋め、SQLの種類数は元の設定と共有する"""
+        return self._not_in
+
+    def _fill_last(self) -> 'InListBuckets':
+        buckets = InListBuckets.__new__(InListBuckets)
+        buckets._sizes, buckets._fill, buckets._not_in = self._sizes, FILL_LAST, buckets
+        buckets._shapes, buckets._lock = self._shapes, self._lock
+        return buckets
+
+    def reset(self):
+        """SQLの種類数を 0 に戻す"""
+        with self._lock:
+            self._shapes.clear()
+
+    def bucket_size(self, count: int) -> int:
+        """count 件を埋めた後の件数を返す
+
+        Args:
+            count (int): リストの件数
+        Returns:
+            int: count 以上の最小の段階 0件の場合は 0
+        """
+        if count <= 0:
+            return count
+        if self._sizes is None:
+            return 1 << (count - 1).bit_length()
+        if not self._sizes:
+            return count
+        for size in self._sizes:
+            if count <= size:
+                return size
+        largest = self._sizes[-1]
+        return -(-count // largest) * largest
+
+    def pad_loop(self, values, width: int):
+        """ループ対象を1件ずつ返し、最後に段階の件数まで埋める
+
+        Args:
+            values (iterable): ループ対象
+            width (int): ループ変数の個数 'null' の場合、2以上なら None のタプルで埋める
+        Returns:
+            generator: 埋めた後のループ対象
+        """
+        count, last = 0, None
+        for last in values:
+            count += 1
+            yield last
+        if count:
+            filler = last if self._fill == FILL_LAST else (None if width == 1 else (None, ) * width)
+            for _ in range(self.bucket_size(count) - count):
+                yield filler
+
+    def pad_value(self, value):
+        """list, tuple のパラメータを段階の件数まで埋める それ以外の値はそのまま返す"""
+        if type(value) not in (list, tuple) or not value:
+            return value
+        count = len(value)
+        filler = value[-1] if self._fill == FILL_LAST else None
+        return value + type(value)((filler, )) * (self.bucket_size(count) - count)
+
+    def record(self, fragments):
+        """SQLの断片をそのまま返し、最後まで読んだ時点でSQLの種類を記録する
+
+        Args:
+            fragments (iterable): SQLの断片
+        Returns:
+            generator: SQLの断片
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for fragment in fragments:
+            digest.update(fragment.encode('utf-8'))
+            yield fragment
+        with self._lock:
+            self._shapes.add(digest.digest())
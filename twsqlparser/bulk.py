@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import re
+from functools import lru_cache
+
+from .enums import ParamStyle
+from .internal_exceptions import Msg, TwspExecuteError, TwspValidateError
+from .template import Template, _validate_paramstyle
+
+
+def render_chunks(template: Template, query_params: dict, chunk_param: str, max_params=None, max_bytes=None,
+                  paramstyle: ParamStyle = None, copy_params=True):
+    """/*%for*/ でループするパラメータを分割し、上限を超えないSQLを順に構築する
+
+    複数行の insert などで、1つのSQLのバインドパラメータ数やサイズがドライバ、DBの上限を超えないようにする。
+    ex: PostgreSQL のバインドパラメータ数の上限は 65535
+    分割する件数は、0件と1件の場合のSQLの差分から決めるため、同じ件数の分割は同じSQLになる。
+    行によってSQLが変わり上限を超えた場合は、その分割をさらに半分に分けて構築する。
+
+    Args:
+        template (Template): コンパイル済みのテンプレート
+        query_params (dict): SQL実行時に利用するパラメータ
+        chunk_param (str): 分割するパラメータ名 query_params[chunk_param] は list か tuple
+        max_params (int): 1つのSQLに含めるバインドパラメータ(重複を除く)の最大数 None の場合は上限なし
+            位置指定の paramstyle の場合は、重複を含むパラメータの個数
+        max_bytes (int): 1つのSQLの最大バイト数(utf-8) None の場合は上限なし
+        paramstyle (ParamStyle): 解析後のSQLパラメータ書式を決める。未指定時は `NAMED` と同じ扱い
+        copy_params (bool): `twsqlparser.parse_sql` 参照
+    Returns:
+        generator: (str, dict) 分割ごとのSQLとパラメータ
+    """
+    pstyle = paramstyle or ParamStyle.NAMED
+    _validate_paramstyle(pstyle)
+    rows = (query_params or {}).get(chunk_param)
+    if type(rows) not in (list, tuple):
+        raise TwspValidateError(Msg.E0011, chunk_param, type(rows))
+    chunker = _Chunker(template, query_params, chunk_param, (max_params, max_bytes), pstyle, copy_params)
+    return chunker.chunks(rows)
+
+
+class _Chunker:
+    __slots__ = ('template', 'query_params', 'chunk_param', 'limits', 'pstyle', 'copy_params')
+
+    def __init__(self, template, query_params, chunk_param, limits, pstyle, copy_params):
+        self.template = template
+        self.query_params = query_params
+        self.chunk_param = chunk_param
+        self.limits = limits
+        self.pstyle = pstyle
+        self.copy_params = copy_params
+
+    def chunks(self, rows):
+        chunk_size = self._chunk_size(rows)
+        for start in range(0, len(rows), chunk_size):
+            yield from self._render_fit(rows[start:start + chunk_size])
+
+    def _chunk_size(self, rows) -> int:
+        # 0件と1件の場合の差分を1行あたりのコストとして、上限に収まる件数を求める
+        if not rows:
+            return 1
+        base = self._cost(self._render(rows[:0]))
+        one = self._cost(self._render(rows[:1]))
+        sizes = [(limit - b) // (o - b) for limit, b, o in zip(self.limits, base, one) if limit and b < o]
+        return max(1, min(sizes, default=len(rows)))
+
+    def _render_fit(self, rows):
+        rendered = self._render(rows)
+        if not self._exceeds(rendered):
+            yield rendered
+        elif len(rows) == 1:
+            raise TwspExecuteError(Msg.E0012, self.chunk_param, rows[0])
+        else:
+            half = len(rows) // 2
+            yield from self._render_fit(rows[:half])
+            yield from self._render_fit(rows[half:])
+
+    def _render(self, rows):
+        qparams = {**self.query_params, self.chunk_param: rows}
+        return self.template.render(qparams, self.pstyle, True, self.copy_params)
+
+    def _cost(self, rendered) -> tuple:
+        sql, qparams = rendered
+        if self.pstyle.positional:
+            # 位置指定の場合、パラメータは出現ごとに1つ
+            return len(qparams), len(sql.encode('utf-8'))
+        names = set(_placeholder_regex(self.pstyle).findall(sql))
+        return len(names.intersection(qparams)), len(sql.encode('utf-8'))
+
+    def _exceeds(self, rendered) -> bool:
+        return any(limit is not None and limit < cost for limit, cost in zip(self.limits, self._cost(rendered)))
+
+
+@lru_cache(maxsize=None)
+def _placeholder_regex(pstyle: ParamStyle):
+    # ex: NAMED ':{0}' -> r':(\w+)'
+    return re.compile(re.escape(pstyle.value).replace(re.escape('{0}'), r'(\w+)'))
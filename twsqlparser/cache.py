@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+FileCacheInfo = namedtuple('FileCacheInfo', ('hits', 'misses', 'evictions', 'reloads', 'currsize', 'currbytes'))
+
+# text: ファイルの内容, mtime_ns, size: 読み込み時のファイルの状態, checked_at: 最後にファイルの状態を確認した時刻
+_FileEntry = namedtuple('_FileEntry', ('text', 'mtime_ns', 'size', 'checked_at'))
+
+RenderCacheInfo = namedtuple('RenderCacheInfo', ('hits', 'misses', 'evictions', 'currsize', 'currbytes'))
+
+
+def get_cache_maxsize(env_name: str, default_size: int) -> int:
+    """環境変数からキャッシュの最大件数を取得する
+
+    Args:
+        env_name (str): 環境変数名
+        default_size (int): 環境変数が未設定、または数値ではない場合の件数
+    Returns:
+        int: キャッシュの最大件数
+    """
+    env_size = os.getenv(env_name)
+    try:
+        size = int(env_size)
+    except Exception:
+        size = None
+    return size if size else default_size
+
+
+def get_check_interval(env_name: str):
+    """環境変数からファイルの更新確認間隔(秒)を取得する
+
+    Args:
+        env_name (str): 環境変数名
+    Returns:
+        float or None: 確認間隔 環境変数が未設定、または数値ではない場合は None (確認しない)
+    """
+    try:
+        interval = float(os.getenv(env_name))
+    except Exception:
+        return None
+    return interval if 0 <= interval else None
+
+
+class FileCache:
+    """ SQLファイルの内容を保持するキャッシュ
+
+    件数と合計バイト数の両方で上限を設け、超えた場合は最も長く使われていないファイルから破棄する。
+    check_interval を指定した場合、前回の確認から指定秒数が経過したファイルは
+    読み込み時に mtime とサイズを確認し、変更されていれば読み直す。
+    複数のスレッドから同時に利用できる。
+    """
+
+    def __init__(self, max_entries=20, max_bytes=None, check_interval=None):
+        """
+        Args:
+            max_entries (int): 保持するファイルの最大件数
+            max_bytes (int): 保持するファイルの合計バイト数の上限 None の場合は上限なし
+            check_interval (float): ファイルの更新を確認する間隔(秒)
+                None の場合は確認しない、 0 の場合は読み込みのたびに確認する
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = self._reloads = 0
+
+    def read(self, file_path: str, encoding='utf-8') -> str:
+        """ファイルの内容を返す キャッシュに無い、または更新されている場合はファイルを読み込む
+
+        Args:
+            file_path (str): 対象ファイルのパス
+            encoding (str): 対象ファイルの文字コード
+        Returns:
+            str: ファイルの内容
+        """
+        key = (file_path, encoding)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(key, entry):
+            with self._lock:
+                self._hits += 1
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+            return entry.text
+        return self._load(key, reload=entry is not None)
+
+    def peek(self, file_path: str, encoding='utf-8'):
+        """ファイルの状態を確認せずに返せる場合のみ、キャッシュ済みの内容を返す
+
+        ファイルを読まないため、イベントループ上からも呼び出せる。
+
+        Args:
+            file_path (str): 対象ファイルのパス
+            encoding (str): 対象ファイルの文字コード
+        Returns:
+            str or None: ファイルの内容 キャッシュに無い、または更新の確認が必要な場合は None
+        """
+        key = (file_path, encoding)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._is_fresh_without_stat(entry):
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return entry.text
+
+    def invalidate(self, file_path: str):
+        """指定したファイルをキャッシュから削除する
+
+        Args:
+            file_path (str): 対象ファイルのパス 文字コードに関わらず削除する
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == file_path]:
+                self._remove(key)
+
+    def clear(self):
+        """全てのファイルをキャッシュから削除し、統計情報を初期化する"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = self._reloads = 0
+
+    def info(self) -> FileCacheInfo:
+        """キャッシュの統計情報を返す
+
+        Returns:
+            FileCacheInfo: hits, misses, evictions, reloads, currsize, currbytes
+        """
+        with self._lock:
+            return FileCacheInfo(self._hits, self._misses, self._evictions, self._reloads,
+                                 len(self._entries), self._bytes)
+
+    def _is_fresh_without_stat(self, entry: _FileEntry) -> bool:
+        return self.check_interval is None or time.monotonic() - entry.checked_at < self.check_interval
+
+    def _is_fresh(self, key: tuple, entry: _FileEntry) -> bool:
+        if self._is_fresh_without_stat(entry):
+            return True
+        checked_at = time.monotonic()
+        st = os.stat(key[0])
+        if (st.st_mtime_ns, st.st_size) != (entry.mtime_ns, entry.size):
+            return False
+        with self._lock:
+            # 確認した時刻を更新し、次の確認間隔が経過するまでは確認しない 他のスレッドが読み直した場合は更新しない
+            if self._entries.get(key) is entry:
+                self._entries[key] = entry._replace(checked_at=checked_at)
+        return True
+
+    def _load(self, key: tuple, reload: bool) -> str:
+        file_path, encoding = key
+        # 読み込み中に更新された場合は次回の確認で読み直すよう、読み込み前の状態を保持する
+        st = os.stat(file_path)
+        with open(file_path, 'r', encoding=encoding) as f:
+            text = f.read()
+        entry = _FileEntry(text, st.st_mtime_ns, st.st_size, time.monotonic())
+        with self._lock:
+            self._misses += 1
+            self._reloads += 1 if reload else 0
+            self._store(key, entry)
+        return text
+
+    def _store(self, key: tuple, entry: _FileEntry):
+        if key in self._entries:
+            self._remove(key)
+        if self.max_bytes is not None and self.max_bytes < entry.size:
+            # 1ファイルで上限を超える場合はキャッシュしない
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def _evict(self):
+        while self._entries and (self._over_entries() or self._over_bytes()):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._evictions += 1
+
+    def _over_entries(self) -> bool:
+        return self.max_entries is not None and self.max_entries < len(self._entries)
+
+    def _over_bytes(self) -> bool:
+        return self.max_bytes is not None and self.max_bytes < self._bytes
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+class RenderCache:
+    """ 構築済みのSQLを、制御の流れごとに保持するキャッシュ
+
+    構築するSQLは、 %if の真偽、 %for のループ回数、 /*$param*/ で埋め込む値の組み合わせ(シグネチャ)のみで決まる。
+    Template.render に指定した場合、シグネチャとパラメータのみを求め、
+    同じシグネチャで構築済みのSQLがあればそれを返す。
+    件数と概算のメモリ使用量の両方で上限を設け、超えた場合は最も長く使われていないSQLから破棄する。
+    複数のスレッドから同時に利用できる。
+    """
+
+    def __init__(self, max_entries=256, max_bytes=None):
+        """
+        Args:
+            max_entries (int): 保持するSQLの最大件数 None の場合は上限なし
+            max_bytes (int): 保持するSQLとシグネチャの合計バイト数の上限 None の場合は上限なし
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, key: tuple):
+        """キーに対応するSQLを返す
+
+        Args:
+            key (tuple): (テンプレート, paramstyle, シグネチャ)
+        Returns:
+            str or None: 構築済みのSQL キャッシュに無い場合は None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, sql: str):
+        """構築したSQLを保持する
+
+        Args:
+            key (tuple): `RenderCache.get` 参照
+            sql (str): 構築したSQL
+        """
+        size = sys.getsizeof(sql) + sys.getsizeof(key[-1])
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if self.max_bytes is not None and self.max_bytes < size:
+                # 1件で上限を超える場合はキャッシュしない
+                return
+            self._entries[key] = (sql, size)
+            self._bytes += size
+            self._evict()
+
+    def clear(self):
+        """全てのSQLをキャッシュから削除し、統計情報を初期化する"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def info(self) -> RenderCacheInfo:
+        """キャッシュの統計情報を返す
+
+        Returns:
+            RenderCacheInfo: hits, misses, evictions, currsize, currbytes
+        """
+        with self._lock:
+            return RenderCacheInfo(self._hits, self._misses, self._evictions, len(self._entries), self._bytes)
+
+    def _evict(self):
+        while self._entries and (self._over_entries() or self._over_bytes()):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+
+    def _over_entries(self) -> bool:
+        return self.max_entries is not None and self.max_entries < len(self._entries)
+
+    def _over_bytes(self) -> bool:
+        return self.max_bytes is not None and self.max_bytes < self._bytes
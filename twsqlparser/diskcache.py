@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import hashlib
+import os
+import pathlib
+import pickle
+
+from .__pkg_info__ import __version__
+from .template import Template
+from . import instrument, twsp
+
+# ノードの構造を変更した場合は値を変え、古い形式のキャッシュを利用しないようにする
+_CACHE_FORMAT = 9
+
+
+class DiskCache:
+    """ コンパイル済みのテンプレートをディレクトリに保存するキャッシュ
+
+    __pycache__ と同様に、プロセスを起動するたびに字句解析を行わないようにするためのもの。
+    キャッシュはSQLファイルのパスと設定ごとに1ファイル作成し、
+    twsqlparser のバージョン、SQLファイルの mtime とサイズが一致する場合はSQLファイルを読まずに利用する。
+    mtime のみ変わった場合は、SQLの内容のハッシュが一致すればコンパイルせずに利用する。
+    キャッシュは pickle で保存するため、信頼できないユーザーが書き込めるディレクトリは指定しないこと。
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Args:
+            cache_dir (str or pathlib.Path): キャッシュを保存するディレクトリ 存在しない場合は作成する
+        """
+        self._cache_dir = pathlib.Path(cache_dir)
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def cache_dir(self) -> pathlib.Path:
+        return self._cache_dir
+
+    def load(self, file_path: str, encoding='utf-8', delete_comment=True, newline='\n') -> Template:
+        """SQLファイルのコンパイル済みテンプレートを返す キャッシュが利用できない場合はコンパイルして保存する
+
+        Args:
+            file_path (str): SQLファイルのパス
+            encoding (str): SQLファイルの文字コード
+            delete_comment (bool): True の場合、通常コメントを削除、 False の場合は削除しない
+            newline (str): SQLファイルの改行コード
+        Returns:
+            Template: コンパイル済みのテンプレート
+        """
+        st = os.stat(file_path)
+        stamp = (__version__, _CACHE_FORMAT, st.st_mtime_ns, st.st_size)
+        entry_path = self._entry_path(file_path, encoding, delete_comment, newline)
+        entry = _read_entry(entry_path)
+        if entry is not None and entry[0] == stamp:
+            return entry[2]
+        with instrument.timed(file_path, None, 'load'), open(file_path, 'r', encoding=encoding) as f:
+            base_sql = f.read()
+        source_hash = hashlib.sha256(base_sql.encode('utf-8')).hexdigest()
+        if entry is not None and entry[0][:2] == stamp[:2] and entry[1] == source_hash:
+            template = entry[2]
+        else:
+            template = twsp.compile(base_sql, delete_comment, newline, file_path)
+        _write_entry(entry_path, (stamp, source_hash, template))
+        return template
+
+    def clear(self):
+        """保存済みのキャッシュを全て削除する"""
+        for entry_path in self._cache_dir.glob('*.twsp'):
+            entry_path.unlink()
+
+    def _entry_path(self, file_path: str, encoding: str, delete_comment: bool, newline: str) -> pathlib.Path:
+        key = '\0'.join((os.path.abspath(file_path), encoding, str(delete_comment), newline))
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        return self._cache_dir / f'{pathlib.Path(file_path).stem}.{name}.twsp'
+
+
+def _read_entry(entry_path: pathlib.Path):
+    try:
+        with open(entry_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # キャッシュが存在しない、または壊れている場合はコンパイルし直す
+        return None
+
+
+def _write_entry(entry_path: pathlib.Path, entry: tuple):
+    # 書き込み途中のファイルを他のプロセスが読まないよう、一時ファイルに書き込んでから置き換える
+    tmp_path = entry_path.with_name(f'{entry_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        # キャッシュを保存できなくても解析は継続する
+        pass
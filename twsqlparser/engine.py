@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+from .enums import ParamStyle
+from .template import Template, _validate_paramstyle
+from . import bulk, twsp
+
+
+class Engine:
+    """ 解析時の設定を保持する
+
+    改行コード、パラメータ書式、コメント削除などの設定をインスタンスごとに持つため、
+    異なる設定の Engine を複数のスレッドから同時に利用できる。
+    インスタンスの設定は作成後に変更できない。
+    """
+    __slots__ = ('_delete_comment', '_newline', '_paramstyle', '_encoding', '_stable_bind_names', '_copy_params',
+                 '_in_buckets', '_render_cache')
+
+    def __init__(self, delete_comment=True, newline='\n', paramstyle: ParamStyle = None, encoding='utf-8',
+                 stable_bind_names=True, copy_params=True, in_buckets=None, render_cache=None):
+        """
+        Args:
+            delete_comment (bool): True の場合、通常コメントを削除、 False の場合は削除しない (デフォルトは True)
+            newline (str): SQLに含まれる改行コード (デフォルトは '\n')
+            paramstyle (ParamStyle): 解析後のSQLパラメータ書式を決める。未指定時は `NAMED` と同じ扱い
+            encoding (str): SQLファイルの文字コード デフォルトは utf-8
+            stable_bind_names (bool): `twsqlparser.parse_sql` 参照
+            copy_params (bool): `twsqlparser.parse_sql` 参照
+            in_buckets (InListBuckets): `twsqlparser.parse_sql` 参照
+            render_cache (RenderCache): `twsqlparser.parse_sql` 参照
+        """
+        pstyle = paramstyle or ParamStyle.NAMED
+        _validate_paramstyle(pstyle)
+        self._delete_comment = delete_comment
+        self._newline = newline
+        self._paramstyle = pstyle
+        self._encoding = encoding
+        self._stable_bind_names = stable_bind_names
+        self._copy_params = copy_params
+        self._in_buckets = in_buckets
+        self._render_cache = render_cache
+
+    @property
+    def delete_comment(self) -> bool:
+        return self._delete_comment
+
+    @property
+    def newline(self) -> str:
+        return self._newline
+
+    @property
+    def paramstyle(self) -> ParamStyle:
+        return self._paramstyle
+
+    @property
+    def encoding(self) -> str:
+        return self._encoding
+
+    @property
+    def stable_bind_names(self) -> bool:
+        return self._stable_bind_names
+
+    @property
+    def copy_params(self) -> bool:
+        return self._copy_params
+
+    @property
+    def in_buckets(self):
+        return self._in_buckets
+
+    @property
+    def render_cache(self):
+        return self._render_cache
+
+    def parse_sql(self, base_sql: str, query_params=None) -> (str, dict):
+        """インスタンスの設定でSQLの解析を行う 戻り値は `twsqlparser.parse_sql` と同じ"""
+        return twsp.parse_sql(base_sql, query_params, self._delete_comment, self._newline, self._paramstyle,
+                              self._stable_bind_names, self._copy_params, self._in_buckets, self._render_cache)
+
+    def parse_file(self, file_path: str, query_params=None) -> (str, dict):
+        """インスタンスの設定でSQLファイルの解析を行う 戻り値は `twsqlparser.parse_file` と同じ"""
+        return twsp.parse_file(file_path, query_params, self._delete_comment, self._encoding, self._newline,
+                               self._paramstyle, self._stable_bind_names, self._copy_params, self._in_buckets,
+                               self._render_cache)
+
+    def compile(self, base_sql: str) -> Template:
+        """インスタンスの設定でSQLをコンパイルする"""
+        return twsp.compile(base_sql, self._delete_comment, self._newline)
+
+    def compile_file(self, file_path: str) -> Template:
+        """インスタンスの設定でSQLファイルをコンパイルする"""
+        return twsp.compile_file(file_path, self._delete_comment, self._encoding, self._newline)
+
+    def render(self, template: Template, query_params=None) -> (str, dict):
+        """インスタンスの設定でコンパイル済みのテンプレートからSQLを構築する
+
+        Args:
+            template (Template): `Engine.compile` などで作成したテンプレート
+            query_params (dict): SQL実行時に利用するパラメータ
+        Returns:
+            tuple(str, dict): `Template.render` と同じ
+        """
+        return template.render(query_params, self._paramstyle, self._stable_bind_names, self._copy_params,
+                               self._in_buckets, self._render_cache)
+
+    def render_many(self, template: Template, params_iter, batch_size=1000):
+        """インスタンスの設定で `twsqlparser.render_many` を実行する
+
+        Args:
+            template (Template): `Engine.compile` などで作成したテンプレート
+            params_iter (iterable): SQL実行時に利用するパラメータ(dict)を返すイテラブル
+            batch_size (int): 1バッチに含めるパラメータの最大件数
+        Returns:
+            generator: `twsqlparser.render_many` と同じ
+        """
+        return twsp.render_many(template, params_iter, self._paramstyle, batch_size, self._copy_params,
+                                self._in_buckets, self._render_cache)
+
+    def render_chunks(self, template: Template, query_params: dict, chunk_param: str, max_params=None,
+                      max_bytes=None):
+        """インスタンスの設定で `twsqlparser.render_chunks` を実行する
+
+        Args:
+            template (Template): `Engine.compile` などで作成したテンプレート
+            query_params (dict): SQL実行時に利用するパラメータ
+            chunk_param (str): 分割するパラメータ名
+            max_params (int): 1つのSQLに含めるバインドパラメータの最大数
+            max_bytes (int): 1つのSQLの最大バイト数
+        Returns:
+            generator: `twsqlparser.render_chunks` と同じ
+        """
+        return bulk.render_chunks(template, query_params, chunk_param, max_params, max_bytes, self._paramstyle,
+                                  self._copy_params)
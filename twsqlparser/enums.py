@@ -1,28 +1,60 @@
 #!/usr/bin/env python3
 # (C) 2021 gomachssm
-import re
 from enum import Enum
 
-_REG_PARAM = r'/\*:[a-zA-Z0-9_]*\*/'
+_REG_PARAM = r'/\*:[a-zA-Z0-9_]*(?:\[\])?\*/'
 _REG_DIRECT = r'/\*\$[a-zA-Z0-9_]*\*/'
 _REG_IF = r'/\*%if .+?\*/'
+_REG_ELIF = r'/\*%elif .+?\*/'
+_REG_ELSE = r'/\*%else\*/'
 _REG_FOR = r'/\*%for .+? in .+?\*/'
 _REG_END = r'/\*end\*/'
 
 
 class ParamStyle(Enum):
+    """ 解析後のSQLパラメータ書式
+
+    値は書式文字列で、 {0} はパラメータ名、 {1} は1から始まるパラメータの位置。
+    パラメータ名を含まない書式は位置指定で、パラメータは出現順に値を並べたリストになる。
+    """
     NAMED = ':{0}'
     PYFORMAT = '%({0})s'
+    QMARK = '?'
+    NUMERIC = ':{1}'
+    DOLLAR_NUMERIC = '${1}'
+    FORMAT = '%s'
+
+    @property
+    def positional(self) -> bool:
+        return '{0}' not in self.value
+
 
+class TokenType(Enum):
+    """ 字句解析のトークン種別
 
-class CommentType(Enum):
-    # :~*/ に一致する場合
-    PARAM = re.compile(f'^{_REG_PARAM}')
+    値は字句解析で利用する正規表現。定義順に照合するため、順序を変更してはいけない。
+    """
+    # 引用符、括弧、コメント以外の連続する文字列
+    TEXT = r'''(?:[^"'(\[{/-]+|-(?!-)|/(?!\*))+'''
+    # ' または " から始まる文字列
+    QUOTE = r'''['"]'''
+    # ( [ { のいずれか
+    BRACKET = r'[(\[{]'
+    # -- から改行まで
+    LINE_COMMENT = r'--'
+    # :~*/ または :~[]*/ に一致する場合
+    PARAM = _REG_PARAM
     # $~*/ に一致する場合
-    DIRECT = re.compile(f'^{_REG_DIRECT}')
+    DIRECT = _REG_DIRECT
     # %if ~ */ に一致する場合
-    IFEND = re.compile(f'^{_REG_IF}')
+    IFEND = _REG_IF
     # %for ~ */ に一致する場合
-    FOREND = re.compile(f'^{_REG_FOR}')
+    FOREND = _REG_FOR
+    # %elif ~ */ に一致する場合
+    ELIF = _REG_ELIF
+    # %else */ に一致する場合
+    ELSE = _REG_ELSE
+    # /*end*/ に一致する場合
+    END = _REG_END
     # 最初の */まで
-    NORMAL = re.compile(r'^/\*.*?\*/', re.DOTALL)
+    NORMAL = r'/\*(?s:.*?)\*/'
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from time import perf_counter
+
+# 計測する処理
+# load: SQLファイルの読み込み、 lex: 字句解析、 eval: %if の式の評価、
+# loop: %for の式の評価とループ変数の展開、 join: それ以外のSQLの構築
+PHASES = ('load', 'lex', 'eval', 'loop', 'join')
+
+PhaseStats = namedtuple('PhaseStats', ('count', 'seconds'))
+
+
+class _Collector:
+    """ テンプレートごと、処理ごとの回数と秒数を集計する """
+    __slots__ = ('enabled', 'lock', 'data', 'callbacks')
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # {テンプレート名: {処理: [回数, 秒数]}}
+        self.data = {}
+        self.callbacks = []
+
+    def record(self, name: str, phase: str, count: int, seconds: float):
+        with self.lock:
+            phases = self.data.get(name)
+            if phases is None:
+                phases = self.data[name] = {p: [0, 0.0] for p in PHASES}
+            total = phases[phase]
+            total[0] += count
+            total[1] += seconds
+            callbacks = tuple(self.callbacks)
+        for callback in callbacks:
+            callback(name, phase, count, seconds)
+
+
+_collector = _Collector(os.environ.get('TWSP_STATS', '') not in ('', '0'))
+
+
+def enable_stats():
+    """計測を開始する 環境変数 TWSP_STATS に 0 以外を指定した場合は、 import 時から計測する"""
+    _collector.enabled = True
+
+
+def disable_stats():
+    """計測を停止する 集計済みの値は reset_stats を呼び出すまで保持する"""
+    _collector.enabled = False
+
+
+def is_enabled() -> bool:
+    return _collector.enabled
+
+
+def reset_stats():
+    """集計済みの値を全て削除する"""
+    with _collector.lock:
+        _collector.data.clear()
+
+
+def stats() -> dict:
+    """テンプレートごとの集計結果を返す
+
+    テンプレート名は、 compile_file, parse_file などSQLファイルから作成した場合はファイルパス、
+    それ以外は SQL のハッシュから作成した '<sql:xxxxxxxxxxxx>' 形式。
+
+    Returns:
+        dict: {テンプレート名: {処理: PhaseStats(count, seconds)}}
+            count は load, lex, join は呼び出し回数、 eval は式の評価回数、 loop はループ回数
+    """
+    with _collector.lock:
+        return {name: {phase: PhaseStats(*total) for phase, total in phases.items()}
+                for name, phases in _collector.data.items()}
+
+
+def register_stats_callback(callback):
+    """集計するたびに呼び出す関数を登録する
+
+    Args:
+        callback (callable): (テンプレート名, 処理, 回数, 秒数) で呼び出す
+            SQLの構築では、1回の構築ごとに eval, loop, join の3回呼び出す
+    """
+    with _collector.lock:
+        _collector.callbacks.append(callback)
+
+
+def unregister_stats_callback(callback):
+    """register_stats_callback で登録した関数を削除する"""
+    with _collector.lock:
+        _collector.callbacks.remove(callback)
+
+
+def record(name: str, phase: str, count: int, seconds: float):
+    _collector.record(name, phase, count, seconds)
+
+
+def template_name(name, sql: str) -> str:
+    return name if name is not None else _sql_name(sql)
+
+
+@lru_cache(maxsize=256)
+def _sql_name(sql: str) -> str:
+    return f'<sql:{hashlib.blake2b(sql.encode("utf-8"), digest_size=6).hexdigest()}>'
+
+
+class RenderStats:
+    """ 1回のSQL構築で、 %if の式の評価と %for の展開にかかった回数と秒数 """
+    __slots__ = ('eval_count', 'eval_seconds', 'loop_count', 'loop_seconds')
+
+    def __init__(self):
+        self.eval_count = 0
+        self.eval_seconds = 0.0
+        self.loop_count = 0
+        self.loop_seconds = 0.0
+
+    def timed_eval(self, func, *args):
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.eval_count += 1
+            self.eval_seconds += perf_counter() - start
+
+    def timed_loop(self, loop_params):
+        """ループ変数を1件ずつ返し、次の1件を求める時間を計測する"""
+        start = perf_counter()
+        for params in loop_params:
+            self.loop_seconds += perf_counter() - start
+            self.loop_count += 1
+            yield params
+            start = perf_counter()
+        self.loop_seconds += perf_counter() - start
+
+    def timed_fragments(self, fragments, name: str):
+        """SQLの断片を返し、最後まで読んだ時点で集計する 呼び出し元が断片を利用する時間は含めない"""
+        seconds = 0.0
+        start = perf_counter()
+        for fragment in fragments:
+            seconds += perf_counter() - start
+            yield fragment
+            start = perf_counter()
+        seconds += perf_counter() - start
+        record(name, 'eval', self.eval_count, self.eval_seconds)
+        record(name, 'loop', self.loop_count, self.loop_seconds)
+        record(name, 'join', 1, max(seconds - self.eval_seconds - self.loop_seconds, 0.0))
+
+
+class _Timer:
+    __slots__ = ('name', 'phase', 'start')
+
+    def __init__(self, name: str, phase: str):
+        self.name = name
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, self.phase, 1, perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name, sql: str, phase: str):
+    """with 文で囲んだ処理の秒数を集計する 計測していない場合は何もしない
+
+    Args:
+        name (str): テンプレート名 None の場合は sql から作成する
+        sql (str): SQL name が None の場合のみ利用する
+        phase (str): 処理 load または lex
+    """
+    if not _collector.enabled:
+        return _NULL_TIMER
+    return _Timer(template_name(name, sql), phase)
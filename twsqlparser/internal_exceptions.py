@@ -17,6 +17,13 @@ class Msg(enum.Enum):
     E0007 = 'Format must be "/*%for ~ in ~*/", value is {0}'
     E0008 = '{0}. %for statement is "{1}"'
     E0009 = 'Variable "paramstyle" must be either {0} or {1}, but "{2}".'
+    E0010 = 'SQL "{0}" is not found in {1}'
+    E0011 = 'Arg {0} must be a list or tuple, but {1}'
+    E0012 = 'A single row of "{0}" exceeds the limit. {1}'
+    E0013 = 'Parameter "{0}" is not found in query_params'
+    E0014 = '{0} must not follow /*%else*/'
+    E0015 = 'Constants {0} are already specialized'
+    E0016 = 'In-list bucket sizes must be positive integers, but {0}'
 
 
 class TwspException(Exception):
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import re
+
+from .internal_exceptions import Msg, TwspException
+from .enums import TokenType
+
+# 全てのトークンを1つの正規表現にまとめ、元のSQLを切り出さずに位置指定で照合する
+_TOKEN_REGEX = re.compile('|'.join(f'(?P<{t.name}>{t.value})' for t in TokenType))
+_TOKEN_TYPES = {t.name: t for t in TokenType}
+
+_QUOTES = ("'", '"')
+_BRACKET_PARE = {'[': ']', '(': ')', '{': '}'}
+# ([{'"\ 以外の一般的な記号と空白文字
+_EOP_SIMPLE_PARAM = ('!', '#', '$', '%', '&', ')', '-', '=', '^', '~',
+                     '|', '@', '`', ';', '+', ':', '*', ']', '}',
+                     ',', '/', '<', '>', '?', ' ',     # '.', '(', '_',
+                     '\t', '\n', '\r', )
+# ダミー値のうち、引用符と括弧を含まない部分
+_DUMMY_TEXT_REGEX = re.compile(f'[^{re.escape("".join((*_EOP_SIMPLE_PARAM, *_QUOTES, *_BRACKET_PARE)))}]+')
+
+
+def next_token(base_sql: str, idx: int, newline: str) -> (TokenType, int):
+    """idx から始まるトークンを1つ読み込む
+
+    Args:
+        base_sql (str): 解析対象SQL
+        idx (int): トークンの開始位置
+        newline (str): SQLに含まれる改行コード
+    Returns:
+        tuple:
+            TokenType: トークン種別
+            int: トークンの終了位置
+                PARAM, DIRECT の場合はダミー値を含まないコメントの終了位置
+    """
+    matched = _TOKEN_REGEX.match(base_sql, idx)
+    if matched is None:
+        # 閉じられていない /* の場合
+        raise TwspException(Msg.E0003, base_sql[idx:])
+    token_type = _TOKEN_TYPES[matched.lastgroup]
+    if token_type is TokenType.QUOTE:
+        return token_type, quote_end(base_sql, idx)
+    if token_type is TokenType.LINE_COMMENT:
+        return token_type, _line_end(base_sql, idx, newline)
+    return token_type, matched.end()
+
+
+def quote_end(base_sql: str, idx: int) -> int:
+    """idx の引用符から始まる文字列の終了位置を返す
+
+    Args:
+        base_sql (str): 解析対象SQL
+        idx (int): ' または " の位置
+    Returns:
+        int: 閉じ引用符の直後の位置、閉じられていない場合はSQLの末尾
+    """
+    quote = base_sql[idx]
+    max_idx = len(base_sql) - 1
+    i = idx + 1
+    while i <= max_idx:
+        found = base_sql.find(quote, i)
+        if found < 0:
+            break
+        i = found + 1
+        # 2連続のクォート以外の場合、文字列はそこまで
+        if max_idx <= i or base_sql[i + 1] != quote:
+            return i
+        i += 1
+    return max_idx + 1
+
+
+def dummy_end(base_sql: str, idx: int) -> int:
+    """パラメータコメント直後のダミー値の終了位置を返す
+
+    ダミー値は引用符で囲まれた文字列、括弧で囲まれた文字列、それ以外の文字の連続からなり、
+    _EOP_SIMPLE_PARAM のいずれかの文字で終了する。
+
+    Args:
+        base_sql (str): 解析対象SQL
+        idx (int): パラメータコメントの直後の位置
+    Returns:
+        int: ダミー値の直後の位置、ダミー値が無い場合は idx
+    """
+    max_idx = len(base_sql)
+    while idx < max_idx:
+        c = base_sql[idx]
+        if c in _QUOTES:
+            idx = quote_end(base_sql, idx)
+        elif c in _BRACKET_PARE:
+            idx = _bracket_end(base_sql, idx)
+        elif c in _EOP_SIMPLE_PARAM:
+            break
+        else:
+            idx = _DUMMY_TEXT_REGEX.match(base_sql, idx).end()
+    return idx
+
+
+def _bracket_end(base_sql: str, idx: int) -> int:
+    # 括弧のネストは考慮せず、最初に見つかった閉じ括弧までとする
+    closing_idx = base_sql.find(_BRACKET_PARE[base_sql[idx]], idx + 1)
+    return len(base_sql) if closing_idx < 0 else closing_idx + 1
+
+
+def _line_end(base_sql: str, idx: int, newline: str) -> int:
+    new_line_idx = base_sql.find(newline, idx)
+    return len(base_sql) if new_line_idx < 0 else new_line_idx
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import pathlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .diskcache import DiskCache
+from .engine import Engine
+from .internal_exceptions import Msg, TwspValidateError
+from .template import Template
+from . import instrument, twsp
+
+_EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+class SqlRegistry:
+    """ ディレクトリ配下のSQLファイルを論理名で管理する
+
+    論理名は root_dir からの相対パスから拡張子を除き、区切り文字を '/' にしたもの。
+    ex: root_dir/orders/select_by_user.sql -> 'orders/select_by_user'
+    preload が True の場合、作成時に全てのファイルを読み込んでコンパイルするため、初回の描画で字句解析を行わない。
+    """
+
+    def __init__(self, root_dir, engine: Engine = None, suffix='.sql', preload=True, parallel=None,
+                 max_workers=None, cache_dir=None):
+        """
+        Args:
+            root_dir (str or pathlib.Path): SQLファイルを配置したディレクトリ
+            engine (Engine): コンパイル、描画時の設定 未指定時は `Engine()` と同じ扱い
+            suffix (str): 対象とするファイルの拡張子 (デフォルトは '.sql')
+            preload (bool): True の場合、作成時に全てのファイルをコンパイルする
+                False の場合は初めて利用する時にコンパイルする
+            parallel (str): 'thread' の場合はスレッド、 'process' の場合はプロセスを分けて並列にコンパイルする
+                未指定時は順番にコンパイルする
+            max_workers (int): 並列にコンパイルする場合の最大ワーカー数
+            cache_dir (str or pathlib.Path): 指定した場合、コンパイル済みのテンプレートをディレクトリに保存し、
+                次回以降の起動では保存したテンプレートを読み込む ( `DiskCache` 参照)
+        """
+        self._root_dir = pathlib.Path(root_dir).resolve()
+        self._engine = engine or Engine()
+        self._suffix = suffix
+        self._disk_cache = None if cache_dir is None else DiskCache(cache_dir)
+        self._paths = self._discover()
+        self._templates = {}
+        if preload:
+            self.load(parallel, max_workers)
+
+    @property
+    def root_dir(self) -> pathlib.Path:
+        return self._root_dir
+
+    @property
+    def engine(self) -> Engine:
+        return self._engine
+
+    def names(self) -> list:
+        """管理しているSQLの論理名を返す"""
+        return sorted(self._paths)
+
+    def __contains__(self, name) -> bool:
+        return name in self._paths
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def load(self, parallel=None, max_workers=None):
+        """全てのファイルを読み込み、コンパイルする
+
+        Args:
+            parallel (str): `SqlRegistry` 参照
+            max_workers (int): `SqlRegistry` 参照
+        """
+        names = self.names()
+        args = [self._load_args(name) for name in names]
+        if parallel is None:
+            templates = [_load_template(*arg) for arg in args]
+        else:
+            with _EXECUTORS[parallel](max_workers=max_workers) as executor:
+                templates = list(executor.map(_load_template, *zip(*args))) if args else []
+        self._templates.update(zip(names, templates))
+
+    def get(self, name: str) -> Template:
+        """論理名に対応するコンパイル済みのテンプレートを返す
+
+        Args:
+            name (str): SQLの論理名 ex: 'orders/select_by_user'
+        Returns:
+            Template: コンパイル済みのテンプレート
+        """
+        template = self._templates.get(name)
+        if template is None:
+            template = self._templates[name] = _load_template(*self._load_args(name))
+        return template
+
+    def render(self, name: str, query_params=None) -> (str, dict):
+        """論理名に対応するSQLを描画する
+
+        Args:
+            name (str): SQLの論理名 ex: 'orders/select_by_user'
+            query_params (dict): SQL実行時に利用するパラメータ
+        Returns:
+            tuple(str, dict): `twsqlparser.parse_sql` と同じ
+        """
+        return self._engine.render(self.get(name), query_params)
+
+    def _discover(self) -> dict:
+        paths = {}
+        for path in self._root_dir.rglob(f'*{self._suffix}'):
+            if path.is_file():
+                relpath = path.relative_to(self._root_dir).as_posix()
+                paths[relpath[:len(relpath) - len(self._suffix)]] = str(path)
+        return paths
+
+    def _load_args(self, name: str) -> tuple:
+        path = self._paths.get(name)
+        if path is None:
+            raise TwspValidateError(Msg.E0010, name, str(self._root_dir))
+        engine = self._engine
+        return path, engine.encoding, engine.delete_comment, engine.newline, self._disk_cache
+
+
+def _load_template(path: str, encoding: str, delete_comment: bool, newline: str, disk_cache: DiskCache) -> Template:
+    # ProcessPoolExecutor からも呼び出すため、モジュールレベルの関数とする
+    if disk_cache is not None:
+        return disk_cache.load(path, encoding, delete_comment, newline)
+    with instrument.timed(path, None, 'load'), open(path, 'r', encoding=encoding) as f:
+        base_sql = f.read()
+    return twsp.compile(base_sql, delete_comment, newline, path)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import ast
+from functools import lru_cache
+
+from .cache import get_cache_maxsize
+from .template import TextNode, DirectNode, IfNode, ForNode, block_end_skip
+from .template import _execute_if_statement, _update_blank_line
+
+_NO_BOUND = frozenset()
+
+
+def specialize_nodes(nodes: tuple, constants: dict, newline: str) -> tuple:
+    """constants のみで決まる %if の条件と /*$param*/ を評価し、評価済みのノードに置き換える
+
+    Args:
+        nodes (tuple): 対象のノード
+        constants (dict): 値を固定するパラメータ
+        newline (str): SQLに含まれる改行コード
+    Returns:
+        tuple: 置き換えたノード 構築するSQLは、置き換える前のノードに constants を渡した場合と同じ
+    """
+    return _Specializer(constants, newline).nodes(nodes, _NO_BOUND)
+
+
+class _Specializer:
+    """ constants で決まるノードを置き換える
+
+    bound は外側の for のループ変数名で、 constants より優先されるため評価しない。
+    """
+    __slots__ = ('constants', 'newline')
+
+    def __init__(self, constants: dict, newline: str):
+        self.constants = constants
+        self.newline = newline
+
+    def nodes(self, nodes: tuple, bound: frozenset) -> tuple:
+        result = []
+        for node in nodes:
+            if type(node) is DirectNode:
+                node = self.direct(node, bound)
+            elif type(node) is IfNode:
+                node = self.if_chain(node, bound)
+            elif type(node) is ForNode:
+                node = self.loop(node, bound)
+            if node is not None:
+                result.append(node)
+        return tuple(result)
+
+    def direct(self, node: DirectNode, bound: frozenset):
+        if node.name in bound or node.name not in self.constants:
+            return node
+        value = f'{self.constants[node.name]}'
+        # 空文字の場合は何も出力せず行頭空白数も変えないため、ノードごと取り除く
+        return TextNode(value, _update_blank_line(-1, value, self.newline), True) if value else None
+
+    def loop(self, node: ForNode, bound: frozenset) -> ForNode:
+        body = self.nodes(node.body, bound | frozenset(node.vnames))
+        return node._replace(body=body, end_skip=self.end_skip(node, body))
+
+    def if_chain(self, node: IfNode, bound: frozenset) -> IfNode:
+        if bound:
+            # 出力しない for の本文を辿る場合は全ての条件を真とみなすため、 for の内側では分岐を取り除かない
+            branches = [self.branch(b, self.condition(b.statement, bound), bound) for b in (node, *node.orelse)]
+        else:
+            branches = self.reachable_branches(node)
+        return branches[0]._replace(orelse=tuple(branches[1:]))
+
+    def reachable_branches(self, node: IfNode) -> list:
+        # 偽に決まる分岐と、真に決まる分岐より後ろの分岐は通らないため取り除く
+        branches = []
+        for branch in (node, *node.orelse):
+            value = self.condition(branch.statement, _NO_BOUND)
+            if value is True:
+                return branches + [self.branch(branch, True, _NO_BOUND)]
+            if value is None:
+                branches.append(self.branch(branch, None, _NO_BOUND))
+        # いずれの分岐も通らない場合は最後の分岐で /*end*/ の後ろの読み飛ばしを決めるため、偽として残す
+        if value is False:
+            branches.append(self.branch(branch, False, _NO_BOUND, trim=True))
+        return branches
+
+    def branch(self, branch: IfNode, value, bound: frozenset, trim=False) -> IfNode:
+        statement = branch.statement if value is None else value
+        # 出力しない本文は、 /*end*/ の後ろで読み飛ばす文字数に影響する場合のみ残す
+        body = () if trim and branch.end_skip is not None else self.nodes(branch.body, bound)
+        return branch._replace(statement=statement, body=body, end_skip=self.end_skip(branch, body), orelse=())
+
+    def end_skip(self, node, body: tuple):
+        # 本文の出力によって変わる場合のみ、置き換えた本文から求め直す
+        if node.end_skip is not None:
+            return node.end_skip
+        return block_end_skip(body, node.head_skip, node.tail_skip, self.newline)
+
+    def condition(self, statement, bound: frozenset):
+        """constants のみで決まる条件の真偽を返す 決まらない場合は None
+
+        評価時に例外が発生する場合は、 render で同じ例外を発生させるため評価せずに None とする。
+        """
+        if statement is None or type(statement) is bool:
+            # /*%else*/ 、または評価済みの条件
+            return True if statement is None else statement
+        names = _expression_names(statement)
+        if names is None or not names.issubset(self.constants) or names & bound:
+            return None
+        try:
+            return _execute_if_statement(statement, self.constants, {})
+        except Exception:
+            return None
+
+
+@lru_cache(maxsize=get_cache_maxsize('TWSP_EXPR_CACHE_SIZE', 256))
+def _expression_names(statement: str):
+    # 式で参照する名前 解析できない場合は None
+    try:
+        tree = ast.parse(f'True {statement} else False', mode='eval')
+    except SyntaxError:
+        return None
+    return frozenset(n.id for n in ast.walk(tree) if type(n) is ast.Name)
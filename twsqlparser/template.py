@@ -0,0 +1,1240 @@
+#!/usr/bin/env python3
+# (C) 2021 gomachssm
+
+import ast
+import re
+from collections import ChainMap, namedtuple
+from collections.abc import Mapping
+from copy import deepcopy
+from functools import lru_cache
+from uuid import uuid4
+
+from . import instrument
+from .cache import get_cache_maxsize
+
+from .internal_exceptions import Msg, TwspExecuteError, TwspValidateError
+from .enums import ParamStyle
+
+_TN = 'tmpnm'
+_VL = 'value'
+_DMY = '...dummy...'
+
+_END = '/*end*/'
+# 空白以外を出力しない本文の末尾
+_NO_OUTPUT = 'no output'
+
+# IN 句の直後かどうか ex: "where id in (", "not in "
+_IN_LIST = re.compile(r'(?<=[\s)])(not\s+)?in\s*\(?\s*\Z', re.IGNORECASE)
+# ParamNode, ForNode の in_list の値 IN 句の直後でない場合は False
+_IN = 'in'
+_NOT_IN = 'not in'
+# 配列パラメータの直前の IN 句 ex: "where id in ", "id not in "
+_ARRAY_IN = re.compile(r'(?<=[\s)])(not\s+)?in\s*\Z', re.IGNORECASE)
+
+
+class Template:
+    """ コンパイル済みのSQLテンプレート
+
+    SQLの字句解析はコンパイル時に1度だけ行い、 render ではノードのツリーを辿るだけで SQL を構築する。
+    %if, %for を含まないテンプレートは、ノードを辿らずに _FlatPlan で構築する。
+    """
+    __slots__ = ('_sql', '_nodes', '_delete_comment', '_newline', '_name', '_constants', '_variants', '_plan')
+
+    def __init__(self, sql: str, nodes: tuple, delete_comment: bool, newline: str, name: str = None,
+                 constants: dict = None):
+        """
+        Args:
+            sql (str): コンパイル元のSQL
+            nodes (tuple): 解析済みのノード
+            delete_comment (bool): 通常コメントを削除してコンパイルしたかどうか
+            newline (str): SQLに含まれる改行コード
+            name (str): 計測結果の集計に利用するテンプレート名 SQLファイルから作成した場合はファイルパス
+            constants (dict): `Template.specialize` で値を固定したパラメータ
+        """
+        self._sql = sql
+        self._nodes = nodes
+        self._delete_comment = delete_comment
+        self._newline = newline
+        self._name = name
+        self._constants = constants
+        # specialize で作成したテンプレート {constants のキーと値のタプル: Template}
+        self._variants = {}
+        # %if, %for を含まない場合の構築手順 含む場合は None
+        self._plan = _flat_plan(nodes)
+
+    @property
+    def sql(self) -> str:
+        return self._sql
+
+    @property
+    def nodes(self) -> tuple:
+        return self._nodes
+
+    @property
+    def delete_comment(self) -> bool:
+        return self._delete_comment
+
+    @property
+    def newline(self) -> str:
+        return self._newline
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def constants(self) -> dict:
+        return dict(self._constants or {})
+
+    def specialize(self, **constants) -> 'Template':
+        """値が固定のパラメータのみで決まる %if の条件と /*$param*/ を評価済みにしたテンプレートを返す
+
+        プロセスの起動中に変わらない設定値 (ex: dialect == 'pg') による分岐を事前に決め、 render のたびに評価しないようにする。
+        真偽が決まる条件は評価済みの値に置き換え、通らない分岐は取り除く。 /*$param*/ は埋め込む文字列に置き換える。
+        constants 以外の名前を含む式は置き換えず、 render 時に constants を query_params に重ねて評価する。
+        同じ constants を指定した場合は同じテンプレートを返す。
+
+        Args:
+            **constants: 値を固定するパラメータ
+                render 時に同じ名前のパラメータを指定しても、 constants の値を利用する
+        Returns:
+            Template: 構築するSQLとパラメータが、元のテンプレートの query_params に constants を加えた場合と同じテンプレート
+        """
+        if not constants:
+            return self
+        fixed = set(constants).intersection(self._constants or {})
+        if fixed:
+            raise TwspValidateError(Msg.E0015, sorted(fixed))
+        key = _variant_key(constants)
+        variant = self._variants.get(key) if key is not None else None
+        if variant is None:
+            from .specialize import specialize_nodes
+            merged = {**(self._constants or {}), **constants}
+            nodes = specialize_nodes(self._nodes, merged, self._newline)
+            variant = Template(self._sql, nodes, self._delete_comment, self._newline, self._name, merged)
+            if key is not None:
+                self._variants[key] = variant
+        return variant
+
+    @staticmethod
+    async def load_async(file_path: str, delete_comment=True, encoding='utf-8', newline='\n',
+                         executor=None) -> 'Template':
+        """SQLファイルをイベントループを止めずに読み込み、テンプレートを作成する `twsqlparser.compile_file_async` 参照"""
+        from . import aio
+        return await aio.compile_file_async(file_path, delete_comment, encoding, newline, executor)
+
+    def render(self, query_params=None, paramstyle: ParamStyle = None, stable_bind_names=True,
+               copy_params=True, in_buckets=None, render_cache=None) -> (str, dict):
+        """パラメータを埋め込んだSQLを構築する
+
+        Args:
+            query_params (dict): SQL実行時に利用するパラメータ
+            paramstyle (ParamStyle): 解析後のSQLパラメータ書式を決める。未指定時は `NAMED` と同じ扱い
+            stable_bind_names (bool): True の場合、for 内のパラメータ名を for の位置とループ回数から決める
+                False の場合は uuid4 から決める (デフォルトは True)
+            copy_params (bool): True の場合、 query_params を deepcopy したdictを返す
+                False の場合はコピーせず、 for 用のパラメータを query_params に重ねた ChainMap を返す
+                (デフォルトは True)
+            in_buckets (InListBuckets): 指定した場合、IN 句のリスト展開の件数を段階まで埋める
+            render_cache (RenderCache): 指定した場合、 %if の真偽と %for のループ回数が同じであれば
+                構築済みのSQLを再利用し、パラメータのみを求める stable_bind_names が False の場合は利用しない
+                キャッシュに無い場合は式を2回評価するため、 %for の対象には1度しか読めないイテレータを指定しないこと
+                %if, %for を含まないテンプレートの場合は利用しない
+        Returns:
+            tuple(str, dict):
+                str: 解析後のSQL
+                dict: パラメータ更新後のdict ( copy_params が False の場合は ChainMap )
+                    位置指定の paramstyle の場合は、SQL内の出現順に値を並べたリスト
+        """
+        plan = self._flat_plan(in_buckets)
+        if plan is not None:
+            pstyle = paramstyle or ParamStyle.NAMED
+            _validate_paramstyle(pstyle)
+            qparams = _prepare_qparams(query_params, copy_params, self._constants)
+            values = [] if pstyle.positional else None
+            return plan.render(qparams, pstyle, values), qparams if values is None else values
+        if render_cache is not None and stable_bind_names:
+            return self._render_cached(render_cache, query_params, paramstyle, copy_params, in_buckets)
+        if instrument.is_enabled():
+            # 計測中は断片ごとに時間を計るため、 iter_render と同じ経路で構築する
+            fragments, qparams = self.iter_render(query_params, paramstyle, stable_bind_names, copy_params, in_buckets)
+            return ''.join(fragments), qparams
+        pstyle = paramstyle or ParamStyle.NAMED
+        _validate_paramstyle(pstyle)
+        qparams = _prepare_qparams(query_params, copy_params, self._constants)
+        values = [] if pstyle.positional else None
+        ctx = _RenderContext(qparams, pstyle.value, self._newline, stable_bind_names, values, in_buckets)
+        sql = _render_root(self._nodes, ctx)
+        if in_buckets is not None:
+            _drain(in_buckets.record((sql, )))
+        return sql, qparams if values is None else values
+
+    def _render_cached(self, render_cache, query_params, paramstyle: ParamStyle, copy_params: bool,
+                       in_buckets) -> (str, dict):
+        pstyle = paramstyle or ParamStyle.NAMED
+        _validate_paramstyle(pstyle)
+        qparams = _prepare_qparams(query_params, copy_params, self._constants)
+        values = [] if pstyle.positional else None
+        ctx = _RenderContext(qparams, pstyle.value, self._newline, True, values, in_buckets)
+        signature = []
+        collect_nodes(self._nodes, ctx, {}, signature)
+        key = (self, pstyle, tuple(signature))
+        sql = render_cache.get(key)
+        if sql is None:
+            sql, _ = self.render(query_params, pstyle, True, copy_params, in_buckets)
+            render_cache.put(key, sql)
+        elif in_buckets is not None:
+            _drain(in_buckets.record((sql, )))
+        return sql, qparams if values is None else values
+
+    def iter_render(self, query_params=None, paramstyle: ParamStyle = None, stable_bind_names=True,
+                    copy_params=True, in_buckets=None) -> (iter, dict):
+        """パラメータを埋め込んだSQLを断片ごとに返す
+
+        SQL全体を1つの文字列にまとめないため、大きなSQLを構築する場合もメモリ使用量は断片1つ分に収まる。
+        for のループ対象も1件ずつ読み込む。
+
+        Args:
+            query_params (dict): `Template.render` 参照
+            paramstyle (ParamStyle): `Template.render` 参照
+            stable_bind_names (bool): `Template.render` 参照
+            copy_params (bool): `Template.render` 参照
+            in_buckets (InListBuckets): `Template.render` 参照
+        Returns:
+            tuple(generator, dict):
+                generator: 解析後のSQLの断片(str)を順に返すジェネレータ
+                dict: パラメータ更新後のdict for 用のパラメータはジェネレータを最後まで読んだ時点で揃う
+                    位置指定の paramstyle の場合はリスト
+        """
+        pstyle = paramstyle or ParamStyle.NAMED
+        _validate_paramstyle(pstyle)
+        qparams = _prepare_qparams(query_params, copy_params, self._constants)
+        values = [] if pstyle.positional else None
+        plan = self._flat_plan(in_buckets)
+        if plan is not None:
+            return plan.stream(qparams, pstyle, values), qparams if values is None else values
+        ctx = _RenderContext(qparams, pstyle.value, self._newline, stable_bind_names, values, in_buckets)
+        fragments = _stream_root(self._nodes, ctx)
+        if instrument.is_enabled():
+            ctx.stats = instrument.RenderStats()
+            fragments = ctx.stats.timed_fragments(fragments, instrument.template_name(self._name, self._sql))
+        if in_buckets is not None:
+            fragments = in_buckets.record(fragments)
+        return fragments, qparams if values is None else values
+
+    def render_to(self, stream, query_params=None, paramstyle: ParamStyle = None, stable_bind_names=True,
+                  copy_params=True, in_buckets=None) -> dict:
+        """パラメータを埋め込んだSQLを断片ごとに stream に書き込む
+
+        Args:
+            stream: write(str) を持つオブジェクト ex: テキストモードのファイル、 io.StringIO
+            query_params (dict): `Template.render` 参照
+            paramstyle (ParamStyle): `Template.render` 参照
+            stable_bind_names (bool): `Template.render` 参照
+            copy_params (bool): `Template.render` 参照
+            in_buckets (InListBuckets): `Template.render` 参照
+        Returns:
+            dict: パラメータ更新後のdict 位置指定の paramstyle の場合はリスト
+        """
+        fragments, qparams = self.iter_render(query_params, paramstyle, stable_bind_names, copy_params, in_buckets)
+        for fragment in fragments:
+            stream.write(fragment)
+        return qparams
+
+    def _flat_plan(self, in_buckets):
+        # IN 句の件数を埋める場合と計測中の場合は、ノードを辿って構築する
+        if in_buckets is None and not instrument.is_enabled():
+            return self._plan
+        return None
+
+
+class _FlatPlan:
+    """ %if, %for を含まないテンプレートの構築手順
+
+    行の削除や読み飛ばしが発生しないため、SQLは各ノードの出力を順に結合したものと同じになる。
+    /*$param*/ を含まない場合、SQLは paramstyle ごとに1度だけ構築して再利用する。
+    """
+    __slots__ = ('nodes', 'names', 'sqls')
+
+    def __init__(self, nodes: tuple):
+        self.nodes = nodes
+        # /*:param*/ のパラメータ名 (出現順)
+        self.names = tuple(node.name for node in nodes if type(node) is ParamNode)
+        # 構築済みのSQL {ParamStyle: str} /*$param*/ を含む場合は None
+        self.sqls = None
+        if not any(type(node) is DirectNode for node in nodes):
+            # パラメータを含まない場合、SQLは paramstyle によらず同じ
+            self.sqls = dict.fromkeys(ParamStyle, self.build(None, '')) if not self.names else {}
+
+    def render(self, qparams: dict, pstyle: ParamStyle, values: list) -> str:
+        """SQLを返す 位置指定の paramstyle の場合は values にパラメータの値を出現順に追加する"""
+        if values is not None:
+            for name in self.names:
+                if name not in qparams:
+                    raise TwspExecuteError(Msg.E0013, name)
+                values.append(qparams[name])
+        if self.sqls is None:
+            return self.build(qparams, pstyle.value)
+        sql = self.sqls.get(pstyle)
+        if sql is None:
+            sql = self.sqls[pstyle] = self.build(qparams, pstyle.value)
+        return sql
+
+    def stream(self, qparams: dict, pstyle: ParamStyle, values: list):
+        # iter_render と同様に、パラメータは読み進めた時点で揃う
+        yield self.render(qparams, pstyle, values)
+
+    def build(self, qparams: dict, prmfmt: str) -> str:
+        fragments, position = [], 0
+        for node in self.nodes:
+            if type(node) is TextNode:
+                fragments.append(node.text)
+            elif type(node) is ParamNode:
+                position += 1
+                fragments.append(prmfmt.format(node.name, position))
+            else:
+                fragments.append(f'{qparams.get(node.name)}')
+        return ''.join(fragments)
+
+
+def _flat_plan(nodes: tuple):
+    if any(type(node) in (IfNode, ForNode) for node in nodes):
+        return None
+    return _FlatPlan(nodes)
+
+
+def _prepare_qparams(query_params, copy_params: bool, constants: dict = None):
+    # constants は Template.specialize で固定したパラメータで、 query_params より優先する
+    if copy_params:
+        qparams = deepcopy(query_params) if query_params else {}
+        _is_collect_type('query_params', qparams, dict)
+        if constants:
+            qparams.update(constants)
+        return qparams
+    # 呼び出し元の値はコピーせず、 for 用のパラメータは先頭の空dictにのみ追加される
+    qparams = query_params if query_params else {}
+    _is_collect_type('query_params', qparams, dict)
+    return ChainMap({}, constants, qparams) if constants else ChainMap({}, qparams)
+
+
+def _variant_key(constants: dict):
+    # 値が全てハッシュ可能な場合のみ、 constants ごとにテンプレートを再利用する
+    # 1, True, 1.0 のように等しい値でも型が異なれば別のキーとする
+    key = tuple(sorted((name, _typed_value(value)) for name, value in constants.items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _typed_value(value):
+    if type(value) is tuple:
+        return tuple, tuple(_typed_value(v) for v in value)
+    if type(value) is frozenset:
+        return frozenset, frozenset(_typed_value(v) for v in value)
+    return type(value), value
+
+
+class _RenderContext:
+    __slots__ = ('qparams', 'prmfmt', 'newline', 'stable_bind_names', 'loop_path', 'values', 'muted', 'buckets',
+                 'stats')
+
+    def __init__(self, qparams: dict, prmfmt: str, newline: str, stable_bind_names: bool, values: list = None,
+                 buckets=None):
+        self.qparams = qparams
+        self.prmfmt = prmfmt
+        self.newline = newline
+        self.stable_bind_names = stable_bind_names
+        # 外側の for から順に、現在のループ回数
+        self.loop_path = []
+        # 位置指定の paramstyle の場合、出現順のパラメータの値 それ以外は None
+        self.values = values
+        # 0 より大きい場合、出力しない if の内側を処理中
+        self.muted = 0
+        # IN 句のリスト展開を埋める設定 埋めない場合は None
+        self.buckets = buckets
+        # 計測中の場合は instrument.RenderStats 、それ以外は None
+        self.stats = None
+
+
+# #######################################
+# nodes
+# 各ノードの stream は出力する文字列のイテラブルを返し、 level の行頭空白数と次ノードの読み飛ばし文字数を更新する
+# render は stream と同じ文字列を level の push を通して out に追加する (Template.render 用)
+# #######################################
+class TextNode(namedtuple('TextNode', ('text', 'ldng_sp_cnt', 'single'))):
+    """ 静的な文字列
+
+    text は連続する静的トークンを結合したもの。
+    ldng_sp_cnt は最後のトークン出力後の行頭空白数、 single はトークンが1つだけかどうか。
+    """
+    __slots__ = ()
+
+    def stream(self, ctx: _RenderContext, tmp_params: dict, level: '_Level'):
+        return (self.output(ctx, level), )
+
+    def render(self, ctx: _RenderContext, tmp_params: dict, level: '_Level', out: list):
+        out.append(level.push(self.output(ctx, level)))
+
+    def output(self, ctx: _RenderContext, level: '_Level') -> str:
+        if level.skip:
+            # 直前の if/for 行を削除した場合、先頭の空白と改行を読み飛ばす
+            c = self.text[level.skip:]
+            ldng_sp_cnt = _update_blank_line(level.ldng_sp_cnt, c, ctx.newline) if self.single else self.ldng_sp_cnt
+        else:
+            c, ldng_sp_cnt = self.text, self.ldng_sp_cnt
+        level.ldng_sp_cnt, level.skip = ldng_sp_cnt, 0
+        return c
+
+    def collect(self, ctx: _RenderContext, tmp_params: dict, signature: list):
+        pass
+
+
+class ParamNode(namedtuple('ParamNode', ('name', 'in_list', 'array'))):
+    """ /*:param*/ または /*:param[]*/
+
+    in_list は IN 句の直後の場合 'in' または 'not in' 、それ以外は False 。 array は /*:param[]*/ 形式かどうか。
+    """
+    __slots__ = ()
+
+    def stream(self, ctx: _RenderContext, tmp_params: dict, level: '_Level'):
+        level.ldng_sp_cnt, level.skip = -1, 0
+        return (self.bind(ctx, tmp_params), )
+
+    def render(self, ctx: _RenderContext, tmp_params: dict, level: '_Level', out: list):
+        level.ldng_sp_cnt, level.skip = -1, 0
+        out.append(level.push(self.bind(ctx, tmp_params)))
+
+    def collect(self, ctx: _RenderContext, tmp_params: dict, signature: list):
+        self.bind(ctx, tmp_params)
+
+    def bind(self, ctx: _RenderContext, tmp_params: dict) -> str:
+        # パラメータを追加し、SQLに埋め込むパラメータ名を返す
+        if ctx.muted:
+            # 出力しない本文のため、パラメータは追加しない
+            return ctx.prmfmt.format(self.name, 0)
+        buckets = _in_list_buckets(ctx.buckets, self.in_list)
+        if ctx.values is not None:
+            return _bind_positional(self.name, ctx, tmp_params, buckets)
+        if buckets is not None:
+            _pad_in_list_param(self.name, ctx.qparams, tmp_params, buckets)
+        return _update_qparams_if_exist_tmp(self.name, ctx.qparams, tmp_params, ctx.prmfmt)
+
+
+class DirectNode(namedtuple('DirectNode', ('name', ))):
+    """ /*$param*/ """
+    __slots__ = ()
+
+    def stream(self, ctx: _RenderContext, tmp_params: dict, level: '_Level'):
+        return (self.output(ctx, tmp_params, level), )
+
+    def render(self, ctx: _RenderContext, tmp_params: dict, level: '_Level', out: list):
+        out.append(level.push(self.output(ctx, tmp_params, level)))
+
+    def output(self, ctx: _RenderContext, tmp_params: dict, level: '_Level') -> str:
+        c = self.value(ctx, tmp_params)
+        level.ldng_sp_cnt, level.skip = _update_blank_line(level.ldng_sp_cnt, c, ctx.newline), 0
+        return c
+
+    def collect(self, ctx: _RenderContext, tmp_params: dict, signature: list):
+        # 埋め込む値でSQLが変わるため、値そのものをシグネチャに含める
+        signature.append(self.value(ctx, tmp_params))
+
+    def value(self, ctx: _RenderContext, tmp_params: dict) -> str:
+        return f'{_scope(ctx.qparams, tmp_params).get(self.name)}'
+
+
+class IfNode(namedtuple('IfNode', ('statement', 'body', 'head_skip', 'tail_skip', 'end_skip', 'orelse'))):
+    """ /*%if ~*/ ~ /*%elif ~*/ ~ /*%else*/ ~ /*end*/
+
+    statement は "if BOOL_EXPRESSION" 形式、 /*%else*/ の分岐の場合は None 、 Template.specialize で評価済みの場合は bool 。
+    head_skip は if コメントと同じ行が空白のみの場合に読み飛ばす文字数、それ以外は None 。
+    tail_skip は /*end*/ と同じ行が空白のみの場合に /*end*/ の後ろから読み飛ばす文字数、それ以外は None 。
+    end_skip は本文を出力しない場合に /*end*/ の後ろから読み飛ばす文字数、本文の出力によって変わる場合は None 。
+    orelse は /*%elif ~*/ 、 /*%else*/ の分岐の IfNode のタプル 分岐ごとの head_skip は各コメントの行から求める。
+    """
+    __slots__ = ()
+
+    def stream(self, ctx: _RenderContext, tmp_params: dict, level: '_Level'):
+        index, branch = self.choose(ctx, tmp_params)
+        body_level = _head_of_block(branch.head_skip, level)
+        if 0 <= index:
+            blank = _BlankLine(level.ldng_sp_cnt, ctx.newline)
+            level.skip = yield from _stream_block_body(branch, ctx, tmp_params, body_level, blank)
+            level.ldng_sp_cnt = blank.ldng_sp_cnt()
+        else:
+            level.skip = _muted_end_skip(branch, ctx, tmp_params, body_level)
+
+    def render(self, ctx: _RenderContext, tmp_params: dict, level: '_Level', out: list):
+        index, branch = self.choose(ctx, tmp_params)
+        body_level = _head_of_block(branch.head_skip, level)
+        if 0 <= index:
+            blank, body = _BlankLine(level.ldng_sp_cnt, ctx.newline), []
+            level.skip = _render_block_body(branch, ctx, tmp_params, body_level, blank, body)
+            out.append(level.push(''.join(body)))
+            level.ldng_sp_cnt = blank.ldng_sp_cnt()
+        else:
+            level.skip = _muted_end_skip(branch, ctx, tmp_params, body_level)
+
+    def collect(self, ctx: _RenderContext, tmp_params: dict, signature: list):
+        index, branch = self.choose(ctx, tmp_params)
+        signature.append(index)
+        if 0 <= index:
+            collect_nodes(branch.body, ctx, tmp_params, signature)
+        elif branch.end_skip is None:
+            # 出力しない本文が /*end*/ の後ろで読み飛ばす文字数に影響する場合のみ、 stream と同様に辿る
+            ctx.muted += 1
+            collect_nodes(branch.body, ctx, tmp_params, signature)
+            ctx.muted -= 1
+
+    def choose(self, ctx: _RenderContext, tmp_params: dict) -> (int, 'IfNode'):
+        """条件を順に評価し、最初に真となる分岐を返す 以降の分岐の条件は評価しない
+
+        Returns:
+            tuple(int, IfNode): 分岐の位置 (if は 0) と分岐
+                いずれも偽の場合は -1 と最後の分岐 ( /*end*/ の直前の本文で読み飛ばす文字数を決める)
+        """
+        if _branch_is_true(self, ctx, tmp_params):
+            return 0, self
+        for index, branch in enumerate(self.orelse, 1):
+            if _branch_is_true(branch, ctx, tmp_params):
+                return index, branch
+        return -1, self.orelse[-1] if self.orelse else self
+
+
+class ForNode(namedtuple('ForNode', ('loop_id', 'vnames', 'statement', 'body', 'head_skip', 'tail_skip', 'end_skip',
+                                     'in_list'))):
+    """ /*%for ~ in ~*/ ~ /*end*/
+
+    loop_id はテンプレート内で何番目の for か、 vnames はループ変数名のタプル、 statement は "for x in xxx" 形式。
+    head_skip, tail_skip, end_skip は IfNode と同じ。 in_list は ParamNode と同じ。
+    """
+    __slots__ = ()
+
+    def stream(self, ctx: _RenderContext, tmp_params: dict, level: '_Level'):
+        body_level = _head_of_block(self.head_skip, level)
+        blank = _BlankLine(level.ldng_sp_cnt, ctx.newline)
+        prefix = _loop_prefix(self.loop_id, ctx)
+        buckets = _in_list_buckets(ctx.buckets, self.in_list)
+        for_variables = _get_for_variable_names(self.vnames, self.statement, ctx.qparams, tmp_params, prefix, buckets)
+        if ctx.stats is not None:
+            for_variables = ctx.stats.timed_loop(for_variables)
+        for loop_count, loop_params in enumerate(for_variables):
+            ctx.loop_path.append(loop_count)
+            yield from _stream_block_body(self, ctx, loop_params, body_level.copy(), blank)
+            ctx.loop_path.pop()
+        # /*end*/ の行を削除するかどうかは、ループ回数によらず本文を出力しない場合と同じ
+        level.skip = _muted_end_skip(self, ctx, {_DMY: True}, body_level.copy())
+        level.ldng_sp_cnt = blank.ldng_sp_cnt()
+
+    def render(self, ctx: _RenderContext, tmp_params: dict, level: '_Level', out: list):
+        body_level = _head_of_block(self.head_skip, level)
+        blank, body = _BlankLine(level.ldng_sp_cnt, ctx.newline), []
+        prefix = _loop_prefix(self.loop_id, ctx)
+        buckets = _in_list_buckets(ctx.buckets, self.in_list)
+        for_variables = _get_for_variable_names(self.vnames, self.statement, ctx.qparams, tmp_params, prefix, buckets)
+        for loop_count, loop_params in enumerate(for_variables):
+            ctx.loop_path.append(loop_count)
+            _render_block_body(self, ctx, loop_params, body_level.copy(), blank, body)
+            ctx.loop_path.pop()
+        out.append(level.push(''.join(body)))
+        level.skip = _muted_end_skip(self, ctx, {_DMY: True}, body_level.copy())
+        level.ldng_sp_cnt = blank.ldng_sp_cnt()
+
+    def collect(self, ctx: _RenderContext, tmp_params: dict, signature: list):
+        prefix = _loop_prefix(self.loop_id, ctx)
+        buckets = _in_list_buckets(ctx.buckets, self.in_list)
+        for_variables = _get_for_variable_names(self.vnames, self.statement, ctx.qparams, tmp_params, prefix, buckets)
+        for loop_count, loop_params in enumerate(for_variables):
+            # 1回ごとに True 、最後に False を追加し、ループ回数をシグネチャに含める
+            signature.append(True)
+            ctx.loop_path.append(loop_count)
+            collect_nodes(self.body, ctx, loop_params, signature)
+            ctx.loop_path.pop()
+        signature.append(False)
+        if self.end_skip is None:
+            ctx.muted += 1
+            collect_nodes(self.body, ctx, {_DMY: True}, signature)
+            ctx.muted -= 1
+
+
+def build_nodes(items: list, newline: str) -> tuple:
+    """解析結果のリストからノードのタプルを作成する
+
+    Args:
+        items (list): 静的な文字列、またはノード
+        newline (str): SQLに含まれる改行コード
+    Returns:
+        tuple: 連続する文字列を TextNode にまとめたノードのタプル
+    """
+    nodes, texts = [], []
+    for item in items:
+        if type(item) is not str:
+            _append_node(nodes, texts, item, newline)
+        elif item:
+            texts.append(item)
+    _flush_texts(nodes, texts, newline)
+    return tuple(nodes)
+
+
+def _append_node(nodes: list, texts: list, node, newline: str):
+    array_in = type(node) is ParamNode and node.array and _rewrite_array_in(texts)
+    _flush_texts(nodes, texts, newline)
+    nodes.append(_mark_in_list(node, nodes))
+    if array_in:
+        texts.append(')')
+
+
+def _rewrite_array_in(texts: list) -> bool:
+    # 直前が IN 句の場合、配列を1つのパラメータで渡すため "= ANY(" に置き換える
+    # ex: "id in /*:ids[]*/(1, 2)" -> "id = ANY(:ids)", "id not in ~" -> "id <> ALL(:ids)"
+    text = ''.join(texts)
+    matched = _ARRAY_IN.search(text, max(0, len(text) - 64))
+    if matched is None:
+        return False
+    texts[:] = [text[:matched.start()], '<> ALL(' if matched.group(1) else '= ANY(']
+    return True
+
+
+def block_end_skip(body: tuple, head_skip, tail_skip, newline: str):
+    """if/for の本文を出力しない場合に、 /*end*/ の後ろから読み飛ばす文字数を本文を辿らずに求める
+
+    本文の末尾に if/for がある場合は、その if/for の各分岐を出力する場合と出力しない場合の全てから求める。
+
+    Args:
+        body (tuple): if/for の本文のノード
+        head_skip (int): if/for コメントと同じ行が空白のみの場合に読み飛ばす文字数、それ以外は None
+        tail_skip (int): /*end*/ と同じ行が空白のみの場合に読み飛ばす文字数、それ以外は None
+        newline (str): SQLに含まれる改行コード
+    Returns:
+        int or None: 読み飛ばす文字数 本文の出力によって変わる場合は None
+    """
+    if tail_skip is None:
+        return 0
+    skips = _end_skips(body, head_skip, tail_skip, newline)
+    return skips.pop() if skips is not None and len(skips) == 1 else None
+
+
+def _end_skips(body: tuple, head_skip, tail_skip, newline: str):
+    # 本文の出力後に /*end*/ の後ろから読み飛ばす文字数として取り得る値 求められない場合は None
+    if tail_skip is None:
+        return {0}
+    tails = _tail_outcomes(body, len(body), head_skip, newline)
+    if tails is None:
+        return None
+    # 最後の行が空白のみ (改行で終わる、または空白以外を出力しない) 場合のみ読み飛ばす
+    return {0 if tail is False else tail_skip for tail in tails}
+
+
+def _tail_outcomes(nodes: tuple, end: int, head_skip, newline: str):
+    """nodes[:end] の出力の末尾として取り得る値を返す 求められない場合は None
+
+    True は改行で終わる場合、 False はそれ以外の文字で終わる場合、 _NO_OUTPUT は空白以外を出力しない場合。
+    """
+    if not end:
+        return {_NO_OUTPUT}
+    last = nodes[end - 1]
+    if type(last) is ParamNode:
+        return {False}
+    if type(last) is TextNode:
+        return _text_tail_outcomes(nodes, end, head_skip, newline)
+    if type(last) in (IfNode, ForNode):
+        return _block_tail_outcomes(nodes, end, head_skip, newline)
+    # /*$param*/ は埋め込む値で決まる
+    return None
+
+
+def _text_tail_outcomes(nodes: tuple, end: int, head_skip, newline: str):
+    # 先頭の空白と改行を読み飛ばすのは、本文の先頭か if/for の直後のみ
+    skips = _skips_before(nodes, end - 1, head_skip, newline)
+    if skips is None:
+        return None
+    outcomes, before = set(), None
+    for skip in skips:
+        c = nodes[end - 1].text[skip:].rstrip(' ')
+        if not c:
+            # 空白以外を出力しない場合、末尾は直前までの出力で決まる
+            before = before or _tail_outcomes(nodes, end - 1, head_skip, newline)
+            if before is None:
+                return None
+            outcomes |= before
+        elif len(newline) <= len(c) or not c.endswith(newline[-1]):
+            outcomes.add(c.endswith(newline))
+        else:
+            # 改行コードの途中までの文字列は、直前の出力とつなげて判断する必要がある
+            return None
+    return outcomes
+
+
+def _skips_before(nodes: tuple, index: int, head_skip, newline: str):
+    # nodes[index] の出力前に読み飛ばす文字数として取り得る値
+    if not index:
+        return {0} if head_skip is None else {0, head_skip}
+    prev = nodes[index - 1]
+    if type(prev) is ForNode:
+        # for の後ろで読み飛ばす文字数は、ループ回数によらず本文を出力しない場合と同じ
+        return _end_skips(prev.body, prev.head_skip, prev.tail_skip, newline)
+    if type(prev) is not IfNode:
+        return {0}
+    # いずれの分岐も通らない場合は、最後の分岐で読み飛ばす文字数を決める
+    skips = set()
+    for branch in _if_outputs(prev)[0]:
+        branch_skips = _end_skips(branch.body, branch.head_skip, branch.tail_skip, newline)
+        if branch_skips is None:
+            return None
+        skips |= branch_skips
+    return skips
+
+
+def _block_tail_outcomes(nodes: tuple, end: int, head_skip, newline: str):
+    block = nodes[end - 1]
+    # ループ回数が 0 回、またはいずれの分岐も通らない場合は何も出力しない
+    branches, may_be_empty = ([block], True) if type(block) is ForNode else _if_outputs(block)
+    outcomes = {_NO_OUTPUT} if may_be_empty else set()
+    for branch in branches:
+        tails = _tail_outcomes(branch.body, len(branch.body), branch.head_skip, newline)
+        if tails is None:
+            return None
+        outcomes |= tails
+    if _NO_OUTPUT not in outcomes:
+        return outcomes
+    before = _tail_outcomes(nodes, end - 1, head_skip, newline)
+    return None if before is None else (outcomes - {_NO_OUTPUT}) | before
+
+
+def _if_outputs(node: 'IfNode') -> (list, bool):
+    """本文を出力し得る分岐と、いずれの分岐も通らない場合があるかどうかを返す
+
+    必ず通る分岐より後ろの分岐は含めない。出力しない for の本文では全ての条件を真とみなすため、
+    Template.specialize で偽に決まった分岐も含める。
+    """
+    branches = []
+    for branch in (node, *node.orelse):
+        branches.append(branch)
+        if branch.statement is None or branch.statement is True:
+            return branches, False
+    return branches, True
+
+
+def _mark_in_list(node, nodes: list):
+    # 直前の文字列が IN 句の場合、 InListBuckets の対象とする
+    if type(node) not in (ParamNode, ForNode) or not nodes or type(nodes[-1]) is not TextNode:
+        return node
+    matched = _IN_LIST.search(nodes[-1].text[-64:])
+    if matched is None:
+        return node
+    return node._replace(in_list=_NOT_IN if matched.group(1) else _IN)
+
+
+def _in_list_buckets(buckets, in_list):
+    # IN 句のリスト展開を埋める設定 埋めない場合は None
+    if buckets is None or not in_list:
+        return None
+    return buckets.for_not_in() if in_list == _NOT_IN else buckets
+
+
+def number_for_nodes(nodes: tuple, counter) -> tuple:
+    """ForNode にテンプレート内の出現順で loop_id を付与する
+
+    Args:
+        nodes (tuple): 対象のノード
+        counter (iterator): 出現順を返すイテレータ ex: itertools.count()
+    Returns:
+        tuple: loop_id を付与したノード
+    """
+    return tuple(_number_for_node(node, counter) for node in nodes)
+
+
+def _number_for_node(node, counter):
+    if type(node) is ForNode:
+        loop_id = next(counter)
+        return node._replace(loop_id=loop_id, body=number_for_nodes(node.body, counter))
+    if type(node) is IfNode:
+        return node._replace(body=number_for_nodes(node.body, counter), orelse=number_for_nodes(node.orelse, counter))
+    return node
+
+
+def _flush_texts(nodes: list, texts: list, newline: str):
+    if texts:
+        ldng_sp_cnt = _update_blank_line(-1, texts[-1], newline)
+        nodes.append(TextNode(''.join(texts), ldng_sp_cnt, len(texts) == 1))
+        texts.clear()
+
+
+class _Level:
+    """ ノードの出力状態 if/for の内側は、1回の出力ごとに別の _Level を利用する
+
+    末尾の空白は後続の if/for の行を削除する場合に取り除くため、次の出力まで保留する。
+    """
+    __slots__ = ('newline', 'ldng_sp_cnt', 'skip', 'pending', 'tail', 'nl_len')
+
+    def __init__(self, newline: str, ldng_sp_cnt: int, skip: int):
+        """
+        Args:
+            newline (str): SQLに含まれる改行コード
+            ldng_sp_cnt (int): 行頭から続く空白文字の個数
+            skip (int): 次のノードで読み飛ばす文字数
+        """
+        self.newline = newline
+        self.ldng_sp_cnt = ldng_sp_cnt
+        self.skip = skip
+        # 保留中の末尾の空白、出力済みの末尾 (改行コードの長さ以上)
+        self.pending = ''
+        self.tail = ''
+        self.nl_len = len(newline)
+
+    def copy(self) -> '_Level':
+        return _Level(self.newline, self.ldng_sp_cnt, self.skip)
+
+    def push(self, c: str) -> str:
+        """保留中の空白に c を続け、末尾の空白を除いた出力可能な文字列を返す"""
+        if self.pending:
+            c = self.pending + c
+        out = c.rstrip(' ')
+        self.pending = c[len(out):]
+        if out:
+            self.tail = out if self.nl_len <= len(out) else (self.tail + out)[-self.nl_len:]
+        return out
+
+    def delete_last_space(self):
+        self.pending = ''
+
+    def last_line_is_blank(self) -> bool:
+        # 出力済みの文字列が改行で終わる場合、最後の行は保留中の空白のみ
+        return self.tail == '' or self.tail.endswith(self.newline)
+
+
+class _BlankLine:
+    """ if/for の出力全体に対して、 _update_blank_line と同じ値を求める
+
+    _Level は末尾の空白を保留して出力するため、最後の空白以外の文字が改行かどうかと、その後ろの空白数から求められる。
+    """
+    __slots__ = ('base', 'newline', 'seen', 'ends_nl', 'spaces')
+
+    def __init__(self, ldng_sp_cnt: int, newline: str):
+        self.base = ldng_sp_cnt
+        self.newline = newline
+        self.seen = False
+        self.ends_nl = False
+        self.spaces = 0
+
+    def add(self, level: _Level, spaces: int):
+        """if/for の内側の出力を1回分追加する
+
+        Args:
+            level (_Level): 出力を終えた内側の出力状態
+            spaces (int): 出力済みの文字列の後ろに続けて出力した空白の数
+        """
+        if level.tail:
+            self.seen, self.ends_nl, self.spaces = True, level.tail.endswith(self.newline), spaces
+        else:
+            self.spaces += spaces
+
+    def ldng_sp_cnt(self) -> int:
+        if not self.seen:
+            return self.spaces if self.spaces else self.base
+        # 改行コードが2文字以上の場合、 _update_blank_line は改行コードの2文字目を空白以外の文字とみなす
+        return self.spaces if self.ends_nl and len(self.newline) == 1 else -1
+
+
+def stream_nodes(nodes: tuple, ctx: _RenderContext, tmp_params: dict, level: _Level):
+    """ノードを順に出力する 末尾の空白は level に保留したまま返さない
+
+    Args:
+        nodes (tuple): 出力対象のノード
+        ctx (_RenderContext): 出力中のパラメータ等
+        tmp_params (dict): for内の一時パラメータ
+        level (_Level): 出力状態
+    Returns:
+        generator: 構築したSQLの断片
+    """
+    push = level.push
+    for node in nodes:
+        for c in node.stream(ctx, tmp_params, level):
+            c = push(c)
+            if c:
+                yield c
+
+
+def render_nodes(nodes: tuple, ctx: _RenderContext, tmp_params: dict, level: _Level, out: list):
+    """ノードを順に出力し、 stream_nodes と同じ断片を out に追加する 末尾の空白は level に保留したまま追加しない
+
+    ジェネレータを連ねないため、SQL全体を1つの文字列にする場合は stream_nodes より速い。
+
+    Args:
+        nodes (tuple): 出力対象のノード
+        ctx (_RenderContext): 出力中のパラメータ等
+        tmp_params (dict): for内の一時パラメータ
+        level (_Level): 出力状態
+        out (list): 構築したSQLの断片を追加するリスト
+    """
+    for node in nodes:
+        node.render(ctx, tmp_params, level, out)
+
+
+def collect_nodes(nodes: tuple, ctx: _RenderContext, tmp_params: dict, signature: list):
+    """SQLを構築せずにパラメータのみを求め、構築するSQLを決める値をシグネチャに追加する
+
+    stream_nodes と同じ順に式を評価するため、同じシグネチャからは同じSQLが構築される。
+
+    Args:
+        nodes (tuple): 対象のノード
+        ctx (_RenderContext): 出力中のパラメータ等
+        tmp_params (dict): for内の一時パラメータ
+        signature (list): %if の真偽、 %for のループ回数、 /*$param*/ の値を出現順に追加するリスト
+    """
+    for node in nodes:
+        node.collect(ctx, tmp_params, signature)
+
+
+def _stream_root(nodes: tuple, ctx: _RenderContext):
+    level = _Level(ctx.newline, 0, 0)
+    yield from stream_nodes(nodes, ctx, {}, level)
+    if level.pending:
+        yield level.pending
+
+
+def _render_root(nodes: tuple, ctx: _RenderContext) -> str:
+    level, out = _Level(ctx.newline, 0, 0), []
+    render_nodes(nodes, ctx, {}, level, out)
+    out.append(level.pending)
+    return ''.join(out)
+
+
+def _head_of_block(head_skip, level: _Level) -> _Level:
+    # if/for コメントの行が空白のみの場合、その行を出力しない
+    if 0 <= level.ldng_sp_cnt and head_skip is not None:
+        level.delete_last_space()
+        # 改行削除済みの場合、 ldng_sp_cnt は 0 から
+        return _Level(level.newline, 0 if head_skip else -1, head_skip)
+    return _Level(level.newline, -1, 0)
+
+
+def _stream_block_body(node, ctx: _RenderContext, tmp_params: dict, body_level: _Level, blank: _BlankLine):
+    """if/for の内側を出力する
+
+    Returns:
+        generator: 構築したSQLの断片 return の値は /*end*/ の後ろで読み飛ばす文字数
+    """
+    yield from stream_nodes(node.body, ctx, tmp_params, body_level)
+    # /*end*/ の行に含まれる文字がスペースのみの場合、その行は出力せず次の行から読み込ませる
+    if node.tail_skip is not None and body_level.last_line_is_blank():
+        blank.add(body_level, 0)
+        return node.tail_skip
+    blank.add(body_level, len(body_level.pending))
+    if body_level.pending:
+        yield body_level.pending
+    return 0
+
+
+def _render_block_body(node, ctx: _RenderContext, tmp_params: dict, body_level: _Level, blank: _BlankLine,
+                       out: list) -> int:
+    # _stream_block_body と同じ断片を out に追加し、 /*end*/ の後ろで読み飛ばす文字数を返す
+    render_nodes(node.body, ctx, tmp_params, body_level, out)
+    if node.tail_skip is not None and body_level.last_line_is_blank():
+        blank.add(body_level, 0)
+        return node.tail_skip
+    blank.add(body_level, len(body_level.pending))
+    out.append(body_level.pending)
+    return 0
+
+
+def _muted_end_skip(node, ctx: _RenderContext, tmp_params: dict, body_level: _Level) -> int:
+    # 本文を出力しない if/for の /*end*/ の後ろで読み飛ばす文字数
+    # 本文によらず決まる場合は本文を辿らず、本文の出力によって変わる場合のみ出力せずに辿る
+    if node.end_skip is not None:
+        return node.end_skip
+    ctx.muted += 1
+    skip = _render_block_body(node, ctx, tmp_params, body_level, _BlankLine(0, ctx.newline), [])
+    ctx.muted -= 1
+    return skip
+
+
+def _drain(body) -> int:
+    # 出力せずに最後まで処理し、 return の値を返す
+    while True:
+        try:
+            next(body)
+        except StopIteration as e:
+            return e.value
+
+
+def _update_qparams_if_exist_tmp(param: str, qparams: dict, tmp_params: dict, prmfmt: str) -> str:
+    tmp_name = tmp_params.get(param, {}).get(_TN)
+    if _tmpp_is_dummy(tmp_params):
+        # tmp_paramsがダミーの場合
+        return prmfmt.format(param)
+    elif tmp_name is not None:
+        qparams[tmp_name] = tmp_params.get(param, {}).get(_VL)
+        return prmfmt.format(tmp_name)
+    return prmfmt.format(param)
+
+
+def _bind_positional(param: str, ctx: _RenderContext, tmp_params: dict, buckets) -> str:
+    values = ctx.values
+    if _tmpp_is_dummy(tmp_params):
+        # 出力しない文字列のため、値は追加しない
+        return ctx.prmfmt.format(param, len(values) + 1)
+    tmp = tmp_params.get(param)
+    if tmp is not None:
+        value = tmp[_VL]
+    elif param in ctx.qparams:
+        value = ctx.qparams[param]
+    else:
+        raise TwspExecuteError(Msg.E0013, param)
+    values.append(value if buckets is None else buckets.pad_value(value))
+    return ctx.prmfmt.format(param, len(values))
+
+
+def _pad_in_list_param(param: str, qparams: dict, tmp_params: dict, buckets):
+    # 埋めた後の件数は段階と同じため、同じパラメータを複数回埋めても値は変わらない
+    if _tmpp_is_dummy(tmp_params):
+        return
+    tmp = tmp_params.get(param)
+    if tmp is not None:
+        tmp_params[param] = {**tmp, _VL: buckets.pad_value(tmp[_VL])}
+    elif param in qparams:
+        qparams[param] = buckets.pad_value(qparams[param])
+
+
+def _loop_prefix(loop_id: int, ctx: _RenderContext) -> str:
+    if not ctx.stable_bind_names:
+        return str(uuid4()).replace('-', '_')
+    # for の位置と外側のループ回数から決めるため、同じ形のループは常に同じ名前になる
+    # ex: 2番目の for が 1番目の for の3回目のループ内にある場合: __f1_2
+    return ''.join([f'__f{loop_id}', *(f'_{loop_count}' for loop_count in ctx.loop_path)])
+
+
+def _get_for_variable_names(vnames: tuple, for_statement: str, qparams: dict, tmp_params: dict,
+                            prefix: str, buckets=None) -> dict:
+    """
+    Args:
+        vnames (tuple): ループ変数名 ex: ('i', 'kv')
+        for_statement (str): 'for x in xxx'
+        qparams (dict):
+        tmp_params (dict):
+            ex1: {}
+            ex2:
+            ex3: {__DMY: True}
+        prefix (str): 一時パラメータ名の接頭辞
+        buckets (InListBuckets): 指定した場合、ループ対象の件数を段階まで埋める
+    Returns:
+
+    """
+    vnames_str = ",".join(vnames)
+    for_statement = f'for {vnames_str} in []' if _tmpp_is_dummy(tmp_params) else for_statement
+    try:
+        clauses = _compile_expression(for_statement, True)
+    except Exception as e:
+        raise TwspExecuteError(Msg.E0008, e, for_statement)
+    # ループ対象を1件ずつ読み込むため、リストにせずに順に評価する
+    values_iter = _iter_for_clauses(clauses, 0, _scope(qparams, tmp_params), {}, vnames)
+
+    values_iter = _iter_loop_values(values_iter, for_statement)
+    if buckets is not None:
+        values_iter = buckets.pad_loop(values_iter, len(vnames))
+    for tmp_variable in _enum_temp_variables(vnames, values_iter, prefix):
+        yield {**tmp_params, **tmp_variable}
+    # 変数名のリスト
+    # for a in range(3)なら
+    # -> {'a': {'tmpnm': '__f0_0_a', 'value': 0}}
+    # -> {'a': {'tmpnm': '__f0_1_a', 'value': 1}}
+    # -> {'a': {'tmpnm': '__f0_2_a', 'value': 2}}
+    # for a,b,c in zip(['A', 'b'], ['I', 'j'], ['X', 'y'])なら、
+    # -> {'a': {'tmpnm': '__f0_0_a', 'value': 'A'},
+    #     'b': {'tmpnm': '__f0_0_b', 'value': 'I'},
+    #     'c': {'tmpnm': '__f0_0_c', 'value': 'X'}}
+    # -> {'a': {'tmpnm': '__f0_1_a', 'value': 'b'},
+    #     'b': {'tmpnm': '__f0_1_b', 'value': 'j'},
+    #     'c': {'tmpnm': '__f0_1_c', 'value': 'y'}}
+
+
+def _iter_for_clauses(clauses: tuple, index: int, scope: Mapping, bound: dict, vnames: tuple):
+    """for ~ in ~ if ~ の各節を順に評価し、ループ変数の値を返す
+
+    ジェネレータ式は式を別のスコープで評価するため、 if の条件から query_params を参照できない (Python 3.12 以降は
+    リスト内包表記とも異なる) 。ループ対象と条件の式を個別に評価し、ループ変数への代入はここで行う。
+    """
+    target, iter_code, if_codes = clauses[index]
+    for value in eval(iter_code, {}, ChainMap(bound, scope)):
+        _assign_for_target(target, value, bound)
+        if if_codes and not all(eval(code, {}, ChainMap(bound, scope)) for code in if_codes):
+            continue
+        if index + 1 < len(clauses):
+            yield from _iter_for_clauses(clauses, index + 1, scope, bound, vnames)
+        else:
+            yield bound[vnames[0]] if len(vnames) == 1 else tuple(bound[vname] for vname in vnames)
+
+
+def _assign_for_target(target, value, bound: dict):
+    # for の代入先 (ループ変数名、またはそのタプル) に値を展開する
+    if type(target) is ast.Name:
+        bound[target.id] = value
+        return
+    values = tuple(value)
+    if len(values) != len(target.elts):
+        raise ValueError(f'expected {len(target.elts)} values to unpack, got {len(values)}')
+    for elt, elt_value in zip(target.elts, values):
+        _assign_for_target(elt, elt_value, bound)
+
+
+def _compile_for_statement(for_statement: str) -> tuple:
+    """"for x in xxx if yyy" 形式の文を、 for ごとの (代入先, ループ対象の式, 条件の式のタプル) のタプルにする"""
+    tree = ast.parse(f'[None {for_statement}]', mode='eval')
+    clauses = []
+    for clause in tree.body.generators:
+        _validate_for_target(clause.target, for_statement)
+        clauses.append((clause.target, _compile_node(clause.iter), tuple(_compile_node(c) for c in clause.ifs)))
+    return tuple(clauses)
+
+
+def _validate_for_target(target, for_statement: str):
+    if type(target) in (ast.Tuple, ast.List):
+        for elt in target.elts:
+            _validate_for_target(elt, for_statement)
+    elif type(target) is not ast.Name:
+        raise SyntaxError(f'unsupported loop variable in "{for_statement}"')
+
+
+def _compile_node(node):
+    return compile(ast.Expression(node), '<twsqlparser>', 'eval')
+
+
+def _iter_loop_values(values_iter, for_statement: str):
+    # ループ対象の読み込み中に発生した例外も、式の評価時と同じ例外にする
+    try:
+        yield from values_iter
+    except Exception as e:
+        raise TwspExecuteError(Msg.E0008, e, for_statement)
+
+
+def _enum_temp_variables(vnames: tuple, values_list, prefix: str):
+    if len(vnames) == 1:
+        for vi, values in enumerate(values_list):
+            vname = vnames[0]
+            tmp_name = _gen_tmp_name(vname, vi, prefix)
+            yield {vname: {_TN: tmp_name, _VL: values}}
+    else:
+        for vi, values in enumerate(values_list):
+            tmpdct = {}
+            for ni, vname in enumerate(vnames):
+                tmp_name = _gen_tmp_name(vname, vi, prefix)
+                tmpdct[vname] = {_TN: tmp_name, _VL: values[ni]}
+            yield tmpdct
+
+
+def _gen_tmp_name(vname: str, loop_count: int, prefix: str) -> str:
+    name = f'{prefix}_{loop_count}_{vname}'
+    return name
+
+
+def _branch_is_true(branch: IfNode, ctx: _RenderContext, tmp_params: dict) -> bool:
+    statement = branch.statement
+    if statement is None or _tmpp_is_dummy(tmp_params):
+        # /*%else*/ 、または出力しない for の本文 (全ての条件を真とみなす)
+        return True
+    if type(statement) is bool:
+        # Template.specialize で評価済みの条件
+        return statement
+    if ctx.stats is None:
+        return _execute_if_statement(statement, ctx.qparams, tmp_params)
+    return ctx.stats.timed_eval(_execute_if_statement, statement, ctx.qparams, tmp_params)
+
+
+def _execute_if_statement(statement: str, qparams: dict, tmp_params: dict) -> bool:
+    # statement: "if BOOL_EXPRESSION"
+    if _tmpp_is_dummy(tmp_params):
+        return True
+    try:
+        code = _compile_expression(f'True {statement} else False')
+        is_true = eval(code, {}, _scope(qparams, tmp_params))
+    except NameError as e:
+        raise TwspExecuteError(Msg.E0005, e, statement)
+    if type(is_true) != bool:
+        raise TwspExecuteError(Msg.E0006, statement)
+    return is_true
+
+
+@lru_cache(maxsize=get_cache_maxsize('TWSP_EXPR_CACHE_SIZE', 256))
+def _compile_expression(source: str, loop: bool = False):
+    # %if, %for の式をコンパイルした結果を式の文字列ごとにキャッシュする
+    if loop:
+        return _compile_for_statement(source)
+    return compile(source, '<twsqlparser>', 'eval')
+
+
+def expression_cache_info():
+    """%if, %for の式のキャッシュ状況を返す
+
+    Returns:
+        functools._CacheInfo: hits, misses, maxsize, currsize
+    """
+    return _compile_expression.cache_info()
+
+
+def _update_blank_line(ldng_sp_cnt: int, c: str, newline: str) -> int:
+    if not c:
+        return ldng_sp_cnt
+
+    ridx = c.rfind(newline)
+    after_nl = c[ridx + 1:]
+    if after_nl.lstrip(' ') == '':
+        # 改行後、全部スペースの場合
+        return len(after_nl)
+    else:
+        return -1
+
+
+# #######################################
+# temp_params
+# #######################################
+def _tmpp_is_dummy(tmpp: dict) -> bool:
+    return True if tmpp.get(_DMY) is True else False
+
+
+class _Scope(Mapping):
+    """ for のループ変数を query_params に重ねて参照する %if, %for の式の評価時は locals として渡す
+
+    query_params はコピーせずに参照するため、1回の評価にかかる時間はパラメータ数に依存しない。
+    """
+    __slots__ = ('qparams', 'tmp_params')
+
+    def __init__(self, qparams: dict, tmp_params: dict):
+        self.qparams = qparams
+        self.tmp_params = tmp_params
+
+    def __getitem__(self, key):
+        tmp = self.tmp_params.get(key)
+        if tmp is not None:
+            return tmp[_VL]
+        return self.qparams[key]
+
+    def __iter__(self):
+        yield from self.tmp_params
+        yield from (key for key in self.qparams if key not in self.tmp_params)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def _scope(qparams: dict, tmp_params: dict) -> Mapping:
+    # for の外側、またはダミーの場合はループ変数が無いため、 query_params をそのまま参照する
+    if not tmp_params or _tmpp_is_dummy(tmp_params):
+        return qparams
+    return _Scope(qparams, tmp_params)
+
+
+# #######################################
+# validation
+# #######################################
+def _is_collect_type(argname, value, expected_type):
+    if type(value) != expected_type:
+        raise TwspValidateError(Msg.E0001, argname, expected_type, type(value))
+
+
+def _validate_paramstyle(paramstyle):
+    if (not isinstance(paramstyle, ParamStyle)) or paramstyle not in ParamStyle:
+        ps = [f'{p.__class__.__name__}.{p.name}' for p in ParamStyle]
+        raise TwspValidateError(Msg.E0009, f'{", ".join(ps[:-1])}', ps[-1], paramstyle)
+    return True
@@ -1,38 +1,35 @@
 #!/usr/bin/env python3
 # (C) 2021 gomachssm
 
+import itertools
 import logging
-import os
 import pathlib
-from copy import deepcopy
-from uuid import uuid4
 from functools import lru_cache
 
-from .internal_exceptions import Msg, TwspException, TwspExecuteError, TwspValidateError
-from .enums import ParamStyle, CommentType
+from . import instrument
+from .internal_exceptions import Msg, TwspException, TwspValidateError
+from .enums import ParamStyle, TokenType
+from .cache import FileCache, FileCacheInfo, get_cache_maxsize, get_check_interval
+from .lexer import next_token, dummy_end
+from .template import Template, ParamNode, DirectNode, IfNode, ForNode, build_nodes, number_for_nodes, _END
+from .template import block_end_skip
+from .template import _is_collect_type, _validate_paramstyle
 
 
 logger = logging.getLogger(__name__)
 
+# 改行コードの初期値 解析時の改行コードは引数で持ち回すため、この値を書き換えても解析には影響しない
 NEWLINE_CHAR = '\n'
 
-_TN = 'tmpnm'
-_VL = 'value'
-_DMY = '...dummy...'
-
-_END = '/*end*/'
-_FIND_TARGETS = ('"', "'", '(', '[', '{', '--', '/*', )
-_BRACKET_PARE = {'[': ']', '(': ')', '{': '}'}
-# ([{'"\ 以外の一般的な記号と空白文字
-_EOP_SIMPLE_PARAM = ('!', '#', '$', '%', '&', ')', '-', '=', '^', '~',
-                     '|', '@', '`', ';', '+', ':', '*', ']', '}',
-                     ',', '/', '<', '>', '?', ' ',     # '.', '(', '_',
-                     '\t', '\n', '\r', )
-_EOP_END = (_END, )
+# parse_file, compile_file で読み込んだSQLファイルのキャッシュ
+file_cache = FileCache(max_entries=get_cache_maxsize('TWSP_CACHE_SIZE', 20),
+                       max_bytes=get_cache_maxsize('TWSP_FILE_CACHE_BYTES', 32 * 1024 * 1024),
+                       check_interval=get_check_interval('TWSP_FILE_CHECK_INTERVAL'))
 
 
 def parse_file(file_path: str, query_params=None, delete_comment=True, encoding='utf-8', newline='\n',
-               paramstyle: ParamStyle = None) -> (str, dict):
+               paramstyle: ParamStyle = None, stable_bind_names=True, copy_params=True,
+               in_buckets=None, render_cache=None) -> (str, dict):
     """SQLファイルを読み込み、解析を行う
 
     Args:
@@ -43,558 +40,325 @@ def parse_file(file_path: str, query_params=None, delete_comment=True, encoding=
         encoding (str): 対象ファイルの文字コード デフォルトは utf-8
         newline (str): 対象ファイルの改行コード (デフォルトは '\n')
         paramstyle (ParamStyle): 解析後のSQLパラメータ書式を決める。未指定時は `NAMED` と同じ扱い
+        stable_bind_names (bool): True の場合、for 内のパラメータ名を for の位置とループ回数から決める
+            False の場合は uuid4 から決める (デフォルトは True)
+        copy_params (bool): True の場合、 query_params を deepcopy したdictを返す
+            False の場合はコピーせず、 for 用のパラメータを query_params に重ねた ChainMap を返す
+            (デフォルトは True)
+        in_buckets (InListBuckets): 指定した場合、IN 句のリスト展開の件数を段階まで埋める
+        render_cache (RenderCache): 指定した場合、 %if の真偽と %for のループ回数が同じであれば構築済みのSQLを再利用する
     Returns:
         tuple(str, dict):
             str: 解析後のSQL
-            dict: パラメータ更新後のdict
+            dict: パラメータ更新後のdict ( copy_params が False の場合は ChainMap )
     """
     try:
         base_sql = _open_file(file_path, encoding=encoding)
-        sql, qparams = parse_sql(base_sql, query_params, delete_comment=delete_comment, newline=newline,
-                                 paramstyle=paramstyle)
-        return sql, qparams
+        template = _compile_cache(base_sql, delete_comment, newline, file_path)
+        return template.render(query_params, paramstyle, stable_bind_names, copy_params, in_buckets, render_cache)
     except TwspException as e:
         logger.error(e.msg_txt)
 
 
 def parse_sql(base_sql: str, query_params=None, delete_comment=True, newline='\n',
-              paramstyle: ParamStyle = None) -> (str, dict):
+              paramstyle: ParamStyle = None, stable_bind_names=True, copy_params=True,
+              in_buckets=None, render_cache=None) -> (str, dict):
     """SQLの解析を行う.
 
+    コンパイル済みのテンプレートをキャッシュし、同じSQLの2回目以降の解析では字句解析を省略する。
+
     Args :
         base_sql (str): 解析対象SQL(必須)
         query_params (dict): SQL実行時に利用するパラメータ
         delete_comment (bool): True の場合、通常コメントを削除、 False の場合は削除しない (デフォルトは True)
         newline (str): SQLに含まれる改行コード (デフォルトは '\n')
         paramstyle (ParamStyle): 解析後のSQLパラメータ書式を決める。未指定時は `NAMED` と同じ扱い
+        stable_bind_names (bool): True の場合、for 内のパラメータ名を for の位置とループ回数から決める
+            False の場合は uuid4 から決める (デフォルトは True)
+        copy_params (bool): True の場合、 query_params を deepcopy したdictを返す
+            False の場合はコピーせず、 for 用のパラメータを query_params に重ねた ChainMap を返す
+            (デフォルトは True)
+        in_buckets (InListBuckets): 指定した場合、IN 句のリスト展開の件数を段階まで埋める
+            InListBuckets.shape_count で構築したSQLの種類数を確認できる
+        render_cache (RenderCache): 指定した場合、 %if の真偽と %for のループ回数が同じであれば構築済みのSQLを再利用する
+            RenderCache.info でキャッシュの利用状況を確認できる
 
     Returns:
         tuple(str, dict):
             str: 解析後のSQL
-            dict: パラメータ更新後のdict
+            dict: パラメータ更新後のdict ( copy_params が False の場合は ChainMap )
     """
-    global NEWLINE_CHAR
-    NEWLINE_CHAR = newline
     pstyle = paramstyle or ParamStyle.NAMED
     _validate_paramstyle(pstyle)
 
-    # PARAMSTYLEの値に応じたパラメータ書式のセット
-    # TODO: グローバルではなく、引数で持ち回せるようにしたい
-    prmfmt = pstyle.value
     try:
-        qparams = deepcopy(query_params) if query_params else {}
         _is_collect_type('base_sql', base_sql, str)
-        _is_collect_type('query_params', qparams, dict)
-        # base_sql = _format_line_forifend(base_sql)
-        sql, _, _ = _parse(base_sql, qparams, delete_comment, prmfmt)
-        return sql, qparams
+        template = _compile_cache(base_sql, delete_comment, newline)
+        return template.render(query_params, pstyle, stable_bind_names, copy_params, in_buckets, render_cache)
     except TwspException as e:
         logger.error(e)
         # logger.error(e.msg_txt)
 
 
-def _parse(base_sql: str, qparams: dict, delete_comment: bool, prmfmt: str, eop=None, tmp_params=None,
-           after_pcmt=False, ldng_sp_cnt=0) -> (str, int, int):
-    """ SQLを解析してパラメータを埋め込む
+def compile(base_sql: str, delete_comment=True, newline='\n', name: str = None) -> Template:
+    """SQLを字句解析し、再利用可能なテンプレートを作成する
 
     Args:
-        base_sql (str): 元となるSQL
-        qparams (dict): パラメータ
-        delete_comment (bool): コメント削除フラグ
-        eop (tuple->str or None): 解析終了文字 End of parse
-        tmp_params (dict): for内の一時パラメータ default: None
-        after_pcmt (bool): パラメータ直後フラグ default: False
-        ldng_sp_cnt (int): 行頭から続く空白文字の個数 default: 0
-
+        base_sql (str): 解析対象SQL(必須)
+        delete_comment (bool): True の場合、通常コメントを削除、 False の場合は削除しない (デフォルトは True)
+        newline (str): SQLに含まれる改行コード (デフォルトは '\n')
+        name (str): 計測結果の集計に利用するテンプレート名 ( `twsqlparser.stats` 参照)
+            None の場合は base_sql のハッシュから決める
     Returns:
-        tuple:
-            str: 構築したSQL
-            int: 最後の改行から連続したスペースの個数
-                1以上: その個数分のスペースが末尾に存在する
-                0以下: 末尾にスペースが存在しない
-            int: return時のインデックス
-    """
-    q = []
-    max_idx = len(base_sql)
-    i = 0
-    tmp_params = tmp_params if tmp_params else {}
-    while i < max_idx and not _startswith_eop(base_sql, i, eop):
-        c, cc, i = _next_chars(base_sql, i, max_idx, eop)
-        c, i, del_last_sp = _parse_switch_by_char(base_sql, c, cc, i, qparams, delete_comment, tmp_params, after_pcmt,
-                                                  ldng_sp_cnt, prmfmt)
-        if del_last_sp:
-            q = _delete_last_space(q)
-        ldng_sp_cnt = _update_blank_line(ldng_sp_cnt, c)
-        q.append(c)
-
-    result = ''.join(q)
-    return result, ldng_sp_cnt, i
-
-
-def _parse_switch_by_char(base_sql: str, c: str, cc: str, i: int, qparams: dict, delete_comment: bool,
-                          tmp_params: dict, after_pcmt: bool, ldng_sp_cnt: int, prmfmt: str) -> (str, int, bool):
-    del_last_sp = False
-    if c in ("'", '"', '(', '[', '{'):
-        c, i = _nextstring(c, base_sql, i, qparams, delete_comment, after_pcmt)
-    elif cc == '--':
-        # 行コメント -- の場合
-        c, addi = _get_single_line_comment(base_sql[i - 1:], delete_comment)
-        i += addi - 1
-    elif cc == '/*':
-        # 複数行コメント /*...*/ の場合
-        c, addi, del_last_sp = _get_multi_line_comment(base_sql[i - 1:], qparams, delete_comment, tmp_params,
-                                                       ldng_sp_cnt, prmfmt)
-        i += addi - 1
-    return c, i, del_last_sp
-
-
-def _nxtchr(string: str, idx: int):
-    return string[idx], idx + 1
-
-
-def _fnd(string: str, target: str):
-    index = string.find(target)
-    return index if 0 <= index else len(string)
-
-
-def _next_chars(string: str, idx: int, mxidx: int, eop=None) -> (str, str, int):
-    targets = _FIND_TARGETS + eop if eop else _FIND_TARGETS
-    min_idx = min([_fnd(string[idx:], tgt) for tgt in targets])
-    if min_idx == 0:
-        c, i = _nxtchr(string, idx)
-        cc = f'{c}{string[i]}' if i < mxidx else None
-    else:
-        i = idx + min_idx
-        c = string[idx:i]
-        cc = c
-    return c, cc, i
-
-
-def _nextstring(c: str, base_sql: str, i: int, qparams: dict, delete_comment: bool, after_pcmt: bool) -> (str, int):
-    addi = 0
-    if c in ("'", '"'):
-        # ' か " の文字列の場合
-        c, addi = _nextquote(c, base_sql[i:])
-    elif after_pcmt and c in ('(', '[', '{'):
-        # パラメータ直後が括弧の場合
-        c, addi = _nextbracket(c, base_sql[i:], qparams, delete_comment)
-    return c, i + addi
-
-
-def _nextquote(quote: str, sql_after_quote: str) -> (str, int):
-    chars = [quote]
-    max_idx = len(sql_after_quote) - 1
-    addi = 0
-    while addi <= max_idx:
-        c, addi = _nxtchr(sql_after_quote, addi)
-        if c == quote:
-            # 2連続のクォート以外の場合、文字列はそこまで
-            if max_idx <= addi or sql_after_quote[addi + 1] != quote:
-                chars.append(c)
-                break
-            chars.append(c)
-            c, addi = _nxtchr(sql_after_quote, addi)
-        chars.append(c)
-    quote_string = ''.join(chars)
-    return quote_string, addi
-
-
-def _nextbracket(openbrkt: str, sql_after_brkt: str, qparams: dict, delete_comment: bool) -> (str, int):
-    closingbrkt = _BRACKET_PARE.get(openbrkt)
-
-    chars = [openbrkt]
-    max_idx = len(sql_after_brkt) - 1
-    addi = 0
-    while addi <= max_idx:
-        c, addi = _nxtchr(sql_after_brkt, addi)
-        chars.append(c)
-        if c == closingbrkt:
-            break
-    bracket_strings = ''.join(chars)
-    return bracket_strings, addi
-
-
-def _get_single_line_comment(sql_comment: str, delete_comment: bool) -> (str, int):
-    c, addi = _single_line_comment(sql_comment)
-    if delete_comment:
-        c = ''
-    return c, addi
-
-
-def _single_line_comment(sql_comment: str) -> (str, int):
-    # この関数が呼び出される時、文字列は必ず -- から始まる
-    maxlen = len(sql_comment)
-    new_line_idx = sql_comment.find(NEWLINE_CHAR)
-    new_line_idx = maxlen if new_line_idx < 0 else new_line_idx
-    comment_string = sql_comment[:new_line_idx]
-    return comment_string, new_line_idx
-
-
-def _get_multi_line_comment(sql_comment: str, qparams: dict, delete_comment: bool, tmp_params: dict,
-                            ldng_sp_cnt: int, prmfmt: str) -> (str, int, bool):
-    c, addi, is_comment, delete_last_sp = _multi_line_comment(sql_comment, qparams, delete_comment, tmp_params,
-                                                              ldng_sp_cnt, prmfmt)
-    if is_comment and delete_comment:
-        c = ''
-    return c, addi, delete_last_sp
-
-
-def _multi_line_comment(sql_comment: str, qparams: dict, delete_comment: bool, tmp_params: dict,
-                        ldng_sp_cnt: int, prmfmt: str) -> (str, int, bool):
-    # この関数が呼び出される時、文字列は必ず /* から始まる
-    cmtype, comment_string = _check_comment_type(sql_comment)
-    is_comment = False
-    del_last_sp = False
-    # ex: comment_string : "/*:parameter*/"
-    #     after_comment  : "'hogehoge' from xxx"
-    after_comment = sql_comment[len(comment_string):]
-    if cmtype is CommentType.PARAM:        # /*:param*/
-        comment_string, idx = _parse_param_comment(comment_string, after_comment, qparams, tmp_params, prmfmt)
-    elif cmtype is CommentType.DIRECT:     # /*$param*/
-        comment_string, idx = _parse_direct_comment(comment_string, after_comment, qparams, tmp_params, prmfmt)
-    elif cmtype is CommentType.IFEND:      # /*%if ~*/
-        # TODO: ELSE対応
-        comment_string, idx, del_last_sp = _parse_if_comment(
-            comment_string, after_comment, qparams, delete_comment, tmp_params, ldng_sp_cnt, prmfmt)
-    elif cmtype is CommentType.FOREND:     # /*%for ~*/
-        comment_string, idx, del_last_sp = _parse_for_comment(
-            comment_string, after_comment, qparams, delete_comment, tmp_params, ldng_sp_cnt, prmfmt)
-    elif cmtype is CommentType.NORMAL:
-        is_comment = True
-        idx = len(comment_string)
-    else:
-        raise TwspException(Msg.E0003, sql_comment)
-    return comment_string, idx, is_comment, del_last_sp
-
-
-def _parse_param_comment(comment_string: str, after_comment: str, qparams: dict, tmp_params: dict,
-                         prmfmt: str) -> (str, int):
+        Template: コンパイル済みのテンプレート
     """
+    _is_collect_type('base_sql', base_sql, str)
+    with instrument.timed(name, base_sql, 'lex'):
+        nodes, _ = _parse(base_sql, 0, delete_comment, newline)
+        nodes = number_for_nodes(nodes, itertools.count())
+    return Template(base_sql, nodes, delete_comment, newline, name)
+
+
+def compile_file(file_path: str, delete_comment=True, encoding='utf-8', newline='\n') -> Template:
+    """SQLファイルを読み込み、再利用可能なテンプレートを作成する
+
     Args:
-        comment_string (str): コメント部分の文字列
-            ex: /*:any_parameter*/
-        after_comment (str): コメント直後の文字列
+        file_path (str): 実行対象SQLのファイルパス(必須)
+        delete_comment (bool): True の場合、通常コメントを削除、 False の場合は削除しない (デフォルトは True)
+        encoding (str): 対象ファイルの文字コード デフォルトは utf-8
+        newline (str): 対象ファイルの改行コード (デフォルトは '\n')
     Returns:
-        tuple:
-            str:
-            int:
+        Template: コンパイル済みのテンプレート
     """
-    bind_name, _, load_len = _parse_simple_comment(comment_string, after_comment, qparams, tmp_params, prmfmt)
-    return bind_name, load_len
+    base_sql = _open_file(file_path, encoding=encoding)
+    return _compile_cache(base_sql, delete_comment, newline, file_path)
 
 
-def _parse_direct_comment(comment_string: str, after_comment: str, qparams: dict, tmp_params: dict,
-                          prmfmt: str) -> (str, int):
-    """
+def render_many(template: Template, params_iter, paramstyle: ParamStyle = None, batch_size=1000, copy_params=True,
+                in_buckets=None, render_cache=None):
+    """パラメータごとにSQLを構築し、同じSQLになるパラメータを executemany 用にまとめる
+
+    params_iter は1件ずつ読み込むため、ジェネレータを渡した場合も全件をメモリに展開しない。
+    同じSQLのパラメータが batch_size 件に達した時点で返し、残りは params_iter を読み終えた後に返す。
+    そのため、異なるSQLのバッチ間では params_iter の順序を保証しない。
+
     Args:
-        comment_string (str): コメント部分の文字列
-            ex: /*$any_parameter*/
-        after_comment (str): コメント直後の文字列
-        qparams (dict): SQL実行時に利用するパラメータ
+        template (Template): コンパイル済みのテンプレート
+        params_iter (iterable): SQL実行時に利用するパラメータ(dict)を返すイテラブル
+        paramstyle (ParamStyle): 解析後のSQLパラメータ書式を決める。未指定時は `NAMED` と同じ扱い
+        batch_size (int): 1バッチに含めるパラメータの最大件数
+        copy_params (bool): `parse_sql` 参照
+        in_buckets (InListBuckets): `parse_sql` 参照 IN 句の件数を揃えることで、同じSQLにまとまりやすくなる
+        render_cache (RenderCache): `parse_sql` 参照
     Returns:
-        tuple:
-            str:
-            int:
-    """
-    merged_params = _merge_qparams(qparams, tmp_params)
-    _, value, load_len = _parse_simple_comment(comment_string, after_comment, merged_params, {}, prmfmt)
-    return value, load_len
-
-
-def _parse_simple_comment(comment_string: str, after_comment: str, qparams: dict, tmp_params: dict,
-                          prmfmt: str) -> (str, str, int):
-    # comment_string: '/*:param*/' or '/*$param*/'
-    param_name = comment_string[3:-2]
-    bind_name, value = _update_qparams_if_exist_tmp(param_name, qparams, tmp_params, prmfmt)
-
-    dummy_value, _, _ = _parse(after_comment, {}, False, prmfmt, eop=_EOP_SIMPLE_PARAM, after_pcmt=True)
-    load_len = len(comment_string) + len(dummy_value)
-
-    return bind_name, value, load_len
-
-
-def _update_qparams_if_exist_tmp(param: str, qparams: dict, tmp_params: dict, prmfmt: str):
-    tmp_name = tmp_params.get(param, {}).get(_TN)
-    if _tmpp_is_dummy(tmp_params):
-        # tmp_paramsがダミーの場合
-        updated_bind_name = prmfmt.format(param)
-        updated_param_value = ''
-    elif tmp_name is not None:
-        updated_bind_name = prmfmt.format(tmp_name)
-        updated_param_value = tmp_params.get(param, {}).get(_VL)
-        qparams[tmp_name] = updated_param_value
-    else:
-        updated_bind_name = prmfmt.format(param)
-        updated_param_value = qparams.get(param)
-    return updated_bind_name, f'{updated_param_value}'
-
-
-def _parse_if_comment(comment_string: str, after_comment: str, qparams: dict, delete_comment: bool,
-                      tmp_params: dict, ldng_sp_cnt: int, prmfmt: str) -> (str, int, bool):
-    if_strings, after_idx, del_last_sp = _get_str_in_forif(after_comment, qparams, delete_comment, tmp_params,
-                                                           ldng_sp_cnt, prmfmt)
-    is_true = _execute_if_statement(comment_string[3:-2], qparams, tmp_params)
-    output_value = ''.join(if_strings) if is_true else ''
-    addi = len(comment_string) + after_idx
-    return output_value, addi, del_last_sp
-
-
-def _parse_for_comment(comment_string: str, after_comment: str, qparams: dict, delete_comment: bool,
-                       tmp_params: dict, ldng_sp_cnt: int, prmfmt: str) -> (str, int, bool):
-    # comment_string: /*%for x in list_obj*/
-    # after_comment: .*/*end*/
-    for_strings, after_idx, del_last_sp = [], 0, False
-    # 最後の1回はfor~endまでの文字数カウントのため、ダミーで空dictが返される
-    for tmp_params in _get_for_variable_names(comment_string, qparams, tmp_params):
-        _for_strings, after_idx, del_last_sp = _get_str_in_forif(after_comment, qparams, delete_comment, tmp_params,
-                                                                 ldng_sp_cnt, prmfmt)
-        for_strings.append(_for_strings)
-    # 最後の1ループ分は無視
-    output_value = ''.join(for_strings[:-1])
-    addi = len(comment_string) + after_idx
-    return output_value, addi, del_last_sp
-
-
-def _get_for_variable_names(for_comment: str, qparams: dict, tmp_params: dict) -> dict:
+        generator: (str, list) SQLと、そのSQLで実行するパラメータのリスト
     """
-    Args:
-        for_comment (str): '/*%for x in xxx*/'
-        qparams (dict):
-        tmp_params (dict):
-            ex1: {}
-            ex2:
-            ex3: {__DMY: True}
-    Returns:
+    pstyle = paramstyle or ParamStyle.NAMED
+    _validate_paramstyle(pstyle)
+    _is_collect_type('batch_size', batch_size, int)
+    # for 内のパラメータ名が毎回変わると同じSQLにならないため、 stable_bind_names は常に True とする
+    return _render_many(template, params_iter, pstyle, max(batch_size, 1), copy_params, in_buckets, render_cache)
 
-    """
-    vnames = [v.strip() for v in for_comment[7:-2].split(' in ')[0].split(',')]
-    merged_params = _merge_qparams(qparams, tmp_params)
-    vnames_str = ",".join(vnames)
-    for_statement = f'for {vnames_str} in []' if _tmpp_is_dummy(tmp_params) else for_comment[3:-2]
-    try:
-        values_list = eval(f'[({vnames_str}) {for_statement}]', {}, merged_params)
-    except Exception as e:
-        raise TwspExecuteError(Msg.E0008, e, for_statement)
-
-    prefix = str(uuid4()).replace('-', '_')
-    for tmp_variable in _enum_temp_variables(vnames, values_list, prefix):
-        yield {**tmp_params, **tmp_variable}
-    yield {_DMY: True}
-    # 変数名のリスト
-    # for a in range(3)なら
-    # -> {'a': {'tmpnm': 'xxxxxxxxxxxx_0_a', 'value': 0}}
-    # -> {'a': {'tmpnm': 'xxxxxxxxxxxx_1_a', 'value': 1}}
-    # -> {'a': {'tmpnm': 'xxxxxxxxxxxx_2_a', 'value': 2}}
-    # -> {__DMY: True}
-    # for a,b,c in zip(['A', 'b'], ['I', 'j'], ['X', 'y'])なら、
-    # -> {'a': {'tmpnm': 'xxxxxxxxxxxx_0_a', 'value': 'A'},
-    #     'b': {'tmpnm': 'xxxxxxxxxxxx_0_b', 'value': 'I'},
-    #     'c': {'tmpnm': 'xxxxxxxxxxxx_0_c', 'value': 'X'}}
-    # -> {'a': {'tmpnm': 'xxxxxxxxxxxx_1_a', 'value': 'b'},
-    #     'b': {'tmpnm': 'xxxxxxxxxxxx_1_b', 'value': 'j'},
-    #     'c': {'tmpnm': 'xxxxxxxxxxxx_1_c', 'value': 'y'}}
-    # -> {__DMY: True}
-
-
-def _enum_temp_variables(vnames: list, values_list: list, prefix: str):
-    if len(vnames) == 1:
-        for vi, values in enumerate(values_list):
-            vname = vnames[0]
-            tmp_name = _gen_tmp_name(vname, vi, prefix)
-            yield {vname: {_TN: tmp_name, _VL: values}}
-    else:
-        for vi, values in enumerate(values_list):
-            tmpdct = {}
-            for ni, vname in enumerate(vnames):
-                tmp_name = _gen_tmp_name(vname, vi, prefix)
-                tmpdct[vname] = {_TN: tmp_name, _VL: values[ni]}
-            yield tmpdct
-
-
-def _gen_tmp_name(vname: str, loop_count: int, prefix: str) -> str:
-    name = f'{prefix}_{loop_count}_{vname}'
-    return name
-
-
-def _get_str_in_forif(after_comment: str, qparams: dict, delete_comment: bool, tmp_params: dict,
-                      ldng_sp_cnt: int, prmfmt: str) -> (str, int, bool):
-    """
-    Args:
-        after_comment (str): /*%for ~*/または/*%if ~*/の直後に続く文字列
-        qparams (dict): パラメータ
-        delete_comment (bool):
-        tmp_params (dict):
-        ldng_sp_cnt (int):
-    Returns:
 
-    """
-    # for ~ end、や if ~ end に挟まれた文字を取得する
-    nextq, after_idx, del_last_sp = _nxtq_in_forif(after_comment, ldng_sp_cnt)
-    # 改行削除済みの場合、 ldng_sp_cnt は 0 から
-    ldng_sp_cnt = -1 if after_comment == nextq else 0
-    output_value, _, vlen = _parse(nextq, qparams, delete_comment, prmfmt, _EOP_END, tmp_params=tmp_params,
-                                   ldng_sp_cnt=ldng_sp_cnt)
-    nextq = nextq[vlen:]
-    after_idx += vlen
+def _render_many(template: Template, params_iter, pstyle: ParamStyle, batch_size: int, copy_params: bool,
+                 in_buckets, render_cache):
+    pending = {}
+    for query_params in params_iter:
+        sql, qparams = template.render(query_params, pstyle, True, copy_params, in_buckets, render_cache)
+        batch = pending.setdefault(sql, [])
+        batch.append(qparams)
+        if batch_size <= len(batch):
+            yield sql, pending.pop(sql)
+    yield from pending.items()
 
-    output_value, addi = _end_in_forif(output_value, nextq)
-    after_idx += addi
-    return output_value, after_idx, del_last_sp
 
+def _parse(base_sql: str, idx: int, delete_comment: bool, newline: str, in_block=False,
+           in_if=False) -> (tuple, int):
+    """ SQLを解析してノードを構築する
+
+    Args:
+        base_sql (str): 元となるSQL
+        idx (int): 解析を開始する位置
+        delete_comment (bool): コメント削除フラグ
+        newline (str): SQLに含まれる改行コード
+        in_block (bool): if/for の内側の場合 True 、 /*end*/ の位置で解析を終了する
+        in_if (bool): if の内側の場合 True 、 /*%elif ~*/ 、 /*%else*/ の位置でも解析を終了する
+
+    Returns:
+        tuple:
+            tuple: 構築したノード
+            int: return時のインデックス
+    """
+    items = []
+    max_idx = len(base_sql)
+    stops = _IF_STOPS if in_if else _BLOCK_STOPS if in_block else ()
+    while idx < max_idx:
+        token_type, end = next_token(base_sql, idx, newline)
+        if token_type in stops:
+            break
+        item, idx = _TOKEN_PARSERS[token_type](base_sql, idx, end, delete_comment, newline)
+        items.append(item)
+    return build_nodes(items, newline), idx
 
-def _nxtq_in_forif(nextq: str, ldng_sp_cnt: int) -> (str, int, bool):
-    if 0 <= ldng_sp_cnt:
-        nlidx = nextq.find(NEWLINE_CHAR) + 1
-        if nextq[:nlidx].strip() == '':
-            return nextq[nlidx:], nlidx, True
-    return nextq, 0, False
 
+def _parse_text(base_sql: str, idx: int, end: int, delete_comment: bool, newline: str) -> (str, int):
+    return base_sql[idx:end], end
 
-def _end_in_forif(output_value: str, nextq: str) -> (str, int):
-    # /*end*/が見つからずSQLの末尾に到達した場合
-    if not nextq:
-        return output_value, 0
-    # nextq: '/*end*/\n   order by ~'
-    # /*end*/ でsplitするのは1回のみ
-    target_last_line = output_value.split(NEWLINE_CHAR)[-1]
-    next_first_line = nextq.split(NEWLINE_CHAR, 1)[0]
-    sp_stripped = f'{target_last_line}{next_first_line}'.strip(' ')
-    if sp_stripped == _END:
-        # /*end*/の行に含まれる文字がスペースのみの場合、次の行から読み込ませる
-        newline_len = len(NEWLINE_CHAR)
-        output_idx = len(output_value) - len(target_last_line)
-        forif_string = output_value[:output_idx]
-        add_idx = len(next_first_line) + newline_len
-        return forif_string, add_idx
-    else:
-        # /*end*/までの文字数を返す len('/*end*/')
-        return output_value, 7
-
-
-def _is_continue(string: str, end_str: str):
-    if not string or string.startswith(end_str):
-        return False
-    return True
-
-
-def _execute_if_statement(statement: str, qparams: dict, tmp_params: dict) -> bool:
-    # statement: "if BOOL_EXPRESSION"
-    if _tmpp_is_dummy(tmp_params):
-        return True
-    try:
-        tparams = {}
-        for key, value in _tmpp_items(tmp_params):
-            tparams[key] = value
-        is_true = eval(f'True {statement} else False', {}, {**qparams, **tparams})
-    except NameError as e:
-        raise TwspExecuteError(Msg.E0005, e, statement)
-    if type(is_true) != bool:
-        raise TwspExecuteError(Msg.E0006, statement)
-    return is_true
-
-
-def _check_comment_type(sql_after_comment: str) -> (CommentType, str):
-    # /*:param*/                    -> :param       利用できる文字は英数字とアンダースコア
-    # /*$param*/                    -> {param}      利用できる文字は英数字とアンダースコア
-    # /*%if a == b*/hoge/*end*/     -> 条件がTrueの場合、/*end*/までに挟まれた部分が出力
-    # /*%for a in b*/and a /*end*/  -> and a and a and a and a ... iterate by b
-    # other patterns are multi line comment.
-    for ctyp in CommentType:
-        matched = ctyp.value.findall(sql_after_comment)
-        if len(matched) > 0:
-            return ctyp, matched[0]
-
-
-def __get_cache_maxsize() -> int:
-    default_size = 20
-    env_size = os.getenv('TWSP_CACHE_SIZE')
-    try:
-        size = int(env_size)
-    except Exception:
-        size = None
-    return size if size else default_size
 
+def _parse_comment(base_sql: str, idx: int, end: int, delete_comment: bool, newline: str) -> (str, int):
+    # 通常コメント、 if/for の外側にある /*end*/ 、または if の外側にある /*%elif ~*/ 、 /*%else*/
+    return '' if delete_comment else base_sql[idx:end], end
 
-@lru_cache(maxsize=__get_cache_maxsize())
-def _open_file(file_path, encoding='utf-8'):
-    _is_collect_type('file_path', file_path, str)
-    if not _is_absolute(file_path):
-        raise TwspValidateError(Msg.E0002, file_path)
-    with open(file_path, 'r', encoding=encoding) as f:
-        return f.read()
 
+def _parse_param_comment(base_sql: str, idx: int, end: int, delete_comment: bool, newline: str) -> (ParamNode, int):
+    # /*:param*/ の直後に続くダミー値は読み飛ばす
+    name = base_sql[idx + 3:end - 2]
+    if name.endswith('[]'):
+        # /*:param[]*/ は配列として1つのパラメータで渡す
+        return ParamNode(name[:-2], False, True), dummy_end(base_sql, end)
+    return ParamNode(name, False, False), dummy_end(base_sql, end)
 
-def _is_absolute(path):
-    p = pathlib.Path(path)
-    return p.is_absolute()
 
+def _parse_direct_comment(base_sql: str, idx: int, end: int, delete_comment: bool,
+                          newline: str) -> (DirectNode, int):
+    # /*$param*/ の直後に続くダミー値は読み飛ばす
+    return DirectNode(base_sql[idx + 3:end - 2]), dummy_end(base_sql, end)
 
-def _is_collect_type(argname, value, expected_type):
-    if type(value) != expected_type:
-        raise TwspValidateError(Msg.E0001, argname, expected_type, type(value))
 
+def _parse_if_comment(base_sql: str, idx: int, end: int, delete_comment: bool, newline: str) -> (IfNode, int):
+    # base_sql[idx:end]: /*%if xxx*/
+    # /*%elif xxx*/ 、 /*%else*/ が続く場合は分岐ごとに IfNode を作成し、最初の分岐の orelse とする
+    branches, end_idx = _parse_if_branches(base_sql, base_sql[idx + 3:end - 2], end, delete_comment, newline)
+    tail_skip, after_idx = _tail_skip(base_sql, end_idx, newline)
+    nodes = tuple(IfNode(statement, body, head_skip, tail_skip, block_end_skip(body, head_skip, tail_skip, newline),
+                         ()) for statement, body, head_skip in branches)
+    return nodes[0]._replace(orelse=nodes[1:]), after_idx
 
-def _startswith_eop(base_sql: str, i: int, eop: list) -> bool:
-    if not eop:
-        return False
-    for e in eop:
-        if base_sql[i:].startswith(f'{e}'):
-            return True
-    return False
 
+def _parse_if_branches(base_sql: str, statement: str, idx: int, delete_comment: bool, newline: str) -> (list, int):
+    """
+    Args:
+        base_sql (str): 元となるSQL
+        statement (str): 最初の分岐の条件 "if xxx"
+        idx (int): /*%if ~*/の直後の位置
+        delete_comment (bool):
+        newline (str):
+    Returns:
+        tuple:
+            list: 分岐ごとの (条件, 本文のノード, if/elif/else の行を削除する場合に読み飛ばす文字数)
+                /*%elif xxx*/ の条件は "if xxx" 、 /*%else*/ の条件は None
+            int: /*end*/ の位置
+    """
+    branches = []
+    max_idx = len(base_sql)
+    while True:
+        head_skip = _head_skip(base_sql, idx, newline)
+        body, end_idx = _parse(base_sql, idx, delete_comment, newline, in_block=True, in_if=True)
+        branches.append((statement, body, head_skip))
+        token_type, idx = next_token(base_sql, end_idx, newline) if end_idx < max_idx else (None, max_idx)
+        if token_type not in (TokenType.ELIF, TokenType.ELSE):
+            return branches, end_idx
+        if statement is None:
+            raise TwspException(Msg.E0014, base_sql[end_idx:idx])
+        # /*%elif xxx*/ -> "if xxx"
+        statement = f'if{base_sql[end_idx + 7:idx - 2]}' if token_type is TokenType.ELIF else None
+
+
+def _parse_for_comment(base_sql: str, idx: int, end: int, delete_comment: bool, newline: str) -> (ForNode, int):
+    # base_sql[idx:end]: /*%for x in list_obj*/
+    body, head_skip, tail_skip, after_idx = _parse_forif_block(base_sql, end, delete_comment, newline)
+    for_statement = base_sql[idx + 3:end - 2]
+    vnames = tuple(v.strip() for v in for_statement[4:].split(' in ')[0].split(','))
+    end_skip = block_end_skip(body, head_skip, tail_skip, newline)
+    return ForNode(None, vnames, for_statement, body, head_skip, tail_skip, end_skip, False), after_idx
+
+
+def _parse_forif_block(base_sql: str, idx: int, delete_comment: bool, newline: str) -> (tuple, int, int, int):
+    """
+    Args:
+        base_sql (str): 元となるSQL
+        idx (int): /*%for ~*/または/*%if ~*/の直後の位置
+        delete_comment (bool):
+        newline (str):
+    Returns:
+        tuple:
+            tuple: for ~ end、や if ~ end に挟まれたノード
+            int or None: if/for の行を削除する場合に読み飛ばす文字数
+            int or None: /*end*/ の行を削除する場合に読み飛ばす文字数
+            int: /*end*/ の直後の位置
+    """
+    head_skip = _head_skip(base_sql, idx, newline)
+    body, end_idx = _parse(base_sql, idx, delete_comment, newline, in_block=True)
+    tail_skip, after_idx = _tail_skip(base_sql, end_idx, newline)
+    return body, head_skip, tail_skip, after_idx
 
-def _update_blank_line(ldng_sp_cnt: int, c: str) -> int:
-    if not c:
-        return ldng_sp_cnt
 
-    ridx = c.rfind(NEWLINE_CHAR)
-    if ldng_sp_cnt < 0 and ridx < 0 == 1:
-        return -1
-    after_nl = c[ridx + 1:]
-    if after_nl.lstrip(' ') == '':
-        # 改行後、全部スペースの場合
-        return len(after_nl)
-    else:
-        return -1
+def _head_skip(base_sql: str, idx: int, newline: str):
+    # if/for コメントの後ろが空白のみの場合、改行までを読み飛ばし候補とする
+    nlidx = base_sql.find(newline, idx) + 1
+    if nlidx == 0:
+        return 0
+    if base_sql[idx:nlidx].strip() == '':
+        return nlidx - idx
+    return None
 
 
-def _delete_last_space(q: list) -> list:
-    idx = len(q) - 1
-    while -1 < idx:
-        idx_str = q[idx].rstrip(' ')
-        if idx_str:
-            q[idx] = idx_str
-            break
-        del q[idx]
-        idx -= 1
-    return q
+def _tail_skip(base_sql: str, idx: int, newline: str) -> (int, int):
+    # /*end*/が見つからずSQLの末尾に到達した場合
+    max_idx = len(base_sql)
+    if max_idx <= idx:
+        return None, max_idx
+    after_end = idx + len(_END)
+    line_end = base_sql.find(newline, after_end)
+    line_end = max_idx if line_end < 0 else line_end
+    if base_sql[after_end:line_end].strip(' ') == '':
+        # /*end*/の行に含まれる文字がスペースのみの場合、次の行の先頭までを読み飛ばし候補とする
+        return line_end - after_end + len(newline), after_end
+    return None, after_end
+
+
+# if/for の本文の解析を終了するトークン
+_BLOCK_STOPS = (TokenType.END, )
+_IF_STOPS = (TokenType.END, TokenType.ELIF, TokenType.ELSE)
+
+_TOKEN_PARSERS = {
+    TokenType.TEXT: _parse_text,
+    TokenType.QUOTE: _parse_text,
+    TokenType.BRACKET: _parse_text,
+    TokenType.LINE_COMMENT: _parse_comment,
+    TokenType.PARAM: _parse_param_comment,
+    TokenType.DIRECT: _parse_direct_comment,
+    TokenType.IFEND: _parse_if_comment,
+    TokenType.FOREND: _parse_for_comment,
+    TokenType.ELIF: _parse_comment,
+    TokenType.ELSE: _parse_comment,
+    TokenType.END: _parse_comment,
+    TokenType.NORMAL: _parse_comment,
+}
 
 
-# #######################################
-# temp_params
-# #######################################
-def _tmpp_is_dummy(tmpp: dict) -> bool:
-    return True if tmpp.get(_DMY) is True else False
+def _open_file(file_path, encoding='utf-8'):
+    _is_collect_type('file_path', file_path, str)
+    if not _is_absolute(file_path):
+        raise TwspValidateError(Msg.E0002, file_path)
+    with instrument.timed(file_path, None, 'load'):
+        return file_cache.read(file_path, encoding)
 
 
-def _tmpp_items(tmpp: dict) -> (any, any):
-    for key, v in tmpp.items():
-        value = v.get(_VL)
-        yield key, value
+def file_cache_info() -> FileCacheInfo:
+    """SQLファイルのキャッシュ状況を返す
 
+    Returns:
+        FileCacheInfo: hits, misses, evictions, reloads, currsize, currbytes
+    """
+    return file_cache.info()
 
-def _merge_qparams(qparams: dict, tmp_params: dict) -> dict:
-    if _tmpp_is_dummy(tmp_params):
-        return {**qparams}
 
-    merged_params = {**qparams}
-    for key, value in _tmpp_items(tmp_params):
-        merged_params[key] = value
-    return merged_params
+@lru_cache(maxsize=get_cache_maxsize('TWSP_CACHE_SIZE', 20))
+def _compile_cache(base_sql: str, delete_comment: bool, newline: str, name: str = None) -> Template:
+    return compile(base_sql, delete_comment, newline, name)
 
 
-def _validate_paramstyle(paramstyle):
-    if (not isinstance(paramstyle, ParamStyle)) or paramstyle not in ParamStyle:
-        ps = [f'{p.__class__.__name__}.{p.name}' for p in ParamStyle]
-        raise TwspValidateError(Msg.E0009, f'{", ".join(ps[:-1])}', ps[-1], paramstyle)
-    return True
+def _is_absolute(path):
+    p = pathlib.Path(path)
+    return p.is_absolute()